@@ -28,6 +28,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myapp.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,6 +76,9 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static_in_env')]
 VENV_PATH = os.path.dirname(BASE_DIR)
 STATIC_ROOT =os.path.join(VENV_PATH, 'static')
+# serve collected, precompressed static files from django itself, for
+# deployments without a web server in front (see myapp/staticfiles.py)
+SERVE_STATIC = False
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(VENV_PATH, 'media')
 
@@ -94,4 +98,67 @@ LOGIN_REDIRECT_URL = '/'
 
 # CRISPY FORMS
 
-CRISPY_TEMPLATE_PACK = 'bootstrap4'
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+# CACHE
+# local memory by default, point CACHE_BACKEND/CACHE_LOCATION at memcached
+# or redis in production so every worker shares the same entries
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='ecomm'),
+    }
+}
+
+# SESSIONS
+# read from the cache above, the database row is rewritten on login/logout
+# or once SESSION_DB_WRITE_INTERVAL seconds have passed since the last write.
+# Messages that don't fit their cookie fall back to the session, so they
+# only cost a cache write. Only with a shared cache: on the local memory
+# default every worker would keep its own copy, so sessions then go straight
+# to the database. Expired rows are removed by clear_expired_sessions
+
+SESSION_ENGINE = 'myapp.sessions'
+SESSION_DB_WRITE_INTERVAL = config('SESSION_DB_WRITE_INTERVAL', default=60, cast=int)
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
+
+# PAGE CACHE
+# home, all products, category and product pages are cached whole and shared
+# by every visitor, signed in shoppers fill in their navbar and wishlist
+# hearts from the user_fragments view. A page is fresh for PAGE_CACHE_TIMEOUT
+# seconds or until an item or category changes, then it is served stale for
+# up to PAGE_CACHE_STALE more seconds while one request renders it again
+
+PAGE_CACHE_ENABLED = config('PAGE_CACHE_ENABLED', default=True, cast=bool)
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=300, cast=int)
+PAGE_CACHE_STALE = config('PAGE_CACHE_STALE', default=3600, cast=int)
+
+# FRAGMENT CACHE
+# product page fragments are keyed by the item version. FRAGMENT_CACHE_STATS
+# counts their hits and misses for fragment_cache_stats, that costs two cache
+# writes per fragment render so leave it off outside of profiling
+
+FRAGMENT_CACHE_STATS = config('FRAGMENT_CACHE_STATS', default=False, cast=bool)
+
+# INSTRUMENTATION
+# requests slower than SLOW_REQUEST_MS are written with their SQL to a
+# rotating JSON lines log and request_stats prints per view percentiles.
+# SERVER_TIMING adds a Server-Timing header (db, template, view, total) to
+# every response, it tells anyone how many queries a page runs so it is off
+# unless turned on for profiling
+
+SERVER_TIMING = config('SERVER_TIMING', default=False, cast=bool)
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=500, cast=int)
+SLOW_REQUEST_SAMPLE_RATE = config('SLOW_REQUEST_SAMPLE_RATE', default=1.0, cast=float)
+#queries at least this slow are logged with the stack that ran them
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=20, cast=int)
+SLOW_REQUEST_LOG = config('SLOW_REQUEST_LOG', default=os.path.join(BASE_DIR, 'logs', 'slow_requests.jsonl'))
+SLOW_REQUEST_LOG_BYTES = 10 * 1024 * 1024
+SLOW_REQUEST_LOG_BACKUPS = 5
+
+# PAYMENTS
+# charges are sent by the process_payments worker, point STRIPE_API_BASE at
+# the fake_stripe command to run checkout offline
+
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
@@ -31,5 +31,10 @@ DATABASES = {
 }
 
 
+# fingerprinted, gzip/brotli precompressed files written by collectstatic
+STATICFILES_STORAGE = 'myapp.staticfiles.CompressedManifestStaticFilesStorage'
+SERVE_STATIC = config('SERVE_STATIC', default=False, cast=bool)
+
+
 STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
\ No newline at end of file
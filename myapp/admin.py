@@ -1,97 +1,231 @@
 from django.contrib import admin
-from .models import Item, OrderItem, Order, BilingAddress, UserProfile, Payment, CheckZipcode, WishlistedItem, Wishlish, DiscountCode, Category, Refund
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from . import search
+from .exports import EXPORTS, FORMATS, export_queryset, export_lines, export_filename
+from .pagination import EstimatedCountPaginator
+from .models import Item, OrderItem, Order, BilingAddress, UserProfile, Payment, CheckZipcode, WishlistItem, DiscountCode, Category, Refund, PaymentAttempt, OrderStatusChange
 # Register your models here.
-admin.site.register(OrderItem)
 admin.site.register(UserProfile)
-admin.site.register(WishlistedItem)
-admin.site.register(Wishlish)
-admin.site.register(Category)
-admin.site.register(Refund)
 
 
-class ItemDisplayAdmin(admin.ModelAdmin):
+class IndexedSearchMixin:
+    #search, and the autocomplete lookups built on it, only on what an index
+    #can answer: a prefix of the prefix_search_fields (startswith uses the
+    #index, icontains reads every row) and products from the search index
+    prefix_search_fields = ()
+    #the Item a row is about, 'pk' for items themselves
+    item_search_field = None
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q()
+        for field in self.prefix_search_fields:
+            condition |= Q(**{f'{field}__startswith': term})
+        if self.item_search_field:
+            condition |= Q(**{f'{self.item_search_field}__in': search.matching_items(term)})
+        #autocomplete results are printed with str(), which follows the same relations as the changelist
+        if isinstance(self.list_select_related, (list, tuple)):
+            queryset = queryset.select_related(*self.list_select_related)
+        return queryset.filter(condition), False
+
+
+class UserSearchAdmin(IndexedSearchMixin, UserAdmin):
+    #the email prefix is answered by the index from migration 0020
+    prefix_search_fields = ('username', 'email')
+    search_fields = ('username', 'email')
+
+admin.site.unregister(User)
+admin.site.register(User, UserSearchAdmin)
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('title', 'slug')
+    search_fields = ('title',)
+    ordering = ('title',)
+
+admin.site.register(Category, CategoryAdmin)
+
+
+class ItemDisplayAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('title', 'list_on_frontpage')
     list_filter = ('category',)
-    search_fields = ('title', 'category', 'description', 'slug')
+    search_fields = ('title', 'slug')
+    item_search_field = 'pk'
+    prefix_search_fields = ('slug',)
+    autocomplete_fields = ('category',)
+    ordering = ('-id',)
 
 admin.site.register(Item, ItemDisplayAdmin)
 
 
+class OrderItemAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ('item', 'user', 'quantity', 'ordered')
+    list_select_related = ('item', 'user')
+    search_fields = ('item__title', 'user__username')
+    item_search_field = 'item'
+    prefix_search_fields = ('user__username',)
+    raw_id_fields = ('item', 'user')
+    ordering = ('-id',)
+
+admin.site.register(OrderItem, OrderItemAdmin)
+
+
+class WishlistItemAdmin(admin.ModelAdmin):
+    list_display = ('item', 'user', 'added')
+    list_select_related = ('item', 'user')
+    autocomplete_fields = ('item', 'user')
+
+admin.site.register(WishlistItem, WishlistItemAdmin)
+
+
+def stream_export(kind, fmt, queryset):
+    #rows are written as they are read, nothing is built up in memory
+    response = StreamingHttpResponse(export_lines(kind, fmt, export_queryset(kind, queryset)), content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(kind, fmt)}"'
+    return response
+
+
+def export_action(kind, fmt, description):
+    def export(modeladmin, request, queryset):
+        if kind == 'order-items':
+            queryset = EXPORTS[kind]['model'].objects.filter(order__in=queryset)
+        return stream_export(kind, fmt, queryset)
+
+    export.__name__ = f"export_{kind.replace('-', '_')}_{fmt}"
+    export.short_description = description
+    return export
+
+
 class PaymentAdminDisplay(admin.ModelAdmin):
     list_display = ('user', 'stripe_charge_id', 'amount')
     search_fields = ('user__username', 'stripe_charge_id')
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [export_action('payments', 'csv', 'Export selected payments as CSV'),
+               export_action('payments', 'jsonl', 'Export selected payments as JSON lines')]
 
 admin.site.register(Payment, PaymentAdminDisplay)
 
 
+class PaymentAttemptAdmin(admin.ModelAdmin):
+    list_display = ('idempotency_key', 'user', 'amount', 'status', 'attempts', 'next_attempt_at', 'charge_id', 'error', 'created')
+    list_filter = ('status',)
+    search_fields = ('idempotency_key', 'user__username')
+    raw_id_fields = ('order', 'user', 'payment')
+
+admin.site.register(PaymentAttempt, PaymentAttemptAdmin)
+
+
+def apply_transition(modeladmin, request, queryset, status):
+    #chunked bulk update, orders that can't reach the status are left alone
+    selected = queryset.count()
+    moved = queryset.transition(status, user=request.user)
+    message = f'{moved} orders updated'
+    if selected > moved:
+        message += f', {selected - moved} skipped because their status does not allow it'
+    modeladmin.message_user(request, message)
+
+
 def make_refund_accepted(modeladmin, request, queryset):
-    queryset.update(refund_requested=False, refund_granted=True)
+    apply_transition(modeladmin, request, queryset, 'refund_granted')
 
 make_refund_accepted.short_description = 'Update orders to refund granted'
 
 def make_order_is_shipped(modeladmin, request, queryset):
-    queryset.update(in_transit=False, shipped=True)
+    apply_transition(modeladmin, request, queryset, 'shipped')
 
 make_order_is_shipped.short_description = 'Update order from in transit to shipped'
 
 
 def make_order_is_out_for_delivery(modeladmin, request, queryset):
-    queryset.update(shipped=False, out_for_delivery=True)
+    apply_transition(modeladmin, request, queryset, 'out_for_delivery')
 
 make_order_is_out_for_delivery.short_description = 'Update order shipped to out for delivery'
 
 
 def make_order_is_delivered(modeladmin, request, queryset):
-    queryset.update(out_for_delivery=False, delivered=True)
+    apply_transition(modeladmin, request, queryset, 'delivered')
 
 make_order_is_delivered.short_description = 'Update order out for delivery to delivered'
 
 def make_order_is_returned(modeladmin, request, queryset):
-    queryset.update(delivered=False, returned=True)
+    apply_transition(modeladmin, request, queryset, 'returned')
 
 make_order_is_returned.short_description = 'Update order from delivered to return'
 
 
-class BilingAddressAdmin(admin.ModelAdmin):
+class BilingAddressAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('user', 'country', 'zipcode', 'address_type')
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    prefix_search_fields = ('user__username',)
+    autocomplete_fields = ('user',)
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 admin.site.register(BilingAddress, BilingAddressAdmin)
 
 
-class OrderAdminDisplay(admin.ModelAdmin):
+class OrderStatusChangeInline(admin.TabularInline):
+    model = OrderStatusChange
+    fields = ('from_status', 'to_status', 'changed_by', 'timestamp')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class OrderAdminDisplay(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('user',
                     'order_id',
                     'ordered', 
                     'billing_address', 
                     'payment',
                     'coupon',
-                    'in_transit',
-                    'shipped',
-                    'out_for_delivery',
-                    'delivered',
-                    'returned',
-                    'canceled',
-                    'refund_requested',
-                    'refund_granted',)
+                    'status',)
     list_display_links = ('user',
                             'billing_address',
                             'payment',
                             'coupon')
     list_filter = ('ordered', 
-                    'in_transit',
-                    'shipped',
-                    'out_for_delivery',
-                    'delivered',
-                    'returned',
-                    'canceled',
-                    'refund_requested',
-                    'refund_granted')
+                    'status')
     search_fields = ('user__username', 'order_id')
-    actions = [make_refund_accepted, make_order_is_shipped, make_order_is_out_for_delivery, make_order_is_delivered, make_order_is_returned]
+    prefix_search_fields = ('order_id', 'user__username')
+    autocomplete_fields = ('items', 'user', 'billing_address')
+    ordering = ('-id',)
+    #billing_address and payment print their user's name
+    list_select_related = ('user', 'billing_address__user', 'payment__user', 'coupon')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    #status only changes through the actions so every change is recorded
+    readonly_fields = ('status',)
+    inlines = [OrderStatusChangeInline]
+    actions = [make_refund_accepted, make_order_is_shipped, make_order_is_out_for_delivery, make_order_is_delivered, make_order_is_returned,
+               export_action('orders', 'csv', 'Export selected orders as CSV'),
+               export_action('orders', 'jsonl', 'Export selected orders as JSON lines'),
+               export_action('order-items', 'csv', 'Export items of selected orders as CSV'),
+               export_action('order-items', 'jsonl', 'Export items of selected orders as JSON lines')]
 
 admin.site.register(Order, OrderAdminDisplay)
 
 
+class RefundAdmin(admin.ModelAdmin):
+    list_display = ('order', 'email', 'refund_accepted')
+    list_select_related = ('order__user',)
+    autocomplete_fields = ('order',)
+
+admin.site.register(Refund, RefundAdmin)
+
+
 class CheckZipcodeForDelivery(admin.ModelAdmin):
     search_fields = ('zipcode',)
 
@@ -99,7 +233,9 @@ admin.site.register(CheckZipcode, CheckZipcodeForDelivery)
 
 
 class DiscountCodeAdmin(admin.ModelAdmin):
-    list_display = ('promo_code', 'amount', 'description')
+    list_display = ('promo_code', 'amount', 'description', 'active', 'valid_from', 'valid_until', 'min_subtotal', 'times_used', 'max_uses')
+    list_filter = ('active',)
     search_fields = ('promo_code',)
+    readonly_fields = ('times_used',)
 
 admin.site.register(DiscountCode, DiscountCodeAdmin)
\ No newline at end of file
@@ -0,0 +1,152 @@
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+
+CART_COUNT_TIMEOUT = 60 * 60
+
+
+def cart_count_key(user_id):
+    return f'cart-count:{user_id}'
+
+
+def get_cart_count(user):
+    #memoized on the user object for the rest of the request, backed by a
+    #per-user cache entry the cart views clear whenever the cart changes
+    if not hasattr(user, '_cart_count'):
+        key = cart_count_key(user.pk)
+        count = cache.get(key)
+        if count is None:
+            count = Order.items.through.objects.filter(order__user=user, order__ordered=False).count()
+            cache.set(key, count, CART_COUNT_TIMEOUT)
+        user._cart_count = count
+    return user._cart_count
+
+
+def invalidate_cart_count(user):
+    #clear after commit so a concurrent request can't cache the old count again
+    if hasattr(user, '_cart_count'):
+        del user._cart_count
+    key = cart_count_key(user.pk)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+#cart mutations. There is at most one open order per user and one open
+#OrderItem per (user, item), both enforced by conditional unique
+#constraints declared on the models, so
+#concurrent requests can't create duplicates: quantities move with F()
+#updates and inserts that lose a race fall back to the update
+def get_open_order(user, create=False):
+    try:
+        return Order.objects.get(user=user, ordered=False)
+    except Order.DoesNotExist:
+        if not create:
+            return None
+    try:
+        with transaction.atomic():
+            return Order.objects.create(user=user, ordered_date=timezone.now())
+    except IntegrityError:
+        return Order.objects.get(user=user, ordered=False)
+
+
+def open_lines(user):
+    return OrderItem.objects.filter(user=user, ordered=False)
+
+
+def create_line(user, order, item_id, quantity, replace=False):
+    #inserts an open line, when a concurrent request inserted it first the
+    #quantity is added to that one, or set with replace
+    try:
+        with transaction.atomic():
+            line = OrderItem.objects.create(user=user, item_id=item_id, quantity=quantity)
+            Order.items.through.objects.create(order=order, orderitem=line)
+    except IntegrityError:
+        open_lines(user).filter(item_id=item_id).update(quantity=quantity if replace else F('quantity') + quantity)
+
+
+def add_item(user, item, quantity=1):
+    with transaction.atomic():
+        order = get_open_order(user, create=True)
+        if not open_lines(user).filter(item=item).update(quantity=F('quantity') + quantity):
+            create_line(user, order, item.pk, quantity)
+        order.update_totals()
+    invalidate_cart_count(user)
+    return order
+
+
+def remove_item(user, item):
+    #returns False when the item was not in the cart
+    with transaction.atomic():
+        deleted, _ = open_lines(user).filter(item=item).delete()
+        if deleted:
+            Order.objects.filter(user=user, ordered=False).update_totals()
+    if deleted:
+        invalidate_cart_count(user)
+    return bool(deleted)
+
+
+def remove_single_item(user, item):
+    #one less of the item, the line goes away with its last unit
+    with transaction.atomic():
+        lines = open_lines(user).filter(item=item)
+        changed = lines.filter(quantity__gt=1).update(quantity=F('quantity') - 1)
+        removed = 0
+        if not changed:
+            removed, _ = lines.delete()
+        if changed or removed:
+            Order.objects.filter(user=user, ordered=False).update_totals()
+    if removed:
+        invalidate_cart_count(user)
+    return bool(changed or removed)
+
+
+def set_quantities(user, quantities, replace=False):
+    #{item_id: quantity} in a handful of queries whatever the number of
+    #items: adds to the current quantities, or sets them when replace is
+    #True, a resulting quantity of 0 or less removes the line
+    with transaction.atomic():
+        order = get_open_order(user, create=True)
+        existing = {
+            line.item_id: line
+            for line in open_lines(user).select_for_update().filter(item_id__in=quantities)
+        }
+        new_quantities = {}
+        for item_id, quantity in quantities.items():
+            line = existing.get(item_id)
+            if line is None:
+                if quantity > 0:
+                    new_quantities[item_id] = quantity
+                continue
+            line.quantity = quantity if replace else line.quantity + quantity
+
+        to_delete = [line.pk for line in existing.values() if line.quantity <= 0]
+        to_update = [line for line in existing.values() if line.quantity > 0]
+        if to_delete:
+            OrderItem.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            OrderItem.objects.filter(pk__in=[line.pk for line in to_update]).update(quantity=Case(
+                *[When(pk=line.pk, then=Value(line.quantity)) for line in to_update],
+                output_field=IntegerField()
+            ))
+        if new_quantities:
+            try:
+                with transaction.atomic():
+                    OrderItem.objects.bulk_create([
+                        OrderItem(user=user, item_id=item_id, quantity=quantity)
+                        for item_id, quantity in new_quantities.items()
+                    ])
+                    #bulk_create doesn't return primary keys on every database
+                    created = open_lines(user).filter(item_id__in=new_quantities).values_list('pk', flat=True)
+                    Order.items.through.objects.bulk_create([
+                        Order.items.through(order_id=order.pk, orderitem_id=pk) for pk in created
+                    ])
+            except IntegrityError:
+                #a concurrent add_item inserted one of the lines first
+                for item_id, quantity in new_quantities.items():
+                    create_line(user, order, item_id, quantity, replace)
+        order.update_totals()
+    invalidate_cart_count(user)
+    return order
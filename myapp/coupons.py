@@ -0,0 +1,104 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import DiscountCode, CouponUsage
+from .snapshots import VersionedSnapshot
+
+
+VERSION_KEY = 'coupon-rules-version'
+
+
+class CouponError(Exception):
+    pass
+
+
+def normalize(code):
+    #promo codes match exactly, SAVE10 and save10 can be two different
+    #codes. Only the stray whitespace of a pasted code is dropped
+    return (code or '').strip()
+
+
+def snapshot_queryset():
+    #reads every active code at once, explain_hot_queries allows this
+    #one query to scan the table
+    return DiscountCode.objects.filter(active=True)
+
+
+def load_coupons():
+    #every active code keyed by its promo code. times_used in
+    #here goes stale, the limits are enforced by reserve_coupon
+    return {normalize(coupon.promo_code): coupon for coupon in snapshot_queryset()}
+
+
+_snapshot = VersionedSnapshot(VERSION_KEY, load_coupons)
+
+
+def invalidate():
+    _snapshot.invalidate()
+
+
+def find_coupon(code):
+    return _snapshot.get().get(normalize(code))
+
+
+def check_coupon(coupon, subtotal, now=None):
+    #the rules that don't need the database, raises CouponError
+    now = now or timezone.now()
+    if coupon.valid_from and now < coupon.valid_from:
+        raise CouponError("This promo code is not active yet")
+    if coupon.valid_until and now > coupon.valid_until:
+        raise CouponError("This promo code has expired")
+    if subtotal < coupon.min_subtotal:
+        raise CouponError(f"Add items worth {coupon.min_subtotal - subtotal:.2f} more to use this promo code")
+    if coupon.max_uses is not None and coupon.times_used >= coupon.max_uses:
+        raise CouponError("This promo code has been fully redeemed")
+
+
+def used_by(coupon, user):
+    return CouponUsage.objects.filter(coupon=coupon, user=user).values_list('count', flat=True).first() or 0
+
+
+def apply_coupon(order, code, user):
+    coupon = find_coupon(code)
+    if coupon is None:
+        raise CouponError("Promo code does not exists")
+    check_coupon(coupon, order.subtotal)
+    if coupon.max_uses_per_user is not None and used_by(coupon, user) >= coupon.max_uses_per_user:
+        raise CouponError("You have already used this promo code")
+    order.coupon = coupon
+    order.save(update_fields=['coupon'])
+    order.update_totals()
+    return coupon
+
+
+def reserve_coupon(coupon, user, subtotal):
+    #takes one use of the code for a checkout. Both counters only move with
+    #a conditional UPDATE, so a burst of checkouts can never go past the
+    #limits however many run at once, and a failed step rolls both back
+    check_coupon(coupon, subtotal)
+    with transaction.atomic():
+        taken = DiscountCode.objects.filter(
+            Q(max_uses__isnull=True) | Q(times_used__lt=F('max_uses')),
+            pk=coupon.pk, active=True,
+        ).update(times_used=F('times_used') + 1)
+        if not taken:
+            raise CouponError("This promo code has been fully redeemed")
+        usage = CouponUsage.objects.filter(coupon=coupon, user=user)
+        if not usage.exists():
+            try:
+                with transaction.atomic():
+                    CouponUsage.objects.create(coupon=coupon, user=user)
+            except IntegrityError:
+                pass
+        if coupon.max_uses_per_user is not None:
+            usage = usage.filter(count__lt=coupon.max_uses_per_user)
+        if not usage.update(count=F('count') + 1):
+            raise CouponError("You have already used this promo code")
+
+
+def release_coupon(coupon_id, user_id):
+    #gives back a use taken by reserve_coupon
+    with transaction.atomic():
+        DiscountCode.objects.filter(pk=coupon_id, times_used__gt=0).update(times_used=F('times_used') - 1)
+        CouponUsage.objects.filter(coupon_id=coupon_id, user_id=user_id, count__gt=0).update(count=F('count') - 1)
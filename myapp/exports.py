@@ -0,0 +1,104 @@
+import csv
+import json
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Order, Payment
+
+
+#rows fetched per round trip, on PostgreSQL through a server-side cursor,
+#so an export runs in constant memory however many orders there are
+EXPORT_CHUNK_SIZE = 2000
+
+OrderLine = Order.items.through
+
+#what each export reads: the rows, the filter that leaves out open carts,
+#the fields the date range and status filters apply to and the columns
+EXPORTS = {
+    'orders': dict(model=Order, placed={'ordered': True}, date='ordered_date', status='status', columns=[
+        ('id', 'id'),
+        ('order_id', 'order_id'),
+        ('user', 'user__username'),
+        ('status', 'status'),
+        ('ordered_date', 'ordered_date'),
+        ('subtotal', 'subtotal'),
+        ('discount', 'discount'),
+        ('total', 'total'),
+        ('coupon', 'coupon__promo_code'),
+        ('stripe_charge_id', 'payment__stripe_charge_id'),
+        ('zipcode', 'billing_address__zipcode'),
+        ('country', 'billing_address__country'),
+    ], ordering=['id']),
+    'order-items': dict(model=OrderLine, placed={'order__ordered': True}, date='order__ordered_date', status='order__status', columns=[
+        ('order_id', 'order__order_id'),
+        ('status', 'order__status'),
+        ('ordered_date', 'order__ordered_date'),
+        ('item', 'orderitem__item__title'),
+        ('slug', 'orderitem__item__slug'),
+        ('quantity', 'orderitem__quantity'),
+        ('price', 'orderitem__item__price'),
+        ('discount_price', 'orderitem__item__discount_price'),
+    ], ordering=['order', 'id']),
+    'payments': dict(model=Payment, placed={}, date='timestamp', status='order__status', columns=[
+        ('id', 'id'),
+        ('stripe_charge_id', 'stripe_charge_id'),
+        ('user', 'user__username'),
+        ('amount', 'amount'),
+        ('timestamp', 'timestamp'),
+        ('order_id', 'order__order_id'),
+        ('status', 'order__status'),
+    ], ordering=['id']),
+}
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def day_bounds(date_from=None, date_to=None):
+    #dates are whole days in the current time zone, date_to included
+    start = end = None
+    if date_from:
+        start = timezone.make_aware(datetime.combine(date_from, time.min))
+    if date_to:
+        end = timezone.make_aware(datetime.combine(date_to, time.max))
+    return start, end
+
+
+def export_queryset(kind, queryset=None, date_from=None, date_to=None, statuses=None):
+    export = EXPORTS[kind]
+    if queryset is None:
+        queryset = export['model'].objects.all()
+    queryset = queryset.filter(**export['placed'])
+    start, end = day_bounds(date_from, date_to)
+    if start:
+        queryset = queryset.filter(**{export['date'] + '__gte': start})
+    if end:
+        queryset = queryset.filter(**{export['date'] + '__lte': end})
+    if statuses:
+        queryset = queryset.filter(**{export['status'] + '__in': statuses})
+    return queryset.order_by(*export['ordering'])
+
+
+class Echo:
+    #csv.writer target that hands each line back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_lines(kind, fmt, queryset):
+    #yields the export one line at a time
+    columns = EXPORTS[kind]['columns']
+    names = [name for name, path in columns]
+    rows = queryset.values_list(*[path for name, path in columns]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(names)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def export_filename(kind, fmt):
+    return f"{kind}-{timezone.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
@@ -0,0 +1,105 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+
+#widths generated for every product image, wide enough for a grid card on
+#phones, tablets and retina desktops
+THUMBNAIL_WIDTHS = (240, 480, 960)
+DERIVATIVE_DIR = 'derivatives'
+DERIVATIVE_URLS_TIMEOUT = 60 * 60 * 24
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+#makes the derivatives of new uploads so the save that stored them doesn't
+#wait for Pillow, a process that exits first leaves them to generate_thumbnails
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def derivative_name(name, width, ext):
+    stem = os.path.splitext(name)[0]
+    return f'{DERIVATIVE_DIR}/{stem}-{width}w.{ext}'
+
+
+def fallback_ext(image):
+    #keep transparency for images that have it, everything else becomes JPEG
+    return 'png' if image.mode in ('RGBA', 'LA', 'P') else 'jpg'
+
+
+def save_image(image, name, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_derivatives(name, force=False):
+    #writes a resized fallback and a WebP copy per width, never upscaling
+    if not name:
+        return 0
+    if not force and default_storage.exists(derivative_name(name, THUMBNAIL_WIDTHS[0], 'webp')):
+        return 0
+    with default_storage.open(name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    ext = fallback_ext(original)
+    if ext == 'jpg':
+        original = original.convert('RGB')
+    elif original.mode == 'P':
+        original = original.convert('RGBA')
+    created = 0
+    for width in THUMBNAIL_WIDTHS:
+        if width >= original.width and width != THUMBNAIL_WIDTHS[0]:
+            break
+        height = max(1, round(original.height * min(width, original.width) / original.width))
+        resized = original.resize((min(width, original.width), height), Image.LANCZOS)
+        if ext == 'jpg':
+            save_image(resized, derivative_name(name, width, ext), 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        else:
+            save_image(resized, derivative_name(name, width, ext), 'PNG', optimize=True)
+        save_image(resized, derivative_name(name, width, 'webp'), 'WEBP', quality=WEBP_QUALITY, method=4)
+        created += 1
+    cache.delete(derivative_urls_key(name))
+    return created
+
+
+def generate_derivatives_later(name):
+    def run():
+        try:
+            generate_derivatives(name)
+        except (OSError, ValueError):
+            #a broken upload keeps being served as is
+            pass
+    return _executor.submit(run)
+
+
+def derivative_urls_key(name):
+    return f'image-derivatives:{name}'
+
+
+def get_derivative_urls(name):
+    #{'fallback': [(width, url)], 'webp': [(width, url)]}, cached because the
+    #storage lookups are far slower than a cache hit
+    if not name:
+        return None
+    key = derivative_urls_key(name)
+    urls = cache.get(key)
+    if urls is None:
+        urls = {'fallback': [], 'webp': []}
+        for width in THUMBNAIL_WIDTHS:
+            webp = derivative_name(name, width, 'webp')
+            if not default_storage.exists(webp):
+                break
+            for ext in ('jpg', 'png'):
+                fallback = derivative_name(name, width, ext)
+                if default_storage.exists(fallback):
+                    urls['fallback'].append((width, default_storage.url(fallback)))
+                    break
+            urls['webp'].append((width, default_storage.url(webp)))
+        cache.set(key, urls, DERIVATIVE_URLS_TIMEOUT)
+    return urls
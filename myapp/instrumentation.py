@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.template.backends.django import Template as BackendTemplate
+from django.utils import timezone
+
+
+STATS_NAMES_KEY = 'request-stats:names'
+STATS_FIELDS = ('count', 'total_us', 'queries', 'db_us', 'template_us')
+#latency histogram in ms, every bucket 25% wider than the one before, up to about a minute
+BUCKETS = [1.25 ** i for i in range(50)]
+#counters are summed in the process and written to the cache at most this often
+FLUSH_INTERVAL = 10
+MAX_LOGGED_QUERIES = 100
+STACK_DEPTH = 8
+
+_local = threading.local()
+_lock = threading.Lock()
+_pending = {}
+_last_flush = time.monotonic()
+_log = None
+
+
+def stats_key(name, field):
+    return f'request-stats:{name}:{field}'
+
+
+def bucket_fields():
+    return [f'b{i}' for i in range(len(BUCKETS))]
+
+
+def bucket_for(ms):
+    for i, bound in enumerate(BUCKETS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS) - 1
+
+
+def bump(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def app_stack():
+    #where in our code the query came from, innermost frame last
+    frames = [
+        frame for frame in traceback.extract_stack()[:-3]
+        if frame.filename.startswith(str(settings.BASE_DIR)) and frame.filename != __file__
+        and 'site-packages' not in frame.filename
+    ]
+    return [f'{os.path.relpath(frame.filename, settings.BASE_DIR)}:{frame.lineno} in {frame.name}' for frame in frames[-STACK_DEPTH:]]
+
+
+class RequestTimer:
+    #database execute wrapper, also collects the template and view times
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = False
+        self.view_started = None
+        self.sql = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db += elapsed
+            if len(self.sql) < MAX_LOGGED_QUERIES:
+                stack = app_stack() if elapsed * 1000 >= settings.SLOW_QUERY_MS else None
+                self.sql.append((sql, elapsed, stack))
+
+
+_render = BackendTemplate.render
+
+
+def timed_render(self, context=None, request=None):
+    #only the outermost render counts, includes are part of it
+    timer = getattr(_local, 'timer', None)
+    if timer is None or timer.rendering:
+        return _render(self, context, request)
+    timer.rendering = True
+    started = time.perf_counter()
+    try:
+        return _render(self, context, request)
+    finally:
+        timer.template += time.perf_counter() - started
+        timer.rendering = False
+
+
+def record(name, total, timer):
+    global _last_flush
+    ms = total * 1000
+    with _lock:
+        row = _pending.setdefault(name, {})
+        for field, value in (
+            ('count', 1),
+            ('total_us', int(total * 1000000)),
+            ('queries', timer.queries),
+            ('db_us', int(timer.db * 1000000)),
+            ('template_us', int(timer.template * 1000000)),
+            (f'b{bucket_for(ms)}', 1),
+        ):
+            row[field] = row.get(field, 0) + value
+        if time.monotonic() - _last_flush < FLUSH_INTERVAL:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    flush(pending)
+
+
+def flush(pending):
+    names = cache.get(STATS_NAMES_KEY) or []
+    if set(pending) - set(names):
+        cache.set(STATS_NAMES_KEY, sorted(set(names) | set(pending)), None)
+    for name, row in pending.items():
+        for field, value in row.items():
+            bump(stats_key(name, field), value)
+
+
+def get_stats():
+    stats = {}
+    fields = STATS_FIELDS + tuple(bucket_fields())
+    for name in cache.get(STATS_NAMES_KEY) or []:
+        values = cache.get_many([stats_key(name, field) for field in fields])
+        stats[name] = {field: values.get(stats_key(name, field), 0) for field in fields}
+    return stats
+
+
+def reset_stats():
+    names = cache.get(STATS_NAMES_KEY) or []
+    fields = STATS_FIELDS + tuple(bucket_fields())
+    cache.delete_many([stats_key(name, field) for name in names for field in fields])
+    cache.delete(STATS_NAMES_KEY)
+
+
+def percentile(row, fraction):
+    #upper bound of the bucket the request at that rank fell in
+    rank = row['count'] * fraction
+    seen = 0
+    for i, bound in enumerate(BUCKETS):
+        seen += row.get(f'b{i}', 0)
+        if seen >= rank:
+            return bound
+    return BUCKETS[-1]
+
+
+def get_slow_log():
+    global _log
+    if _log is None:
+        path = settings.SLOW_REQUEST_LOG
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=settings.SLOW_REQUEST_LOG_BYTES, backupCount=settings.SLOW_REQUEST_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _log = logging.getLogger('myapp.slow_requests')
+        _log.propagate = False
+        _log.setLevel(logging.INFO)
+        _log.addHandler(handler)
+    return _log
+
+
+def log_slow_request(request, response, name, total, view, timer):
+    get_slow_log().info(json.dumps({
+        'time': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'url_name': name,
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 2),
+        'view_ms': round(view * 1000, 2),
+        'db_ms': round(timer.db * 1000, 2),
+        'template_ms': round(timer.template * 1000, 2),
+        'queries': timer.queries,
+        'sql': [
+            {'sql': sql, 'ms': round(elapsed * 1000, 2), 'stack': stack}
+            for sql, elapsed, stack in timer.sql
+        ],
+    }))
+
+
+class InstrumentationMiddleware:
+    #keep it first in MIDDLEWARE so the total covers every other middleware
+    def __init__(self, get_response):
+        self.get_response = get_response
+        BackendTemplate.render = timed_render
+
+    def __call__(self, request):
+        timer = RequestTimer()
+        _local.timer = timer
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _local.timer = None
+        finished = time.perf_counter()
+        total = finished - started
+        view = finished - timer.view_started if timer.view_started else 0
+
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else 'unresolved'
+        record(name, total, timer)
+
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                'db;desc="%d queries";dur=%.1f' % (timer.queries, timer.db * 1000),
+                'tpl;dur=%.1f' % (timer.template * 1000),
+                'view;dur=%.1f' % (view * 1000),
+                'total;dur=%.1f' % (total * 1000),
+            ])
+        if total * 1000 >= settings.SLOW_REQUEST_MS and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE:
+            log_slow_request(request, response, name, total, view, timer)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timer = getattr(_local, 'timer', None)
+        if timer is not None:
+            timer.view_started = time.perf_counter()
@@ -0,0 +1,226 @@
+import json
+import random
+import re
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from myapp.models import Item
+from .seed_bench import ITEM_PREFIX, USER_PREFIX, PASSWORD, WORDS
+
+
+SCENARIOS = ('home', 'all-product', 'product', 'search', 'add-to-cart', 'remove-from-cart', 'checkout', 'order-summary')
+QUERIES_RE = re.compile(r'db;desc="(\d+) queries"')
+TIMEOUT = 30
+
+
+class NoRedirect(HTTPRedirectHandler):
+    #a redirect is the answer of the view being measured, not a new request
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class BenchClient:
+    def __init__(self, base_url, username, slugs, rng):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), NoRedirect)
+        self.username = username
+        self.slugs = slugs
+        self.rng = rng
+        self.in_cart = []
+
+    def request(self, path, data=None):
+        #returns (status, seconds, queries), queries from the Server-Timing
+        #header, None unless the server runs with SERVER_TIMING=True
+        body = urlencode(data).encode() if data is not None else None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(Request(self.base_url + path, data=body), timeout=TIMEOUT) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except HTTPError as e:
+            e.read()
+            status, headers = e.code, e.headers
+        elapsed = time.perf_counter() - started
+        match = QUERIES_RE.search(headers.get('Server-Timing', ''))
+        return status, elapsed, int(match.group(1)) if match else None
+
+    def login(self):
+        path = reverse('account_login')
+        self.request(path)
+        token = next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+        status, elapsed, queries = self.request(path, {
+            'login': self.username, 'password': PASSWORD, 'csrfmiddlewaretoken': token,
+        })
+        if status != 302:
+            raise CommandError(f'Logging in as {self.username} answered {status}, run seed_bench first')
+
+    def path_for(self, scenario):
+        if scenario == 'home':
+            return reverse('home-page')
+        if scenario == 'all-product':
+            return reverse('all-product-view')
+        if scenario == 'product':
+            return reverse('product-page', kwargs={'slug': self.rng.choice(self.slugs)})
+        if scenario == 'search':
+            return reverse('search') + '?' + urlencode({'q': self.rng.choice(WORDS)})
+        if scenario == 'add-to-cart':
+            slug = self.rng.choice(self.slugs)
+            self.in_cart.append(slug)
+            return reverse('add-to-cart', kwargs={'slug': slug})
+        if scenario == 'remove-from-cart':
+            slug = self.in_cart.pop(0) if self.in_cart else self.rng.choice(self.slugs)
+            return reverse('remove-from-cart', kwargs={'slug': slug})
+        if scenario == 'checkout':
+            return reverse('checkout-page')
+        return reverse('order-summary')
+
+
+class Command(BaseCommand):
+    help = 'Load test the hot pages of a running server and report throughput, latency percentiles and queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to test, run against the seed_bench data')
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent logged in clients')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--output', help='Write the results as JSON, a baseline for --compare')
+        parser.add_argument('--compare', help='JSON written by an earlier run to compare against')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def run_client(self, client, scenarios, deadline, results, lock):
+        samples = {name: [] for name in scenarios}
+        errors = {name: 0 for name in scenarios}
+        queries = {name: [] for name in scenarios}
+        i = 0
+        while time.monotonic() < deadline:
+            scenario = scenarios[i % len(scenarios)]
+            i += 1
+            try:
+                status, elapsed, count = client.request(client.path_for(scenario))
+            except (URLError, OSError):
+                errors[scenario] += 1
+                continue
+            #only 2xx and 3xx answers are timed, anything else is a failure
+            if not 200 <= status < 400:
+                errors[scenario] += 1
+                continue
+            samples[scenario].append(elapsed)
+            if count is not None:
+                queries[scenario].append(count)
+        with lock:
+            for name in scenarios:
+                results[name]['samples'] += samples[name]
+                results[name]['errors'] += errors[name]
+                results[name]['queries'] += queries[name]
+
+    def summarize(self, results, duration):
+        summary = {}
+        for name, row in results.items():
+            samples = row['samples']
+            summary[name] = {
+                'requests': len(samples),
+                'errors': row['errors'],
+                'rps': round(len(samples) / duration, 1),
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 2) if samples else 0,
+                'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+                'queries': round(sum(row['queries']) / len(row['queries']), 1) if row['queries'] else None,
+            }
+        every = [sample for row in results.values() for sample in row['samples']]
+        summary['total'] = {
+            'requests': len(every),
+            'errors': sum(row['errors'] for row in results.values()),
+            'rps': round(len(every) / duration, 1),
+            'mean_ms': round(sum(every) / len(every) * 1000, 2) if every else 0,
+            'p50_ms': round(percentile(every, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(every, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(every, 0.99) * 1000, 2),
+            'queries': None,
+        }
+        return summary
+
+    def print_summary(self, summary, baseline):
+        self.stdout.write('%-18s %9s %7s %9s %9s %9s %9s %8s' % (
+            'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for name, row in summary.items():
+            self.stdout.write('%-18s %9d %7d %9.1f %9.1f %9.1f %9.1f %8s' % (
+                name, row['requests'], row['errors'], row['rps'], row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                '-' if row['queries'] is None else '%.1f' % row['queries']))
+        if not baseline:
+            return
+        self.stdout.write('')
+        self.stdout.write('%-18s %14s %14s %14s' % ('against baseline', 'req/s', 'p95 ms', 'queries'))
+        for name, row in summary.items():
+            old = baseline['scenarios'].get(name)
+            if not old:
+                continue
+
+            def change(key):
+                if not old[key] or row[key] is None:
+                    return '-'
+                return '%+.1f%%' % ((row[key] - old[key]) / old[key] * 100)
+
+            self.stdout.write('%-18s %14s %14s %14s' % (name, change('rps'), change('p95_ms'), change('queries')))
+
+    def handle(self, *args, **kwargs):
+        baseline = None
+        if kwargs['compare']:
+            with open(kwargs['compare']) as f:
+                baseline = json.load(f)
+        slugs = list(Item.objects.filter(slug__startswith=ITEM_PREFIX).values_list('slug', flat=True)[:1000])
+        if not slugs:
+            raise CommandError('No bench items found, run seed_bench first')
+
+        rng = random.Random(kwargs['seed'])
+        clients = []
+        for i in range(kwargs['clients']):
+            client = BenchClient(kwargs['url'], f'{USER_PREFIX}{i}', slugs, random.Random(rng.random()))
+            client.login()
+            clients.append(client)
+
+        scenarios = kwargs['scenarios']
+        results = {name: {'samples': [], 'errors': 0, 'queries': []} for name in scenarios}
+        lock = threading.Lock()
+        started = time.monotonic()
+        deadline = started + kwargs['duration']
+        threads = [
+            threading.Thread(target=self.run_client, args=(client, scenarios, deadline, results, lock))
+            for client in clients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - started
+
+        summary = self.summarize(results, duration)
+        self.print_summary(summary, baseline)
+        if not any(row['queries'] for row in results.values()):
+            self.stdout.write('No query counts, start the server with SERVER_TIMING=True to get them')
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as f:
+                json.dump({
+                    'url': kwargs['url'],
+                    'clients': kwargs['clients'],
+                    'duration': round(duration, 1),
+                    'finished': timezone.now().isoformat(),
+                    'scenarios': summary,
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {kwargs["output"]}'))
@@ -0,0 +1,126 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from myapp.models import Order, Payment, BilingAddress, DiscountCode, ORDER_STATUS_CHOICES
+
+
+SEED_BATCH_SIZE = 10000
+SEED_USERS = 50
+#one address and one payment per this many orders
+ORDERS_PER_ROW = 10
+#the host the test client sends, allowed for the run whatever ALLOWED_HOSTS says
+CLIENT_HOST = 'testserver'
+STATUSES = [value for value, name in ORDER_STATUS_CHOICES if value != 'cart']
+CHANGELISTS = [
+    ('orders', '/admin/myapp/order/', {}),
+    ('orders page 10', '/admin/myapp/order/', {'p': 9}),
+    ('orders by status', '/admin/myapp/order/', {'status__exact': 'delivered'}),
+    ('payments', '/admin/myapp/payment/', {}),
+    ('addresses', '/admin/myapp/bilingaddress/', {}),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+def batches(total):
+    for start in range(0, total, SEED_BATCH_SIZE):
+        yield range(start, min(start + SEED_BATCH_SIZE, total))
+
+
+class Command(BaseCommand):
+    help = 'Check that the order, payment and address changelists run a constant number of queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 1000000],
+                            help='Numbers of orders to render the changelists with, at least 1000')
+
+    def seed(self, size):
+        User = get_user_model()
+        admin = User.objects.create_superuser('bench-admin', 'bench-admin@example.com', 'bench')
+        User.objects.bulk_create([User(username=f'bench-admin-user-{i}') for i in range(SEED_USERS)])
+        users = list(User.objects.filter(username__startswith='bench-admin-user-').values_list('id', flat=True))
+        coupon = DiscountCode.objects.create(promo_code='BENCHADMIN', amount=10)
+        rows = size // ORDERS_PER_ROW + 1
+        for batch in batches(rows):
+            BilingAddress.objects.bulk_create([
+                BilingAddress(user_id=users[i % SEED_USERS], street_address=f'{i} Bench street',
+                              apartment_address='1', country='IN', zipcode='560001')
+                for i in batch
+            ])
+            Payment.objects.bulk_create([
+                Payment(stripe_charge_id=f'ch_bench_{i}', user_id=users[i % SEED_USERS], amount=100)
+                for i in batch
+            ])
+        #bulk_create only returns primary keys on PostgreSQL
+        addresses = list(BilingAddress.objects.filter(street_address__endswith=' Bench street').values_list('id', flat=True))
+        payments = list(Payment.objects.filter(stripe_charge_id__startswith='ch_bench_').values_list('id', flat=True))
+        now = timezone.now()
+        for batch in batches(size):
+            Order.objects.bulk_create([
+                Order(user_id=users[i % SEED_USERS], order_id=f'bench{i:015d}', ordered_date=now, ordered=True,
+                      status=STATUSES[i % len(STATUSES)], billing_address_id=addresses[i // ORDERS_PER_ROW],
+                      payment_id=payments[i // ORDERS_PER_ROW], coupon=coupon if i % 3 == 0 else None,
+                      subtotal=100, total=100)
+                for i in batch
+            ])
+        #fresh statistics, as autovacuum or a scheduled ANALYZE would leave them
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return admin
+
+    def measure(self, size):
+        results = {}
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=[CLIENT_HOST]):
+                started = time.monotonic()
+                admin = self.seed(size)
+                self.stdout.write('Seeded %d orders in %.1fs' % (size, time.monotonic() - started))
+                client = Client(HTTP_HOST=CLIENT_HOST)
+                client.force_login(admin)
+                for name, url, params in CHANGELISTS:
+                    queries = []
+
+                    def record(execute, sql, params, many, context):
+                        queries.append(sql)
+                        return execute(sql, params, many, context)
+
+                    with connection.execute_wrapper(record):
+                        started = time.monotonic()
+                        response = client.get(url, params)
+                        elapsed = time.monotonic() - started
+                    #an error page runs next to no queries and would look constant
+                    if response.status_code != 200:
+                        raise CommandError(f'{name} answered {response.status_code}')
+                    if not queries:
+                        raise CommandError(f'{name} ran no queries, nothing was measured')
+                    results[name] = (len(queries), elapsed)
+                raise Rollback
+        except Rollback:
+            pass
+        return results
+
+    def handle(self, *args, **kwargs):
+        sizes = kwargs['sizes']
+        results = {size: self.measure(size) for size in sizes}
+
+        failed = []
+        for name, url, params in CHANGELISTS:
+            row = [results[size][name] for size in sizes]
+            self.stdout.write('%-18s %s' % (name, '  '.join(
+                f'{size} orders: {count} queries {elapsed * 1000:.0f}ms'
+                for size, (count, elapsed) in zip(sizes, row))))
+            #a big table can need fewer queries, its count comes from the statistics
+            if any(later[0] > earlier[0] for earlier, later in zip(row, row[1:])):
+                failed.append(name)
+
+        if failed:
+            raise CommandError('Query count grows with the number of orders on: %s' % ', '.join(failed))
+        self.stdout.write(self.style.SUCCESS('Every changelist page runs a constant number of queries'))
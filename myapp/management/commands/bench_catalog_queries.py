@@ -0,0 +1,90 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from myapp import views, search
+from myapp.models import Item, Category
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Check that every product grid page runs a constant number of queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[4, 40],
+                            help='Catalog sizes to render the grid pages with')
+
+    def seed(self, size):
+        Category.objects.bulk_create([
+            Category(title=f'Bench category {i}', slug=f'bench-category-{i}') for i in range(3)
+        ])
+        categories = list(Category.objects.filter(slug__startswith='bench-category-'))
+        Item.objects.bulk_create([
+            Item(
+                title=f'Bench item {i}',
+                price=100 + i,
+                discount_price=90 + i if i % 2 else None,
+                effective_price=90 + i if i % 2 else 100 + i,
+                image='sample.jpg',
+                slug=f'bench-item-{i}',
+                description='Bench item',
+                list_on_frontpage=True,
+            ) for i in range(size)
+        ])
+        items = Item.objects.filter(slug__startswith='bench-item-')
+        Through = Item.category.through
+        Through.objects.bulk_create([
+            Through(item_id=item.id, category_id=category.id)
+            for item in items for category in categories[:2]
+        ])
+        #bulk_create skips the signals that maintain the search index
+        search.index_items(items.values_list('id', flat=True))
+        return categories[0]
+
+    def grid_pages(self, category):
+        factory = RequestFactory()
+        pages = [
+            ('home-page', views.HomeView.as_view(), factory.get('/'), {}),
+            ('all-product-view', views.AllProductView.as_view(), factory.get('/all-product/'), {}),
+            ('search', views.search, factory.get('/search/', {'q': 'bench'}), {}),
+            ('item-by-category', views.item_by_category, factory.get('/cat/'), {'slug': category.slug}),
+        ]
+        for name, view, request, kwargs in pages:
+            request.user = AnonymousUser()
+            yield name, view, request, kwargs
+
+    def count_queries(self, size):
+        counts = {}
+        try:
+            with transaction.atomic():
+                category = self.seed(size)
+                for name, view, request, kwargs in self.grid_pages(category):
+                    with CaptureQueriesContext(connection) as ctx:
+                        response = view(request, **kwargs)
+                        if hasattr(response, 'render'):
+                            response.render()
+                    counts[name] = len(ctx.captured_queries)
+                raise Rollback
+        except Rollback:
+            pass
+        return counts
+
+    def handle(self, *args, **kwargs):
+        sizes = kwargs['sizes']
+        results = {size: self.count_queries(size) for size in sizes}
+
+        failed = []
+        for name in results[sizes[0]]:
+            row = [results[size][name] for size in sizes]
+            self.stdout.write('%-20s %s' % (name, '  '.join(f'{size} items: {count} queries' for size, count in zip(sizes, row))))
+            if len(set(row)) > 1:
+                failed.append(name)
+
+        if failed:
+            raise CommandError('Query count grows with catalog size on: %s' % ', '.join(failed))
+        self.stdout.write(self.style.SUCCESS('Every grid page runs a constant number of queries'))
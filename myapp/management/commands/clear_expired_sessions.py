@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.sessions import SessionStore, CLEANUP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in small batches, run it next to the web workers or from cron with --once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Clean up once and exit')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between cleanups')
+        parser.add_argument('--batch-size', type=int, default=CLEANUP_BATCH_SIZE, help='Sessions deleted per statement')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches so other writes get the table')
+
+    def handle(self, *args, **kwargs):
+        while True:
+            started = time.monotonic()
+            removed = SessionStore.clear_expired(kwargs['batch_size'], kwargs['pause'])
+            if removed:
+                self.stdout.write('Deleted %d expired sessions in %.1fs' % (removed, time.monotonic() - started))
+            if kwargs['once']:
+                break
+            time.sleep(kwargs['interval'])
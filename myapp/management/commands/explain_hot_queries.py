@@ -0,0 +1,211 @@
+import json
+import re
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from myapp import coupons, search
+from myapp.cart import add_item
+from myapp.models import Item, Category, CheckZipcode, DiscountCode, Order, BilingAddress
+
+
+SEED_ITEMS = 50
+#the host the test client sends, allowed for the run whatever ALLOWED_HOSTS says
+CLIENT_HOST = 'testserver'
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+ORDER_BY = re.compile(r'ORDER BY "(\w+)"\."(\w+)"')
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+#plan nodes that read all of their input before returning a row, a scan
+#below one of them can't stop early at a LIMIT
+POSTGRES_BLOCKING = {'Sort', 'Aggregate', 'Hash', 'HashAggregate', 'Materialize', 'Unique', 'WindowAgg', 'SetOp'}
+
+
+class Rollback(Exception):
+    pass
+
+
+def primary_key_column(table):
+    for model in apps.get_models(include_auto_created=True):
+        if model._meta.db_table == table:
+            return model._meta.pk.column
+    return None
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries of the hot views against seeded data and fail on full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--allow', nargs='*', default=[],
+                            help='Tables that may be scanned, e.g. tiny lookup tables')
+        parser.add_argument('--show-plans', action='store_true', help='Print the plan of every query')
+
+    def seed(self):
+        User = get_user_model()
+        user = User.objects.create_user('explain-hot-queries', password='explain')
+        categories = [Category.objects.create(title=f'Explain category {i}', slug=f'explain-category-{i}') for i in range(3)]
+        Item.objects.bulk_create([
+            Item(
+                title=f'Explain item {i}',
+                price=100 + i,
+                discount_price=90 + i if i % 2 else None,
+                effective_price=90 + i if i % 2 else 100 + i,
+                image='sample.jpg',
+                slug=f'explain-item-{i}',
+                description='Explain item',
+                list_on_frontpage=True,
+            ) for i in range(SEED_ITEMS)
+        ])
+        items = list(Item.objects.filter(slug__startswith='explain-item-'))
+        Through = Item.category.through
+        Through.objects.bulk_create([
+            Through(item_id=item.id, category_id=categories[item.id % 3].id) for item in items
+        ])
+        search.index_items([item.id for item in items])
+        CheckZipcode.objects.create(zipcode='999999')
+        DiscountCode.objects.create(promo_code='EXPLAIN10', amount=10)
+
+        #one placed order to look up by order_id, one open cart
+        add_item(user, items[0], 2)
+        placed = Order.objects.get(user=user, ordered=False)
+        placed.items.update(ordered=True)
+        placed.transition('in_transit', ordered=True, order_id='explainhotqueries0001')
+        add_item(user, items[1])
+        address = BilingAddress.objects.create(user=user, street_address='1', apartment_address='1', country='IN', zipcode='999999')
+        Order.objects.filter(user=user, ordered=False).update(billing_address=address, ordered_date=timezone.now())
+        return user, items, categories
+
+    def scenarios(self, items, categories):
+        #(name, method, path, data, the status the view answers with)
+        item = items[len(items) // 2]
+        return [
+            ('home-page', 'get', '/', {}, 200),
+            ('all-product-view', 'get', '/all-product/', {}, 200),
+            ('product-page', 'get', item.get_absolute_url(), {}, 200),
+            ('item-by-category', 'get', f'/cat/{categories[0].slug}/', {}, 200),
+            ('search', 'get', '/search/', {'q': 'explain'}, 200),
+            ('add-to-cart', 'get', item.get_add_to_cart_url(), {}, 302),
+            ('remove-single-item-from-cart', 'get', reverse('remove-single-item-from-cart', kwargs={'slug': item.slug}), {}, 302),
+            ('order-summary', 'get', '/order-summary/', {}, 200),
+            ('checkout-page', 'get', '/checkout/', {}, 200),
+            ('discount-code', 'post', '/discount-code/', {'promo_code': 'EXPLAIN10'}, 302),
+            ('check-zipcode', 'post', '/check-zipcode/', {'zipcode': '999999'}, 302),
+            ('refund-view', 'post', '/refund-request/', {'order_id': 'explainhotqueries0001', 'message': 'x', 'email': 'explain@example.com'}, 302),
+            ('my-active-order', 'get', '/my-active-order/', {}, 200),
+            ('previous-order', 'get', '/pervious-order/', {}, 200),
+        ]
+
+    def capture(self, client, method, path, data):
+        #returns (response, queries)
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            if not many:
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = getattr(client, method)(path, data)
+        return response, queries
+
+    def read_in_key_order(self, sql, lines, table):
+        #a plain SCAN walks the table in rowid order. With a LIMIT, no sort and
+        #no WHERE it stops after a page, a WHERE on a column without an
+        #index (.first() on an unindexed filter) reads until a row matches
+        if ' LIMIT ' not in sql or ' WHERE ' in sql or any('TEMP B-TREE' in line for line in lines):
+            return False
+        match = ORDER_BY.search(sql)
+        return match is None or match.groups() == (table, primary_key_column(table))
+
+    def explain(self, sql, params):
+        #returns (plan lines, scanned tables). A scan that is read in order
+        #and cut off by a LIMIT, like the first keyset page over the primary
+        #key, only touches a page worth of rows and isn't reported
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                lines = [row[-1] for row in cursor.fetchall()]
+                scans = [m.group(1) for m in map(SQLITE_FULL_SCAN.match, lines) if m]
+                return lines, [table for table in scans if not self.read_in_key_order(sql, lines, table)]
+            if connection.vendor == 'postgresql':
+                #with seq scans priced out a Seq Scan means there is no usable index,
+                #however small the seeded tables are
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = [(plan[0]['Plan'], False, 0)]
+                lines, scans = [], []
+                while nodes:
+                    node, bounded, depth = nodes.pop()
+                    lines.append('  ' * depth + f"{node['Node Type']} {node.get('Relation Name', '')}".strip())
+                    #a filtered scan under a Limit still reads rows until enough match
+                    if node['Node Type'] == 'Seq Scan' and (not bounded or 'Filter' in node):
+                        scans.append(node['Relation Name'])
+                    if node['Node Type'] == 'Limit':
+                        bounded = True
+                    elif node['Node Type'] in POSTGRES_BLOCKING:
+                        bounded = False
+                    nodes.extend((child, bounded, depth + 1) for child in reversed(node.get('Plans', [])))
+                return lines, scans
+        raise CommandError(f'EXPLAIN is not supported on {connection.vendor}')
+
+    def snapshot_sql(self):
+        #the coupon snapshot reads every active code on purpose, only that
+        #exact statement may scan myapp_discountcode
+        queryset = coupons.snapshot_queryset()
+        return queryset.query.get_compiler(queryset.db).as_sql()[0]
+
+    def audit(self, allowed, show_plans):
+        failures = []
+        snapshot_sql = self.snapshot_sql()
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=[CLIENT_HOST]):
+                user, items, categories = self.seed()
+                client = Client(HTTP_HOST=CLIENT_HOST)
+                client.force_login(user)
+                for name, method, path, data, status in self.scenarios(items, categories):
+                    response, queries = self.capture(client, method, path, data)
+                    #an error page runs next to no queries and would pass unnoticed
+                    if response.status_code != status:
+                        raise CommandError(f'{name}: {method.upper()} {path} answered {response.status_code}, expected {status}')
+                    if not queries:
+                        raise CommandError(f'{name}: {method.upper()} {path} ran no queries, nothing was audited')
+                    seen = set()
+                    scanned = []
+                    for sql, params in queries:
+                        if not sql.lstrip().upper().startswith(EXPLAINABLE) or sql in seen:
+                            continue
+                        seen.add(sql)
+                        lines, scans = self.explain(sql, params)
+                        if sql == snapshot_sql:
+                            scans = [table for table in scans if table != 'myapp_discountcode']
+                        scans = [table for table in scans if table not in allowed]
+                        if show_plans or scans:
+                            self.stdout.write(f'  {sql[:200]}')
+                            for line in lines:
+                                self.stdout.write(f'      {line}')
+                        if scans:
+                            scanned.extend(scans)
+                    if scanned:
+                        failures.append(name)
+                        self.stdout.write(self.style.ERROR(f'{name}: full scan on {", ".join(sorted(set(scanned)))}'))
+                    else:
+                        self.stdout.write(f'{name}: {len(seen)} queries, all indexed')
+                raise Rollback
+        except Rollback:
+            pass
+        return failures
+
+    def handle(self, *args, **kwargs):
+        failures = self.audit(set(kwargs['allow']), kwargs['show_plans'])
+        if failures:
+            raise CommandError('Full table scans on: %s' % ', '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index'))
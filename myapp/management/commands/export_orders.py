@@ -0,0 +1,59 @@
+import sys
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.exports import EXPORTS, FORMATS, export_queryset, export_lines
+from myapp.models import ORDER_STATUS_CHOICES
+
+
+STATUSES = [value for value, name in ORDER_STATUS_CHOICES]
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'{value!r} is not a date, use YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Stream placed orders, their items or payments as CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(EXPORTS), default='orders')
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--from', dest='date_from', help='First day to include, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='Last day to include, YYYY-MM-DD')
+        parser.add_argument('--status', action='append', choices=STATUSES,
+                            help='Only orders in this status, can be repeated')
+        parser.add_argument('--output', default='-', help="File to write, '-' writes stdout")
+
+    def handle(self, *args, **kwargs):
+        kind = kwargs['kind']
+        date_from = parse_date(kwargs['date_from']) if kwargs['date_from'] else None
+        date_to = parse_date(kwargs['date_to']) if kwargs['date_to'] else None
+        queryset = export_queryset(kind, date_from=date_from, date_to=date_to, statuses=kwargs['status'])
+
+        path = kwargs['output']
+        if path == '-':
+            stream = sys.stdout
+        else:
+            try:
+                stream = open(path, 'w', encoding='utf-8', newline='')
+            except OSError as e:
+                raise CommandError(str(e))
+
+        count = 0
+        try:
+            for line in export_lines(kind, kwargs['format'], queryset):
+                stream.write(line)
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if path != '-':
+            #csv has a header line
+            rows = count - 1 if kwargs['format'] == 'csv' else count
+            self.stderr.write(self.style.SUCCESS(f'Wrote {rows} rows to {path}'))
@@ -0,0 +1,114 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from django.core.management.base import BaseCommand
+
+
+#tokens Stripe documents for failed test charges
+DECLINED_TOKENS = {'tok_chargeDeclined', 'tok_visa_chargeDeclined'}
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    #just enough of POST /v1/charges and /v1/refunds for stripe.Charge.create
+    #and stripe.Refund.create, including
+    #replaying the stored response when an idempotency key comes back
+    server_version = 'FakeStripe/1.0'
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', 'req_' + uuid.uuid4().hex[:14])
+        self.end_headers()
+        self.wfile.write(data)
+
+    def charge(self, params):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        source = params.get('source', '')
+        try:
+            amount = int(params.get('amount', ''))
+        except ValueError:
+            return 400, {'error': {'type': 'invalid_request_error', 'param': 'amount', 'message': 'Invalid integer: amount'}}
+        if not source:
+            return 400, {'error': {'type': 'invalid_request_error', 'param': 'source', 'message': 'Must provide source or customer.'}}
+        if source in DECLINED_TOKENS or random.random() < server.decline_rate:
+            return 402, {'error': {'type': 'card_error', 'code': 'card_declined', 'message': 'Your card was declined.'}}
+        return 200, {
+            'id': 'ch_' + uuid.uuid4().hex[:24],
+            'object': 'charge',
+            'amount': amount,
+            'currency': params.get('currency', 'inr'),
+            'paid': True,
+            'status': 'succeeded',
+            'created': int(time.time()),
+        }
+
+    def refund(self, params):
+        if not params.get('charge'):
+            return 400, {'error': {'type': 'invalid_request_error', 'param': 'charge', 'message': 'Must provide charge.'}}
+        return 200, {
+            'id': 're_' + uuid.uuid4().hex[:24],
+            'object': 'refund',
+            'charge': params['charge'],
+            'status': 'succeeded',
+            'created': int(time.time()),
+        }
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path not in ('/v1/charges', '/v1/refunds'):
+            return self.send_json(404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL (POST: {self.path})'}})
+        length = int(self.headers.get('Content-Length') or 0)
+        params = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        key = self.headers.get('Idempotency-Key')
+        server = self.server
+        handle = self.charge if path == '/v1/charges' else self.refund
+        if key:
+            #hold the key while charging so concurrent retries wait for the first result
+            with server.lock:
+                key_lock = server.key_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                if key not in server.responses:
+                    server.responses[key] = handle(params)
+                status, body = server.responses[key]
+        else:
+            status, body = handle(params)
+        self.send_json(status, body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the Stripe charges API, set STRIPE_API_BASE to its address'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--latency', type=float, default=0.3, help='Seconds each new charge takes')
+        parser.add_argument('--decline-rate', type=float, default=0.0, help='Fraction of charges to decline at random')
+
+    def handle(self, *args, **kwargs):
+        server = ThreadingHTTPServer((kwargs['host'], kwargs['port']), FakeStripeHandler)
+        server.latency = kwargs['latency']
+        server.decline_rate = kwargs['decline_rate']
+        server.verbose = kwargs['verbosity'] > 1
+        server.lock = threading.Lock()
+        server.key_locks = {}
+        server.responses = {}
+        self.stdout.write(f"Fake Stripe listening on http://{kwargs['host']}:{kwargs['port']}, quit with CONTROL-C")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from myapp.templatetags.fragment_cache_tags import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Print hit ratio and render time saved by the versioned fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Clear the collected statistics')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Fragment cache statistics cleared'))
+            return
+
+        stats = get_stats()
+        if not stats:
+            #the counters live in the cache, so other processes are only
+            #visible when CACHE_BACKEND is shared (memcached, redis)
+            self.stdout.write('No fragment statistics found in the cache, they are only '
+                              'collected with FRAGMENT_CACHE_STATS=True')
+            return
+
+        self.stdout.write('%-20s %8s %8s %8s %12s %12s %12s' % (
+            'fragment', 'hits', 'misses', 'ratio', 'hit ms', 'miss ms', 'saved s'))
+        for name, row in sorted(stats.items()):
+            lookups = row['hits'] + row['misses']
+            ratio = row['hits'] / lookups if lookups else 0
+            hit_ms = row['hit_us'] / row['hits'] / 1000 if row['hits'] else 0
+            miss_ms = row['miss_us'] / row['misses'] / 1000 if row['misses'] else 0
+            #every hit saved roughly one miss render minus the lookup itself
+            saved = row['hits'] * max(miss_ms - hit_ms, 0) / 1000
+            self.stdout.write('%-20s %8d %8d %7.1f%% %12.3f %12.3f %12.2f' % (
+                name, row['hits'], row['misses'], ratio * 100, hit_ms, miss_ms, saved))
@@ -0,0 +1,46 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from myapp.images import generate_derivatives
+from myapp.models import Item
+
+
+def generate(args):
+    name, force = args
+    try:
+        return name, generate_derivatives(name, force=force), None
+    except (OSError, ValueError) as e:
+        return name, 0, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail and WebP derivatives for every product image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist')
+
+    def handle(self, *args, **kwargs):
+        names = list(Item.objects.exclude(image='').order_by().values_list('image', flat=True).distinct())
+        #the workers only touch storage, don't let them inherit the connection
+        connections.close_all()
+
+        started = time.monotonic()
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=kwargs['workers']) as executor:
+            jobs = ((name, kwargs['force']) for name in names)
+            for name, created, error in executor.map(generate, jobs, chunksize=8):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                elif created:
+                    done += 1
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            'Processed %d images in %.1fs: %d generated, %d failed, %d already up to date' % (
+                len(names), elapsed, done, failed, len(names) - done - failed)
+        ))
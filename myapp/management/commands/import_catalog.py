@@ -0,0 +1,262 @@
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.text import slugify
+
+from myapp import search, page_cache
+from myapp.images import generate_derivatives
+from myapp.models import Item, Category, LABEL_CHOICES, LABEL_NAME_CHOICES, sale_price
+
+
+LABELS = {value for value, name in LABEL_CHOICES}
+LABEL_NAMES = {value for value, name in LABEL_NAME_CHOICES}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+DOWNLOAD_TIMEOUT = 30
+
+
+class RowError(Exception):
+    pass
+
+
+def read_csv(stream):
+    #categories are separated by | inside the column
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        row['categories'] = [name for name in (row.get('categories') or '').split('|')]
+        yield line, row
+
+
+def read_jsonl(stream):
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, RowError(f'invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            yield line, RowError('expected a JSON object')
+            continue
+        categories = row.get('categories') or []
+        row['categories'] = categories.split('|') if isinstance(categories, str) else categories
+        yield line, row
+
+
+def to_price(value, field, required=True):
+    if value in (None, ''):
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    if isinstance(value, bool):
+        raise RowError(f'{field} must be a number, got {value!r}')
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be a number, got {value!r}')
+    if price < 0:
+        raise RowError(f'{field} can not be negative')
+    return price
+
+
+def text(value, field):
+    #JSONL values can be of any type, numbers are taken as their text and
+    #anything else is an error of the row, not of the whole import
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise RowError(f'{field} must be text, got {value!r}')
+
+
+def clean_row(row):
+    title = text(row.get('title'), 'title')
+    if not title:
+        raise RowError('title is required')
+    slug = slugify(text(row.get('slug'), 'slug') or title)
+    if not slug:
+        raise RowError('slug is empty')
+    label = text(row.get('label'), 'label') or None
+    if label and label not in LABELS:
+        raise RowError(f'unknown label {label!r}')
+    label_name = text(row.get('label_name'), 'label_name') or None
+    if label_name and label_name not in LABEL_NAMES:
+        raise RowError(f'unknown label_name {label_name!r}')
+    image = text(row.get('image'), 'image')
+    if not image:
+        raise RowError('image is required')
+    if not isinstance(row['categories'], list):
+        raise RowError(f"categories must be a list, got {row['categories']!r}")
+    categories = [text(name, 'category') for name in row['categories']]
+    return {
+        'title': title[:200],
+        'slug': slug[:50],
+        'price': to_price(row.get('price'), 'price'),
+        'discount_price': to_price(row.get('discount_price'), 'discount_price', required=False),
+        'description': text(row.get('description'), 'description'),
+        'label': label,
+        'label_name': label_name,
+        'list_on_frontpage': str(row.get('list_on_frontpage') or '').strip().lower() in TRUE_VALUES,
+        'categories': [name[:40] for name in categories if name],
+        'image': image,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Bulk load products from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file, '-' reads stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--image-dir', default='.', help='Directory relative image paths are read from')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=8, help='Threads copying images and making thumbnails')
+        parser.add_argument('--skip-thumbnails', action='store_true',
+                            help='Only copy images, run generate_thumbnails later')
+
+    def open_stream(self, path):
+        if path == '-':
+            return sys.stdin
+        try:
+            return open(path, encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(str(e))
+
+    def store_image(self, source):
+        #returns the storage name for an image given as a URL, a local file
+        #or a name that is already in storage, runs on a worker thread
+        if urlparse(source).scheme in ('http', 'https'):
+            name = os.path.basename(urlparse(source).path) or 'image.jpg'
+            with urlopen(source, timeout=DOWNLOAD_TIMEOUT) as response:
+                name = default_storage.save(name, ContentFile(response.read()))
+        else:
+            path = os.path.join(self.image_dir, source)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    name = default_storage.save(os.path.basename(path), File(f))
+            elif default_storage.exists(source):
+                name = source
+            else:
+                raise RowError(f'image {source!r} not found')
+        if not self.skip_thumbnails:
+            generate_derivatives(name)
+        return name
+
+    def fetch_image(self, source):
+        try:
+            return self.store_image(source), None
+        except RowError as e:
+            return None, str(e)
+        except (OSError, ValueError) as e:
+            return None, f'image {source!r}: {e}'
+
+    def category_ids(self, names):
+        #get or bulk create the categories of a batch, remembered across batches
+        wanted = {slugify(name): name for name in names if slugify(name)}
+        missing = [slug for slug in wanted if slug not in self.categories]
+        if missing:
+            found = dict(Category.objects.filter(slug__in=missing).order_by('-id').values_list('slug', 'id'))
+            new = [Category(title=wanted[slug], slug=slug) for slug in missing if slug not in found]
+            if new:
+                Category.objects.bulk_create(new)
+                found.update(Category.objects.filter(slug__in=[c.slug for c in new]).values_list('slug', 'id'))
+            self.categories.update(found)
+
+    def load_batch(self, batch, executor):
+        rows = []
+        for line, row in batch:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                rows.append((line, clean_row(row)))
+            except RowError as e:
+                self.error(line, e)
+
+        #slugs already in the catalog or repeated in the file are skipped
+        existing = set(Item.objects.filter(slug__in=[row['slug'] for line, row in rows]).values_list('slug', flat=True))
+        unique = []
+        for line, row in rows:
+            if row['slug'] in existing:
+                self.error(line, f"an item with slug {row['slug']!r} already exists")
+                continue
+            existing.add(row['slug'])
+            unique.append((line, row))
+
+        #each distinct source is copied once per run however many rows share it
+        sources = list({row['image'] for line, row in unique} - set(self.images))
+        self.images.update(zip(sources, executor.map(self.fetch_image, sources)))
+        ready = []
+        for line, row in unique:
+            name, error = self.images[row['image']]
+            if error:
+                self.error(line, error)
+            else:
+                row['image'] = name
+                ready.append(row)
+        if not ready:
+            return 0
+
+        with transaction.atomic():
+            self.category_ids(name for row in ready for name in row['categories'])
+            Item.objects.bulk_create([
+                Item(effective_price=sale_price(row['price'], row['discount_price']),
+                     **{key: value for key, value in row.items() if key != 'categories'})
+                for row in ready
+            ])
+            #bulk_create only returns primary keys on PostgreSQL
+            ids = dict(Item.objects.filter(slug__in=[row['slug'] for row in ready]).values_list('slug', 'id'))
+            Through = Item.category.through
+            Through.objects.bulk_create([
+                Through(item_id=ids[row['slug']], category_id=category_id)
+                for row in ready
+                for category_id in {self.categories[slugify(name)] for name in row['categories'] if slugify(name)}
+            ])
+            #bulk_create skips the signals that maintain the search index and the page cache
+            search.index_items(ids.values())
+            transaction.on_commit(page_cache.invalidate)
+        return len(ready)
+
+    def error(self, line, message):
+        self.errors += 1
+        self.stderr.write(f'line {line}: {message}')
+
+    def handle(self, *args, **kwargs):
+        path = kwargs['path']
+        fmt = kwargs['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        self.image_dir = kwargs['image_dir']
+        self.skip_thumbnails = kwargs['skip_thumbnails']
+        self.categories = {}
+        self.images = {}
+        self.errors = 0
+
+        started = time.monotonic()
+        created = seen = 0
+        with self.open_stream(path) as stream, ThreadPoolExecutor(max_workers=kwargs['workers']) as executor:
+            reader = read_jsonl(stream) if fmt == 'jsonl' else read_csv(stream)
+            while True:
+                batch = list(islice(reader, kwargs['batch_size']))
+                if not batch:
+                    break
+                created += self.load_batch(batch, executor)
+                seen += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write('%d rows read, %d items created, %d errors, %.0f rows/s' % (
+                    seen, created, self.errors, seen / elapsed if elapsed else 0))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d of %d rows in %.1fs (%.0f items/s), %d errors' % (
+                created, seen, elapsed, created / elapsed if elapsed else 0, self.errors)
+        ))
@@ -0,0 +1,80 @@
+import csv
+import io
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from myapp import zipcodes
+from myapp.models import CheckZipcode
+
+
+class Command(BaseCommand):
+    help = 'Load serviceable zipcodes (or 5600* prefixes and 560001-560099 ranges) from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file, '-' reads stdin")
+        parser.add_argument('--column', default='0',
+                            help='Column holding the zipcode, a header name or a 0-based position')
+        parser.add_argument('--replace', action='store_true', help='Delete every existing zipcode first')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def rows(self, stream, column):
+        #yields one value per line without reading the whole file
+        reader = csv.reader(stream)
+        if column.isdigit():
+            position = int(column)
+        else:
+            header = next(reader, [])
+            if column not in header:
+                raise CommandError(f'No column named {column!r}, the header has: {", ".join(header)}')
+            position = header.index(column)
+        for row in reader:
+            if len(row) > position:
+                yield row[position]
+
+    def handle(self, *args, **kwargs):
+        path = kwargs['path']
+        batch_size = kwargs['batch_size']
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        else:
+            try:
+                stream = open(path, encoding='utf-8-sig', newline='')
+            except OSError as e:
+                raise CommandError(str(e))
+
+        started = time.monotonic()
+        created = skipped = invalid = 0
+        with stream, transaction.atomic():
+            if kwargs['replace']:
+                CheckZipcode.objects.all().delete()
+                seen = set()
+            else:
+                seen = set(CheckZipcode.objects.values_list('zipcode', flat=True).iterator())
+            batch = []
+            for value in self.rows(stream, kwargs['column']):
+                value = zipcodes.normalize(value)
+                if zipcodes.parse_rule(value) is None or len(value) > 20:
+                    invalid += value != ''
+                    continue
+                if value in seen:
+                    skipped += 1
+                    continue
+                seen.add(value)
+                batch.append(CheckZipcode(zipcode=value))
+                if len(batch) >= batch_size:
+                    CheckZipcode.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            if batch:
+                CheckZipcode.objects.bulk_create(batch)
+                created += len(batch)
+            #bulk_create skips the signals that refresh the index
+            transaction.on_commit(zipcodes.invalidate)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d zipcodes in %.1fs, %d already present, %d invalid' % (
+                created, time.monotonic() - started, skipped, invalid)
+        ))
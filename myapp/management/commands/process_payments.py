@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.payments import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Charge queued payment attempts, run it next to the web workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the queue once and exit')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--batch-size', type=int, default=50, help='Attempts claimed per pass')
+
+    def handle(self, *args, **kwargs):
+        while True:
+            results = process_pending(kwargs['batch_size'])
+            if any(results.values()):
+                self.stdout.write('%d succeeded, %d failed, %d queued for retry' % (
+                    results['succeeded'], results['failed'], results['retry']))
+            if kwargs['once']:
+                break
+            if sum(results.values()) < kwargs['batch_size']:
+                time.sleep(kwargs['interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index from the catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=search.INDEX_BATCH_SIZE,
+                            help='Number of items indexed per batch')
+
+    def handle(self, *args, **kwargs):
+        if search.get_backend() is None:
+            self.stdout.write(self.style.WARNING('This database has no search index, search falls back to substring matching'))
+            return
+        started = time.monotonic()
+        with transaction.atomic():
+            total = search.rebuild_index(batch_size=kwargs['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS('Indexed %d items in %.2fs' % (total, elapsed)))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from myapp.instrumentation import get_stats, reset_stats, percentile
+
+
+class Command(BaseCommand):
+    help = 'Print request count, latency percentiles, queries and DB time per URL name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=['name', 'count', 'p95', 'queries'], default='p95')
+        parser.add_argument('--reset', action='store_true', help='Clear the collected statistics')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Request statistics cleared'))
+            return
+
+        stats = get_stats()
+        if not stats:
+            #workers write their counters every few seconds, and only a
+            #shared CACHE_BACKEND shows other processes
+            self.stdout.write('No request statistics found in the cache')
+            return
+
+        rows = []
+        for name, row in stats.items():
+            count = row['count'] or 1
+            rows.append({
+                'name': name,
+                'count': row['count'],
+                'mean': row['total_us'] / count / 1000,
+                'p50': percentile(row, 0.50),
+                'p95': percentile(row, 0.95),
+                'p99': percentile(row, 0.99),
+                'queries': row['queries'] / count,
+                'db': row['db_us'] / count / 1000,
+                'template': row['template_us'] / count / 1000,
+            })
+        sort = kwargs['sort']
+        rows.sort(key=lambda row: row[sort], reverse=sort != 'name')
+
+        self.stdout.write('%-40s %8s %9s %9s %9s %9s %8s %9s %9s' % (
+            'url name', 'requests', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'db ms', 'tpl ms'))
+        for row in rows:
+            self.stdout.write('%-40s %8d %9.1f %9.1f %9.1f %9.1f %8.1f %9.1f %9.1f' % (
+                row['name'], row['count'], row['mean'], row['p50'], row['p95'], row['p99'],
+                row['queries'], row['db'], row['template']))
@@ -0,0 +1,194 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from myapp import search
+from myapp.models import (
+    Item, Category, OrderItem, Order, BilingAddress, UserProfile, Payment, PAST_ORDER_STATUSES, sale_price,
+)
+
+
+SEED_BATCH_SIZE = 5000
+USER_PREFIX = 'bench-user-'
+ITEM_PREFIX = 'bench-item-'
+CATEGORY_PREFIX = 'bench-category-'
+PASSWORD = 'bench'
+#titles are built from these so searches for any of them hit a realistic share of the catalog
+WORDS = (
+    'cotton', 'denim', 'leather', 'linen', 'wool', 'silk', 'sport', 'casual', 'formal', 'summer',
+    'winter', 'classic', 'slim', 'regular', 'shirt', 'tshirt', 'jeans', 'jacket', 'dress', 'shoes',
+)
+
+
+def batches(total):
+    for start in range(0, total, SEED_BATCH_SIZE):
+        yield range(start, min(start + SEED_BATCH_SIZE, total))
+
+
+def last_ids(model, count):
+    #bulk_create only returns primary keys on PostgreSQL. Nothing else writes
+    #during the seed, so the new rows are the highest ids, in creation order
+    ids = list(model.objects.order_by('-id').values_list('id', flat=True)[:count])
+    ids.reverse()
+    return ids
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic users, products and order history for bench'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--items', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=50000, help='Placed orders spread over the last year')
+        parser.add_argument('--clear', action='store_true', help='Delete data from an earlier seed_bench run first')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+
+    def clear(self):
+        User = get_user_model()
+        #deleting the users cascades to their addresses, carts and orders,
+        #payments only lose their user
+        Payment.objects.filter(user__username__startswith=USER_PREFIX).delete()
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+        items = list(Item.objects.filter(slug__startswith=ITEM_PREFIX).values_list('id', flat=True))
+        Item.objects.filter(slug__startswith=ITEM_PREFIX).delete()
+        search.remove_items(items)
+        Category.objects.filter(slug__startswith=CATEGORY_PREFIX).delete()
+
+    def seed_catalog(self, rng, categories, items):
+        Category.objects.bulk_create([
+            Category(title=f'Bench category {i}', slug=f'{CATEGORY_PREFIX}{i}') for i in range(categories)
+        ])
+        category_ids = list(Category.objects.filter(slug__startswith=CATEGORY_PREFIX).values_list('id', flat=True))
+        #reuse the images of the real catalog so the pages render like production
+        images = list(Item.objects.exclude(slug__startswith=ITEM_PREFIX).values_list('image', flat=True)[:20]) or ['sample.jpg']
+        Through = Item.category.through
+        for batch in batches(items):
+            rows = []
+            for i in batch:
+                price = rng.randrange(199, 9999)
+                discount_price = price * 9 // 10 if i % 3 == 0 else None
+                rows.append(Item(
+                    title=' '.join(rng.sample(WORDS, 3)).title(),
+                    price=price,
+                    discount_price=discount_price,
+                    effective_price=sale_price(price, discount_price),
+                    image=images[i % len(images)],
+                    slug=f'{ITEM_PREFIX}{i}',
+                    description=' '.join(rng.choice(WORDS) for _ in range(30)),
+                    list_on_frontpage=i % 10 == 0,
+                ))
+            Item.objects.bulk_create(rows)
+            ids = last_ids(Item, len(rows))
+            Through.objects.bulk_create([
+                Through(item_id=pk, category_id=category_id)
+                for pk in ids for category_id in rng.sample(category_ids, min(2, len(category_ids)))
+            ])
+            #bulk_create skips the signals that maintain the search index
+            search.index_items(ids)
+        return list(Item.objects.filter(slug__startswith=ITEM_PREFIX).values_list('id', 'price', 'discount_price'))
+
+    def seed_users(self, users):
+        User = get_user_model()
+        #hashing is slow on purpose, every bench user shares one hash
+        password = make_password(PASSWORD)
+        for batch in batches(users):
+            User.objects.bulk_create([
+                User(username=f'{USER_PREFIX}{i}', email=f'{USER_PREFIX}{i}@example.com', password=password)
+                for i in batch
+            ])
+        user_ids = list(User.objects.filter(username__startswith=USER_PREFIX).order_by('id').values_list('id', flat=True))
+        #bulk_create skips the post_save signal that creates the profile
+        for start in range(0, len(user_ids), SEED_BATCH_SIZE):
+            chunk = user_ids[start:start + SEED_BATCH_SIZE]
+            UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in chunk])
+            BilingAddress.objects.bulk_create([
+                BilingAddress(user_id=pk, street_address=f'{pk} Bench street', apartment_address='1',
+                              country='IN', zipcode='560001', address_type='Home', default_address=True)
+                for pk in chunk
+            ])
+        return dict(BilingAddress.objects.filter(user__username__startswith=USER_PREFIX).values_list('user_id', 'id'))
+
+    def seed_orders(self, rng, orders, addresses, items):
+        now = timezone.now()
+        user_ids = list(addresses)
+        statuses = list(PAST_ORDER_STATUSES)
+        Through = Order.items.through
+        for batch in batches(orders):
+            placed = []
+            for i in batch:
+                user_id = rng.choice(user_ids)
+                placed.append((
+                    Order(user_id=user_id, order_id=f'bench{i:015d}', ordered=True, status=rng.choice(statuses),
+                          ordered_date=now - timedelta(minutes=rng.randrange(525600)),
+                          billing_address_id=addresses[user_id]),
+                    [(item, rng.randint(1, 3)) for item in rng.sample(items, rng.randint(1, 3))],
+                ))
+            Payment.objects.bulk_create([
+                Payment(stripe_charge_id=order.order_id, user_id=order.user_id,
+                        amount=sum((discount or price) * quantity for (pk, price, discount), quantity in lines))
+                for order, lines in placed
+            ])
+            for (order, lines), payment_id in zip(placed, last_ids(Payment, len(placed))):
+                order.payment_id = payment_id
+            Order.objects.bulk_create([order for order, lines in placed])
+            order_ids = last_ids(Order, len(placed))
+
+            line_rows = [
+                (order_id, OrderItem(user_id=order.user_id, item_id=pk, quantity=quantity, ordered=True))
+                for (order, lines), order_id in zip(placed, order_ids)
+                for (pk, price, discount), quantity in lines
+            ]
+            OrderItem.objects.bulk_create([line for order_id, line in line_rows])
+            Through.objects.bulk_create([
+                Through(order_id=order_id, orderitem_id=line_id)
+                for (order_id, line), line_id in zip(line_rows, last_ids(OrderItem, len(line_rows)))
+            ])
+            Order.objects.filter(id__gte=order_ids[0], id__lte=order_ids[-1]).update_totals()
+            self.stdout.write(f'{batch.stop} orders')
+
+    def seed_carts(self, rng, addresses, items):
+        #every bench user starts with an open cart, so the checkout scenario
+        #renders the checkout page instead of redirecting away from it
+        now = timezone.now()
+        user_ids = list(addresses)
+        Through = Order.items.through
+        for start in range(0, len(user_ids), SEED_BATCH_SIZE):
+            chunk = user_ids[start:start + SEED_BATCH_SIZE]
+            Order.objects.bulk_create([Order(user_id=pk, ordered_date=now) for pk in chunk])
+            order_ids = last_ids(Order, len(chunk))
+            OrderItem.objects.bulk_create([
+                OrderItem(user_id=pk, item_id=rng.choice(items)[0], quantity=1) for pk in chunk
+            ])
+            Through.objects.bulk_create([
+                Through(order_id=order_id, orderitem_id=line_id)
+                for order_id, line_id in zip(order_ids, last_ids(OrderItem, len(chunk)))
+            ])
+            Order.objects.filter(id__gte=order_ids[0], id__lte=order_ids[-1]).update_totals()
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs['seed'])
+        started = time.monotonic()
+        with transaction.atomic():
+            if kwargs['clear']:
+                self.clear()
+            elif Item.objects.filter(slug__startswith=ITEM_PREFIX).exists():
+                raise CommandError('The database already holds bench data, run with --clear to replace it')
+            items = self.seed_catalog(rng, kwargs['categories'], kwargs['items'])
+            self.stdout.write(f'{len(items)} items in {kwargs["categories"]} categories')
+            addresses = self.seed_users(kwargs['users'])
+            self.stdout.write(f'{len(addresses)} users with an address')
+            if kwargs['orders'] and items and addresses:
+                self.seed_orders(rng, kwargs['orders'], addresses, items)
+            if items and addresses:
+                self.seed_carts(rng, addresses, items)
+                self.stdout.write(f'{len(addresses)} open carts')
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded in %.1fs, bench users log in with password %r' % (time.monotonic() - started, PASSWORD)
+        ))
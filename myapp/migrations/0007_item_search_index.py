@@ -0,0 +1,54 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE myapp_item_fts USING fts5("
+    "title, categories, description, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO myapp_item_fts (rowid, title, categories, description) "
+    "SELECT i.id, i.title, COALESCE((SELECT group_concat(c.title, ' ') FROM myapp_item_category ic "
+    "JOIN myapp_category c ON c.id = ic.category_id WHERE ic.item_id = i.id), ''), i.description "
+    "FROM myapp_item i",
+]
+
+SQLITE_DROP = [
+    "DROP TABLE IF EXISTS myapp_item_fts",
+]
+
+POSTGRES_CREATE = [
+    "CREATE TABLE myapp_item_search ("
+    "item_id integer PRIMARY KEY REFERENCES myapp_item (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX myapp_item_search_document ON myapp_item_search USING gin (document)",
+    "INSERT INTO myapp_item_search (item_id, document) "
+    "SELECT i.id, "
+    "setweight(to_tsvector('simple', i.title), 'A') || "
+    "setweight(to_tsvector('simple', COALESCE((SELECT string_agg(c.title, ' ') FROM myapp_item_category ic "
+    "JOIN myapp_category c ON c.id = ic.category_id WHERE ic.item_id = i.id), '')), 'B') || "
+    "setweight(to_tsvector('simple', i.description), 'C') "
+    "FROM myapp_item i",
+]
+
+POSTGRES_DROP = [
+    "DROP TABLE IF EXISTS myapp_item_search",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_order_canceled'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.1.5 on 2026-10-18 17:07
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model('myapp', 'Order')
+    OrderItem = apps.get_model('myapp', 'OrderItem')
+    DiscountCode = apps.get_model('myapp', 'DiscountCode')
+    line_total = models.ExpressionWrapper(
+        models.F('quantity') * Coalesce('item__discount_price', 'item__price'),
+        output_field=models.FloatField()
+    )
+    subtotal = Coalesce(models.Subquery(
+        OrderItem.objects.filter(order=models.OuterRef('pk')).order_by()
+        .values('order').annotate(total=models.Sum(line_total)).values('total'),
+        output_field=models.FloatField()
+    ), 0.0)
+    discount = Coalesce(models.Subquery(
+        DiscountCode.objects.filter(pk=models.OuterRef('coupon_id')).values('amount')[:1],
+        output_field=models.FloatField()
+    ), 0.0)
+    last_id = Order.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        Order.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).update(
+            subtotal=subtotal, discount=discount, total=subtotal - discount
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,90 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+#partial unique indexes: one open order per user and one open line per
+#(user, item). Created as raw SQL when the project was on Django 2.1, 0017
+#replaces them with the UniqueConstraints declared on the models
+INDEXES = {
+    'sqlite': [
+        "CREATE UNIQUE INDEX myapp_order_one_open_cart ON myapp_order (user_id) WHERE ordered = 0",
+        "CREATE UNIQUE INDEX myapp_orderitem_one_open_line ON myapp_orderitem (user_id, item_id) WHERE ordered = 0",
+    ],
+    'postgresql': [
+        "CREATE UNIQUE INDEX myapp_order_one_open_cart ON myapp_order (user_id) WHERE NOT ordered",
+        "CREATE UNIQUE INDEX myapp_orderitem_one_open_line ON myapp_orderitem (user_id, item_id) WHERE NOT ordered",
+    ],
+}
+
+DROP_INDEXES = [
+    "DROP INDEX IF EXISTS myapp_order_one_open_cart",
+    "DROP INDEX IF EXISTS myapp_orderitem_one_open_line",
+]
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('myapp', 'Order')
+    OrderItem = apps.get_model('myapp', 'OrderItem')
+    Through = Order.items.through
+    changed_orders = set()
+
+    #users with several open orders keep the oldest one with every line merged in
+    duplicated = Order.objects.filter(ordered=False).values('user').annotate(n=Count('id')).filter(n__gt=1)
+    for row in duplicated:
+        orders = list(Order.objects.filter(user=row['user'], ordered=False).order_by('id'))
+        keep = orders[0]
+        for other in orders[1:]:
+            kept_lines = Through.objects.filter(order=keep).values('orderitem')
+            Through.objects.filter(order=other).exclude(orderitem__in=kept_lines).update(order=keep)
+            other.delete()
+        changed_orders.add(keep.pk)
+
+    #open lines for the same item are folded into one, lines that were removed
+    #from the cart but left behind don't count
+    duplicated = OrderItem.objects.filter(ordered=False).values('user', 'item').annotate(n=Count('id')).filter(n__gt=1)
+    for row in duplicated:
+        lines = list(OrderItem.objects.filter(ordered=False, user=row['user'], item=row['item']).order_by('id'))
+        linked = set(Through.objects.filter(orderitem__in=lines).values_list('orderitem_id', flat=True))
+        in_cart = [line for line in lines if line.pk in linked] or lines[:1]
+        keep = in_cart[0]
+        keep.quantity = sum(line.quantity for line in in_cart)
+        keep.save()
+        for line in in_cart[1:]:
+            Through.objects.filter(orderitem=line).exclude(order__items=keep).update(orderitem=keep)
+        changed_orders.update(Through.objects.filter(orderitem=keep).values_list('order_id', flat=True))
+        OrderItem.objects.filter(pk__in=[line.pk for line in lines if line.pk != keep.pk]).delete()
+
+    OrderItem.objects.filter(ordered=False, order__isnull=True).delete()
+
+    for order in Order.objects.filter(pk__in=changed_orders).select_related('coupon'):
+        subtotal = sum(
+            line.quantity * (line.item.discount_price or line.item.price)
+            for line in order.items.select_related('item')
+        )
+        order.subtotal = subtotal
+        order.discount = order.coupon.amount if order.coupon else 0
+        order.total = order.subtotal - order.discount
+        order.save()
+
+
+def create_indexes(apps, schema_editor):
+    for statement in INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in INDEXES:
+        for statement in DROP_INDEXES:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_item_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,133 @@
+# Generated by Django 2.1.5 on 2026-10-18 17:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Case, Max, Q, Value, When
+from importlib import import_module
+
+
+BATCH_SIZE = 1000
+
+#the flags were set on top of each other (a refund request kept delivered
+#set), so the most advanced one decides the status
+FLAG_ORDER = (
+    'refund_granted',
+    'refund_requested',
+    'canceled',
+    'returned',
+    'delivered',
+    'out_for_delivery',
+    'shipped',
+    'in_transit',
+)
+
+
+def id_batches(Order):
+    last_id = Order.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        yield Order.objects.filter(id__gt=start, id__lte=start + BATCH_SIZE)
+
+
+def backfill_status(apps, schema_editor):
+    Order = apps.get_model('myapp', 'Order')
+    #placed orders always started in transit, so one with no flag left is still there
+    status = Case(
+        When(ordered=False, then=Value('cart')),
+        *[When(Q(**{flag: True}), then=Value(flag)) for flag in FLAG_ORDER],
+        default=Value('in_transit'),
+        output_field=models.CharField()
+    )
+    for batch in id_batches(Order):
+        batch.update(status=status)
+
+
+def restore_flags(apps, schema_editor):
+    Order = apps.get_model('myapp', 'Order')
+    for batch in id_batches(Order):
+        for flag in FLAG_ORDER:
+            batch.filter(status=flag).update(**{flag: True})
+
+
+#on SQLite every RemoveField below rebuilds myapp_order, which drops the raw
+#partial indexes 0010 created. Put them back once the rebuilds are done,
+#0017 replaces them with constraints the migration state tracks
+unique_open_cart = import_module('myapp.migrations.0010_unique_open_cart')
+
+
+def recreate_open_cart_indexes(apps, schema_editor):
+    for statement in unique_open_cart.INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement.replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX IF NOT EXISTS'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myapp', '0011_payment_attempt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('cart', 'Cart'), ('in_transit', 'In Transit'), ('shipped', 'Shipped'), ('out_for_delivery', 'Out for delivery'), ('delivered', 'Delivered'), ('returned', 'Returned'), ('refund_requested', 'Refund request inprogress'), ('refund_granted', 'Refunded'), ('canceled', 'Canceled')], max_length=20)),
+                ('to_status', models.CharField(choices=[('cart', 'Cart'), ('in_transit', 'In Transit'), ('shipped', 'Shipped'), ('out_for_delivery', 'Out for delivery'), ('delivered', 'Delivered'), ('returned', 'Returned'), ('refund_requested', 'Refund request inprogress'), ('refund_granted', 'Refunded'), ('canceled', 'Canceled')], max_length=20)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('cart', 'Cart'), ('in_transit', 'In Transit'), ('shipped', 'Shipped'), ('out_for_delivery', 'Out for delivery'), ('delivered', 'Delivered'), ('returned', 'Returned'), ('refund_requested', 'Refund request inprogress'), ('refund_granted', 'Refunded'), ('canceled', 'Canceled')], db_index=True, default='cart', max_length=20),
+        ),
+        migrations.RunPython(backfill_status, restore_flags),
+        migrations.RemoveField(
+            model_name='order',
+            name='canceled',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='delivered',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='in_transit',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='out_for_delivery',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='refund_granted',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='refund_requested',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='returned',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='shipped',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='myapp_order_user_id_e2de58_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderstatuschange',
+            name='changed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='orderstatuschange',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='myapp.Order'),
+        ),
+        migrations.RunPython(recreate_open_cart_indexes, migrations.RunPython.noop),
+    ]
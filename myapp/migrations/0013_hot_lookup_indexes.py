@@ -0,0 +1,40 @@
+# Generated by Django 2.1.5 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_order_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='checkzipcode',
+            name='zipcode',
+            field=models.CharField(db_index=True, max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='discountcode',
+            name='promo_code',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['list_on_frontpage', 'id'], name='myapp_item_list_on_634c3f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'ordered'], name='myapp_order_user_id_abdfbb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['item', 'user', 'ordered'], name='myapp_order_item_id_0fde1a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='checkzipcode',
+            name='zipcode',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+    ]
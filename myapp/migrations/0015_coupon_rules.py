@@ -0,0 +1,81 @@
+# Generated by Django 2.1.5 on 2026-10-18 17:23
+
+from importlib import import_module
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+#adding the coupon column rebuilds myapp_paymentattempt on SQLite and the
+#rebuild drops the partial index 0011 created outside the migration state
+payment_attempt = import_module('myapp.migrations.0011_payment_attempt')
+
+
+def recreate_one_active_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(payment_attempt.ONE_ACTIVE_ATTEMPT.replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX IF NOT EXISTS'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myapp', '0014_zipcode_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discountcode',
+            name='active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='discountcode',
+            name='max_uses',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='discountcode',
+            name='max_uses_per_user',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='discountcode',
+            name='min_subtotal',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discountcode',
+            name='times_used',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='discountcode',
+            name='valid_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='discountcode',
+            name='valid_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='coupon',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='myapp.DiscountCode'),
+        ),
+        migrations.RunPython(recreate_one_active_index, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='CouponUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.DiscountCode')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('coupon', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 2.1.5 on 2026-10-18 17:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+BATCH_SIZE = 1000
+
+
+def flatten_wishlists(apps, schema_editor):
+    #the items linked to each user's open wishlist, once per (user, item)
+    Wishlish = apps.get_model('myapp', 'Wishlish')
+    WishlistItem = apps.get_model('myapp', 'WishlistItem')
+    rows = Wishlish.item.through.objects.filter(
+        wishlish__wishlisted=False, wishlisteditem__item__isnull=False
+    ).values_list('wishlish__user_id', 'wishlisteditem__item_id', 'wishlish__wishlisted_date')
+    added = {}
+    for user_id, item_id, date in rows.iterator():
+        key = (user_id, item_id)
+        if key not in added or date < added[key]:
+            added[key] = date
+    entries = [WishlistItem(user_id=user_id, item_id=item_id, added=date) for (user_id, item_id), date in added.items()]
+    WishlistItem.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+
+def nest_wishlists(apps, schema_editor):
+    Wishlish = apps.get_model('myapp', 'Wishlish')
+    WishlistedItem = apps.get_model('myapp', 'WishlistedItem')
+    WishlistItem = apps.get_model('myapp', 'WishlistItem')
+    by_user = {}
+    for entry in WishlistItem.objects.order_by('user_id', 'added').iterator():
+        by_user.setdefault(entry.user_id, []).append(entry)
+    for user_id, entries in by_user.items():
+        wishlist = Wishlish.objects.create(user_id=user_id, wishlisted_date=entries[0].added)
+        wishlist.item.add(*[
+            WishlistedItem.objects.create(user_id=user_id, item_id=entry.item_id) for entry in entries
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myapp', '0015_coupon_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WishlistItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('added', models.DateTimeField(default=django.utils.timezone.now)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.Item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wishlist', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'item')},
+            },
+        ),
+        migrations.RunPython(flatten_wishlists, nest_wishlists),
+        migrations.RemoveField(
+            model_name='wishlisteditem',
+            name='item',
+        ),
+        migrations.RemoveField(
+            model_name='wishlisteditem',
+            name='user',
+        ),
+        migrations.DeleteModel(
+            name='Wishlish',
+        ),
+        migrations.DeleteModel(
+            name='WishlistedItem',
+        ),
+    ]
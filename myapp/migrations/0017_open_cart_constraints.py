@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:00
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+#0010 created these as raw partial indexes the migration state didn't know
+#about, so table rebuilds on SQLite dropped them without a word. They are
+#declared on the models now, Django recreates them whenever it rebuilds a table
+unique_open_cart = import_module('myapp.migrations.0010_unique_open_cart')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_flat_wishlist'),
+    ]
+
+    operations = [
+        #carts and lines duplicated while the index was missing are merged
+        #first, then the raw index is replaced by the tracked constraint
+        migrations.RunPython(unique_open_cart.merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.RunPython(unique_open_cart.drop_indexes, unique_open_cart.create_indexes),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user',), name='myapp_order_one_open_cart'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user', 'item'), name='myapp_orderitem_one_open_line'),
+        ),
+    ]
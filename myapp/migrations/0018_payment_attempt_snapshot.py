@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+def snapshot_queued_attempts(apps, schema_editor):
+    #attempts queued before the upgrade pay for the cart as it is now
+    PaymentAttempt = apps.get_model('myapp', 'PaymentAttempt')
+    Order = apps.get_model('myapp', 'Order')
+    for attempt in PaymentAttempt.objects.filter(status__in=('pending', 'processing')):
+        lines = Order.items.through.objects.filter(order_id=attempt.order_id).order_by('orderitem_id')
+        attempt.lines = ','.join(f'{line.orderitem_id}:{line.orderitem.quantity}' for line in lines.select_related('orderitem'))
+        attempt.save(update_fields=['lines'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0017_open_cart_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='charge_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='lines',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(snapshot_queued_attempts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:10
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+#the raw index from 0011 was dropped by every rebuild of myapp_paymentattempt
+#on SQLite (0015 and 0018 both add columns). It is declared on the model now
+payment_attempt = import_module('myapp.migrations.0011_payment_attempt')
+
+
+def fail_duplicate_attempts(apps, schema_editor):
+    #orders queued twice while the index was missing keep their oldest
+    #active attempt, the others fail and give their coupon use back
+    PaymentAttempt = apps.get_model('myapp', 'PaymentAttempt')
+    DiscountCode = apps.get_model('myapp', 'DiscountCode')
+    CouponUsage = apps.get_model('myapp', 'CouponUsage')
+    active = PaymentAttempt.objects.filter(status__in=['pending', 'processing'])
+    duplicated = active.values('order').annotate(n=Count('id')).filter(n__gt=1)
+    for row in duplicated:
+        for attempt in active.filter(order=row['order']).order_by('id')[1:]:
+            attempt.status = 'failed'
+            attempt.error = 'Queued twice, only the first payment was kept'
+            attempt.save(update_fields=['status', 'error'])
+            if attempt.coupon_id:
+                DiscountCode.objects.filter(pk=attempt.coupon_id, times_used__gt=0).update(times_used=F('times_used') - 1)
+                CouponUsage.objects.filter(coupon_id=attempt.coupon_id, user_id=attempt.user_id, count__gt=0).update(count=F('count') - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0018_payment_attempt_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_attempts, migrations.RunPython.noop),
+        migrations.RunPython(payment_attempt.drop_index, payment_attempt.create_index),
+        migrations.AddConstraint(
+            model_name='paymentattempt',
+            constraint=models.UniqueConstraint(condition=models.Q(status__in=['pending', 'processing']), fields=('order',), name='myapp_paymentattempt_one_active'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:40
+
+from django.conf import settings
+from django.db import migrations
+
+
+#the user admin searches emails by prefix. auth_user.email has no index of its
+#own, these are the ones a startswith LIKE can use: SQLite's LIKE ignores case
+#so the index must too, PostgreSQL needs the pattern operator class
+INDEXES = {
+    'sqlite': "CREATE INDEX IF NOT EXISTS myapp_user_email_prefix ON auth_user (email COLLATE NOCASE)",
+    'postgresql': "CREATE INDEX IF NOT EXISTS myapp_user_email_prefix ON auth_user (email varchar_pattern_ops)",
+}
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor in INDEXES:
+        schema_editor.execute(INDEXES[schema_editor.connection.vendor])
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS myapp_user_email_prefix")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('myapp', '0019_payment_attempt_one_active'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
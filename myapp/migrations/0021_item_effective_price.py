@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import Case, F, Q, When
+
+
+def fill_effective_price(apps, schema_editor):
+    #models.sale_price() in SQL: a discount price of 0 or none means no discount
+    Item = apps.get_model('myapp', 'Item')
+    Item.objects.update(effective_price=Case(
+        When(Q(discount_price__isnull=False) & ~Q(discount_price=0), then=F('discount_price')),
+        default=F('price'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0020_user_email_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='effective_price',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['effective_price', 'id'], name='myapp_item_effecti_feeda8_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0021_item_effective_price'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='paymentattempt',
+            old_name='tries',
+            new_name='attempts',
+        ),
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.shortcuts import reverse
+from django.utils import timezone
 from django_countries.fields import CountryField
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -30,6 +32,41 @@ ADDRESS_TYPE_CHOICES = (
     ('Other', 'Other')
 )
 
+ORDER_STATUS_CHOICES = (
+    ('cart', 'Cart'),
+    ('in_transit', 'In Transit'),
+    ('shipped', 'Shipped'),
+    ('out_for_delivery', 'Out for delivery'),
+    ('delivered', 'Delivered'),
+    ('returned', 'Returned'),
+    ('refund_requested', 'Refund request inprogress'),
+    ('refund_granted', 'Refunded'),
+    ('canceled', 'Canceled'),
+)
+
+#statuses an order may move to from each status, anything else is rejected
+ORDER_TRANSITIONS = {
+    'cart': ('in_transit',),
+    'in_transit': ('shipped', 'canceled', 'refund_requested'),
+    'shipped': ('out_for_delivery', 'canceled', 'refund_requested'),
+    'out_for_delivery': ('delivered', 'canceled', 'refund_requested'),
+    'delivered': ('returned', 'canceled', 'refund_requested'),
+    'returned': ('refund_requested',),
+    'canceled': ('refund_requested',),
+    'refund_requested': ('refund_granted',),
+    'refund_granted': (),
+}
+
+ACTIVE_ORDER_STATUSES = ('in_transit', 'shipped', 'out_for_delivery')
+PAST_ORDER_STATUSES = ('delivered', 'returned', 'refund_requested', 'refund_granted', 'canceled')
+
+#orders moved per transaction by the bulk admin actions
+TRANSITION_CHUNK_SIZE = 500
+
+
+class InvalidTransition(Exception):
+    pass
+
 
 class Category(models.Model):
     title = models.CharField(max_length=40)
@@ -60,6 +97,27 @@ class UserProfile(models.Model):
         instance.userprofile.save()
 
 
+#columns a product card needs on the grid pages
+CATALOG_CARD_FIELDS = (
+    'id', 'title', 'price', 'discount_price', 'effective_price', 'image',
+    'label', 'label_name', 'slug',
+)
+
+
+def sale_price(price, discount_price):
+    #the price an item sells at, the same rule as the templates and
+    #OrderItem.get_final_price: a discount price of 0 or none means no discount
+    return discount_price or price
+
+
+class ItemQuerySet(models.QuerySet):
+    def catalog(self):
+        #load only the card columns and fetch every category of the page in one query
+        return self.only(*CATALOG_CARD_FIELDS).prefetch_related(
+            models.Prefetch('category', queryset=Category.objects.only('id', 'title', 'slug'))
+        ).order_by('id')
+
+
 # Create your models here.
 class Item(models.Model):
     title = models.CharField(max_length=200)
@@ -73,11 +131,37 @@ class Item(models.Model):
     slug = models.SlugField()
     description = models.TextField()
     list_on_frontpage = models.BooleanField(default=False, blank=True, null=True)
-    
+    #bumped on every change so cached fragments of the item go stale
+    version = models.PositiveIntegerField(default=1, editable=False)
+    #sale_price() stored so the price sort of the listing pages can walk an
+    #index, set by save(), code that bulk creates items must set it too
+    effective_price = models.FloatField(default=0, editable=False)
+
+    objects = ItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            #the home page lists frontpage items in id order
+            models.Index(fields=['list_on_frontpage', 'id']),
+            #keyset pages sorted by price, see pagination.ORDERINGS
+            models.Index(fields=['effective_price', 'id']),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.effective_price = sale_price(self.price, self.discount_price)
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        #bump the stored version, category changes move it with an UPDATE
+        #behind this instance's back and a stale one would be written again
+        self.version = models.F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = list(kwargs['update_fields']) + ['version', 'effective_price']
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
 
     def get_absolute_url(self):
         return reverse('product-page', kwargs={
@@ -110,6 +194,16 @@ class OrderItem(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'user', 'ordered']),
+        ]
+        constraints = [
+            #one open line per (user, item), concurrent adds update it instead
+            models.UniqueConstraint(fields=['user', 'item'], condition=models.Q(ordered=False),
+                                    name='myapp_orderitem_one_open_line'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
 
@@ -128,9 +222,52 @@ class OrderItem(models.Model):
         return self.get_total_item_price()
 
 
+class OrderQuerySet(models.QuerySet):
+    def update_totals(self):
+        #recompute the stored totals of every order in the queryset with a
+        #single UPDATE, the line sums come from a correlated aggregate
+        line_total = models.ExpressionWrapper(
+            models.F('quantity') * models.F('item__effective_price'),
+            output_field=models.FloatField()
+        )
+        subtotal = Coalesce(models.Subquery(
+            OrderItem.objects.filter(order=models.OuterRef('pk')).order_by()
+            .values('order').annotate(total=models.Sum(line_total)).values('total'),
+            output_field=models.FloatField()
+        ), 0.0)
+        discount = Coalesce(models.Subquery(
+            DiscountCode.objects.filter(pk=models.OuterRef('coupon_id')).values('amount')[:1],
+            output_field=models.FloatField()
+        ), 0.0)
+        return self.update(subtotal=subtotal, discount=discount, total=subtotal - discount)
+
+    def transition(self, status, user=None, chunk_size=TRANSITION_CHUNK_SIZE):
+        #moves every order in the queryset that is allowed to reach status,
+        #locking and updating one chunk per transaction. Orders in any other
+        #status are skipped, returns how many were moved
+        sources = [source for source, targets in ORDER_TRANSITIONS.items() if status in targets]
+        queryset = self.filter(status__in=sources).order_by('id')
+        moved = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                rows = list(queryset.select_for_update().filter(id__gt=last_id).values_list('id', 'status')[:chunk_size])
+                if not rows:
+                    break
+                ids = [pk for pk, old in rows]
+                Order.objects.filter(id__in=ids).update(status=status)
+                OrderStatusChange.objects.bulk_create([
+                    OrderStatusChange(order_id=pk, from_status=old, to_status=status, changed_by=user)
+                    for pk, old in rows
+                ])
+            moved += len(rows)
+            last_id = ids[-1]
+        return moved
+
+
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    order_id = models.CharField(max_length=50)
+    order_id = models.CharField(max_length=50, db_index=True)
     items = models.ManyToManyField(OrderItem)
     start_date = models.DateTimeField(auto_now_add=True)
     ordered_date = models.DateTimeField()
@@ -138,26 +275,48 @@ class Order(models.Model):
     billing_address = models.ForeignKey('BilingAddress', on_delete=models.SET_NULL, blank=True, null=True)
     payment = models.ForeignKey('Payment', on_delete=models.SET_NULL, blank=True, null=True)
     coupon = models.ForeignKey('DiscountCode', on_delete=models.SET_NULL, blank=True, null=True)
-    in_transit = models.BooleanField(default=False)
-    shipped = models.BooleanField(default=False)
-    out_for_delivery = models.BooleanField(default=False)
-    delivered = models.BooleanField(default=False)
-    returned = models.BooleanField(default=False)
-    refund_requested = models.BooleanField(default=False)
-    refund_granted = models.BooleanField(default=False)
-    canceled = models.BooleanField(default=False)
+    status = models.CharField(choices=ORDER_STATUS_CHOICES, max_length=20, default='cart', db_index=True)
+    #denormalized totals, kept in sync by update_totals() on every cart change
+    subtotal = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    total = models.FloatField(default=0)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'ordered']),
+            models.Index(fields=['user', 'status']),
+        ]
+        constraints = [
+            #one open cart per user, see cart.get_open_order
+            models.UniqueConstraint(fields=['user'], condition=models.Q(ordered=False),
+                                    name='myapp_order_one_open_cart'),
+        ]
 
 
     def __str__(self):
         return self.user.username
 
+    def transition(self, status, user=None, **fields):
+        #validated status change, extra fields are written in the same UPDATE
+        if status not in ORDER_TRANSITIONS.get(self.status, ()):
+            raise InvalidTransition(f"{self.get_status_display()} order can't become {status}")
+        with transaction.atomic():
+            #the status guard makes a concurrent change win instead of being overwritten
+            if not Order.objects.filter(pk=self.pk, status=self.status).update(status=status, **fields):
+                raise InvalidTransition('Order status was changed by someone else')
+            OrderStatusChange.objects.create(order=self, from_status=self.status, to_status=status, changed_by=user)
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def update_totals(self):
+        Order.objects.filter(pk=self.pk).update_totals()
+        self.refresh_from_db(fields=['subtotal', 'discount', 'total'])
+
     def get_total(self):
-        total = 0
-        for order_item in self.items.all():
-            total += order_item.get_final_price()
-        if self.coupon:
-            total -= self.coupon.amount
-        return total
+        return self.total
 
 
 class BilingAddress(models.Model):
@@ -188,44 +347,122 @@ class Payment(models.Model):
         return self.user.username
 
 
-#wishlisted products
-class WishlistedItem(models.Model):
+#append-only log of order status changes
+class OrderStatusChange(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_history')
+    from_status = models.CharField(choices=ORDER_STATUS_CHOICES, max_length=20)
+    to_status = models.CharField(choices=ORDER_STATUS_CHOICES, max_length=20)
+    changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.order_id}: {self.from_status} -> {self.to_status}"
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError('Order status history can not be edited')
+        super().save(*args, **kwargs)
+
+
+PAYMENT_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('processing', 'Processing'),
+    ('succeeded', 'Succeeded'),
+    ('failed', 'Failed'),
+)
+
+
+#a queued charge for an order, the payment worker picks up pending attempts
+#and sends the idempotency key with the charge so a retry never bills twice
+class PaymentAttempt(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    item = models.ForeignKey(Item, on_delete=models.CASCADE, blank=True, null=True)
-    wishlisted = models.BooleanField(default=False)
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    token = models.CharField(max_length=255)
+    amount = models.FloatField()
+    status = models.CharField(choices=PAYMENT_STATUS_CHOICES, max_length=10, default='pending', db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    #a retried charge waits in pending until then, see payments.backoff
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error = models.CharField(max_length=255, blank=True)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, blank=True, null=True)
+    #line:quantity pairs of the cart when it was queued, see payments.cart_snapshot
+    lines = models.TextField(blank=True, default='')
+    #set as soon as Stripe accepted the charge, before the order is placed
+    charge_id = models.CharField(max_length=50, blank=True)
+    #coupon use reserved for this attempt, given back if the charge fails
+    coupon = models.ForeignKey('DiscountCode', on_delete=models.SET_NULL, blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            #one pending or processing attempt per order, a double submit
+            #can't queue a second charge
+            models.UniqueConstraint(fields=['order'], condition=models.Q(status__in=['pending', 'processing']),
+                                    name='myapp_paymentattempt_one_active'),
+        ]
 
     def __str__(self):
-        return f"{self.item.title}"
+        return self.idempotency_key
 
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
 
-class Wishlish(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    item = models.ManyToManyField(WishlistedItem)
-    wishlisted = models.BooleanField(default=False)
-    wishlisted_date = models.DateTimeField(auto_now_add=False)
+
+#one row per product on a user's wishlist
+class WishlistItem(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wishlist')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    added = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user', 'item')
 
     def __str__(self):
-        return self.user.username
+        return f"{self.item.title}"
 
 
 #check in which area you service 
 class CheckZipcode(models.Model):
-    zipcode = models.CharField(max_length=10)
+    #an exact zipcode, a prefix rule like 5600* or a range like 560001-560099
+    zipcode = models.CharField(max_length=20, db_index=True)
 
     def __str__(self):
         return self.zipcode
 
 
 class DiscountCode(models.Model):
-    promo_code = models.CharField(max_length=20)
+    promo_code = models.CharField(max_length=20, db_index=True)
     amount = models.FloatField()
     description = models.CharField(max_length=200, blank=True, null=True)
+    #campaign rules, empty means no limit
+    active = models.BooleanField(default=True)
+    valid_from = models.DateTimeField(blank=True, null=True)
+    valid_until = models.DateTimeField(blank=True, null=True)
+    min_subtotal = models.FloatField(default=0)
+    max_uses = models.PositiveIntegerField(blank=True, null=True)
+    max_uses_per_user = models.PositiveIntegerField(blank=True, null=True)
+    #only ever changed with conditional F() updates, see coupons.reserve_coupon
+    times_used = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.promo_code
 
 
+#how often each user has redeemed a code
+class CouponUsage(models.Model):
+    coupon = models.ForeignKey(DiscountCode, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('coupon', 'user')
+
+    def __str__(self):
+        return f"{self.coupon} used {self.count} times by {self.user}"
+
+
 class Refund(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     reason = models.TextField()
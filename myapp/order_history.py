@@ -0,0 +1,39 @@
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .pagination import QuerySetSource, get_page
+
+
+ORDER_HISTORY_PAGE_SIZE = 10
+#the lines of a placed order never change, only its status moves on, so
+#the rendered lines are kept until the cache evicts them
+SUMMARY_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def summary_key(order_id):
+    return f'order-summary:{order_id}'
+
+
+def attach_summaries(orders):
+    #sets order.summary to the rendered line cells of every order, the
+    #orders missing from the cache get their lines in two queries together
+    keys = {order.pk: summary_key(order.pk) for order in orders}
+    summaries = cache.get_many(list(keys.values()))
+    missing = [order for order in orders if keys[order.pk] not in summaries]
+    if missing:
+        prefetch_related_objects(missing, 'items__item')
+        rendered = {keys[order.pk]: render_to_string('order_lines.html', {'order': order}) for order in missing}
+        cache.set_many(rendered, SUMMARY_TIMEOUT)
+        summaries.update(rendered)
+    for order in orders:
+        order.summary = mark_safe(summaries[keys[order.pk]])
+
+
+def get_order_history(request, queryset):
+    #one page of the user's placed orders, newest first, in a fixed number of queries
+    queryset = queryset.filter(user=request.user).select_related('billing_address__user', 'payment')
+    page = get_page(QuerySetSource(queryset, ('-id',)), request, ORDER_HISTORY_PAGE_SIZE)
+    attach_summaries(page.object_list)
+    return page
@@ -0,0 +1,109 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.cache import get_cache_key, learn_cache_key
+
+
+KEY_PREFIX = 'shared-page'
+#moved by every catalog change, pages rendered under an older stamp are stale
+VERSION_KEY = 'shared-page:version'
+#how long a request regenerating a stale page keeps the others on the old copy
+REFRESH_LOCK_TIMEOUT = 30
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    #every cached page goes stale at once, each is rendered again on its next hit
+    cache.set(VERSION_KEY, time.time(), None)
+
+
+def is_cacheable_request(request):
+    #everyone without a pending message gets the shared page, signed in
+    #visitors fill in their own parts from the user_fragments view.
+    #len() doesn't mark the messages as read, they are still shown later
+    return request.method in ('GET', 'HEAD') and not len(messages.get_messages(request))
+
+
+def render_shared(view, request, *args, **kwargs):
+    #renders the page as an anonymous visitor sees it, marked so base.html
+    #asks user_fragments for the parts that belong to the real visitor
+    user = request.user
+    request.user = AnonymousUser()
+    request.shared_page = True
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+    finally:
+        request.user = user
+        del request.shared_page
+
+
+def is_cacheable_response(request, response):
+    #a page with a CSRF token or a cookie of its own belongs to one visitor
+    return (
+        request.method == 'GET'
+        and response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def get_cached(request):
+    #returns (response, state), response None when the page must be rendered
+    key = get_cache_key(request, KEY_PREFIX, 'GET', cache=cache)
+    if key is None:
+        return None, 'miss'
+    entry = cache.get(key)
+    if entry is None:
+        return None, 'miss'
+    version, created, response = entry
+    if version == current_version() and time.time() - created < settings.PAGE_CACHE_TIMEOUT:
+        return response, 'hit'
+    #stale: the first request renders the page again, the others keep
+    #getting the old copy until it is stored
+    if cache.add(f'{key}:refreshing', 1, REFRESH_LOCK_TIMEOUT):
+        return None, 'refresh'
+    return response, 'stale'
+
+
+def store(request, response, version):
+    if not is_cacheable_response(request, response):
+        return
+    timeout = settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_STALE
+    key = learn_cache_key(request, response, timeout, KEY_PREFIX, cache=cache)
+    cache.set(key, (version, time.time(), response), timeout)
+    cache.delete(f'{key}:refreshing')
+
+
+def cache_shared_page(view):
+    #full page cache for the storefront pages every visitor shares.
+    #Pages are fresh for PAGE_CACHE_TIMEOUT seconds or until the catalog
+    #changes, then served stale for up to PAGE_CACHE_STALE more seconds
+    #while a single request renders them again
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.PAGE_CACHE_ENABLED or not is_cacheable_request(request):
+            return view(request, *args, **kwargs)
+        response, state = get_cached(request)
+        if response is None:
+            #read before rendering, a change made meanwhile leaves the page stale
+            version = current_version()
+            response = render_shared(view, request, *args, **kwargs)
+            store(request, response, version)
+        response['X-Page-Cache'] = state
+        return response
+    return wrapper
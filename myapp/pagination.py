@@ -0,0 +1,184 @@
+import base64
+import json
+import math
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+#sort options offered on listing pages, every one ends on the primary key
+#so the key is unique and the order is stable
+ORDERINGS = {
+    'newest': ('-id',),
+    'oldest': ('id',),
+    'price': ('effective_price', 'id'),
+    '-price': ('-effective_price', '-id'),
+}
+DEFAULT_ORDERING = 'oldest'
+#below this many rows an exact COUNT(*) is cheap enough to keep
+ESTIMATE_ABOVE = 100000
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def is_key_value(value):
+    #every sort key is a number (ids, prices, search scores) that fits a 64 bit column
+    return (
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+        and math.isfinite(value) and abs(value) < 2 ** 63
+    )
+
+
+def decode_cursor(token):
+    #a cursor that was tampered with is treated as no cursor, the first page
+    if not token:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(key, list) or not all(is_key_value(value) for value in key):
+        return None
+    return tuple(key)
+
+
+def get_ordering(request):
+    sort = request.GET.get('sort')
+    return sort if sort in ORDERINGS else DEFAULT_ORDERING
+
+
+class QuerySetSource:
+    #seeks through a queryset with WHERE (key) > (cursor) instead of OFFSET
+    def __init__(self, queryset, keys):
+        self.queryset = queryset
+        self.keys = keys
+        self.fields = [key.lstrip('-') for key in keys]
+
+    def seek(self, key, forward):
+        #expands (a, b) > (x, y) into a >= x AND (a > x OR (a = x AND b > y)),
+        #the redundant a >= x lets the index on (a, b) start at the cursor
+        condition = Q()
+        for i, order in enumerate(self.keys):
+            ascending = not order.startswith('-')
+            lookup = 'gt' if ascending == forward else 'lt'
+            step = Q(**{f'{self.fields[i]}__{lookup}': key[i]})
+            for field, value in zip(self.fields[:i], key[:i]):
+                step &= Q(**{field: value})
+            condition |= step
+        lookup = 'gte' if self.keys[0].startswith('-') != forward else 'lte'
+        return Q(**{f'{self.fields[0]}__{lookup}': key[0]}) & condition
+
+    def fetch(self, key, forward, limit):
+        if forward:
+            ordering = self.keys
+        else:
+            ordering = [order[1:] if order.startswith('-') else '-' + order for order in self.keys]
+        queryset = self.queryset.order_by(*ordering)
+        if key is not None and len(key) == len(self.keys):
+            queryset = queryset.filter(self.seek(key, forward))
+        return [
+            (tuple(getattr(obj, field) for field in self.fields), obj)
+            for obj in queryset[:limit]
+        ]
+
+
+class KeysetPage:
+    def __init__(self, rows, has_next, has_previous, params):
+        self.object_list = [obj for key, obj in rows]
+        self.has_next_page = has_next and bool(rows)
+        self.has_previous_page = has_previous and bool(rows)
+        self.first_key = rows[0][0] if rows else None
+        self.last_key = rows[-1][0] if rows else None
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    def link(self, name, key):
+        params = self.params.copy()
+        for param in ('after', 'before', 'page'):
+            params.pop(param, None)
+        params[name] = encode_cursor(key)
+        return params.urlencode()
+
+    def next_query(self):
+        return self.link('after', self.last_key) if self.has_next_page else ''
+
+    def previous_query(self):
+        return self.link('before', self.first_key) if self.has_previous_page else ''
+
+
+def get_page(source, request, per_page):
+    #one extra row tells whether there is another page in that direction
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+    if before is not None:
+        rows = source.fetch(before, False, per_page + 1)
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        has_next = True
+    else:
+        rows = source.fetch(after, True, per_page + 1)
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_previous = after is not None
+    return KeysetPage(rows, has_next, has_previous, request.GET)
+
+
+class KeysetPaginationMixin:
+    #drop-in replacement for ListView's OFFSET pagination
+    def paginate_queryset(self, queryset, page_size):
+        source = QuerySetSource(queryset, ORDERINGS[get_ordering(self.request)])
+        page = get_page(source, self.request, page_size)
+        return (None, page, page.object_list, page.has_other_pages())
+
+
+def estimated_rows(model, using='default'):
+    #the row count the planner statistics hold for the table, None when the
+    #table was never analyzed or the database keeps no such statistics
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] > 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    #an unfiltered changelist of a big table takes its page count from the
+    #table statistics instead of a COUNT(*) over every row. Filtered lists
+    #and small tables still get the exact count
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > ESTIMATE_ABOVE:
+                return estimate
+        return super().count
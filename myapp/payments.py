@@ -0,0 +1,214 @@
+import random
+import string
+import uuid
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cart import invalidate_cart_count
+from .coupons import reserve_coupon, release_coupon
+from .models import Order, Payment, PaymentAttempt, InvalidTransition
+
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.api_base = settings.STRIPE_API_BASE
+
+#a charge that hit a rate limit or a network error is queued again, each
+#time waiting twice as long, until it has been tried this many times
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(minutes=30)
+#an attempt stuck in processing this long belongs to a worker that died
+STALE_AFTER = timedelta(minutes=5)
+ACTIVE = ('pending', 'processing')
+
+#same wording the checkout used to flash when the charge ran in the view
+ERROR_MESSAGES = (
+    (stripe.error.RateLimitError, 'Rate limit error'),
+    (stripe.error.InvalidRequestError, 'Invalid request error'),
+    (stripe.error.AuthenticationError, 'Not authenticated'),
+    (stripe.error.APIConnectionError, 'API connection error'),
+    (stripe.error.StripeError, 'Something went wrong'),
+)
+RETRYABLE = (stripe.error.RateLimitError, stripe.error.APIConnectionError)
+CART_CHANGED = 'Your cart changed while the payment was queued, please check out again'
+
+
+class CartChanged(Exception):
+    pass
+
+
+def create_order_id():
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
+
+
+def cart_snapshot(order):
+    #the lines and quantities being paid for, compared again before charging
+    #and before the order is placed
+    return ','.join(f'{pk}:{quantity}' for pk, quantity in order.items.order_by('pk').values_list('pk', 'quantity'))
+
+
+def cart_unchanged(attempt, order):
+    return order.total == attempt.amount and cart_snapshot(order) == attempt.lines
+
+
+def enqueue_payment(order, token):
+    #one active attempt per order (a conditional unique constraint backs this up),
+    #so a double submit gets the attempt that is already queued
+    existing = PaymentAttempt.objects.filter(order=order, status__in=ACTIVE).first()
+    if existing is not None:
+        return existing
+    try:
+        with transaction.atomic():
+            #the coupon use is taken before charging, raises CouponError
+            #when the code ran out, and is undone if the insert loses a race
+            if order.coupon_id:
+                reserve_coupon(order.coupon, order.user, order.subtotal)
+            return PaymentAttempt.objects.create(
+                order=order,
+                user_id=order.user_id,
+                idempotency_key=f'order-{order.pk}-{uuid.uuid4().hex}',
+                token=token or '',
+                amount=order.total,
+                lines=cart_snapshot(order),
+                coupon_id=order.coupon_id,
+            )
+    except IntegrityError:
+        return PaymentAttempt.objects.get(order=order, status__in=ACTIVE)
+
+
+def claim(attempt_id):
+    #only one worker wins the pending -> processing transition
+    return PaymentAttempt.objects.filter(pk=attempt_id, status='pending').update(
+        status='processing', attempts=F('attempts') + 1, updated=timezone.now()
+    ) == 1
+
+
+def backoff(attempts):
+    #30s after the first try, then 1m, 2m, 4m... at most MAX_RETRY_DELAY
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def requeue_stale(now=None):
+    #attempts left in processing by a worker that died are queued again
+    #with the same backoff, or given up once they used all their tries
+    now = now or timezone.now()
+    requeued = 0
+    stale = PaymentAttempt.objects.filter(status='processing', updated__lt=now - STALE_AFTER)
+    for attempt in stale.select_related('user'):
+        if attempt.attempts >= MAX_ATTEMPTS:
+            if not stale.filter(pk=attempt.pk).update(status='failed', updated=now):
+                continue
+            error = 'The payment could not be processed, please try again'
+            if attempt.charge_id:
+                refund(attempt, attempt.charge_id, error)
+            else:
+                fail(attempt, error)
+        elif stale.filter(pk=attempt.pk).update(status='pending', next_attempt_at=now + backoff(attempt.attempts), updated=now):
+            requeued += 1
+    return requeued
+
+
+def error_message(error):
+    if isinstance(error, stripe.error.CardError):
+        return (error.json_body or {}).get('error', {}).get('message') or 'Your card was declined'
+    for error_class, message in ERROR_MESSAGES:
+        if isinstance(error, error_class):
+            return message
+    return 'Something went wrong! we are taking note of it'
+
+
+def finish(attempt, status, **fields):
+    PaymentAttempt.objects.filter(pk=attempt.pk).update(status=status, updated=timezone.now(), **fields)
+
+
+def fail(attempt, error):
+    finish(attempt, 'failed', error=error[:255])
+    if attempt.coupon_id:
+        release_coupon(attempt.coupon_id, attempt.user_id)
+
+
+def finalize_order(attempt, charge_id):
+    #places exactly the cart that was charged, raises CartChanged when a
+    #line, a quantity or a price moved since the attempt was queued and
+    #InvalidTransition when the order was placed some other way meanwhile
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=attempt.order_id)
+        if not cart_unchanged(attempt, order):
+            raise CartChanged(CART_CHANGED)
+        payment = Payment.objects.create(
+            stripe_charge_id=charge_id,
+            user_id=attempt.user_id,
+            amount=attempt.amount,
+        )
+        #every line in one UPDATE instead of a save() per item
+        order.items.update(ordered=True)
+        order.transition(
+            'in_transit',
+            user=attempt.user,
+            ordered=True,
+            payment=payment,
+            order_id=create_order_id(),
+        )
+        finish(attempt, 'succeeded', payment=payment, error='')
+        invalidate_cart_count(attempt.user)
+    return payment
+
+
+def refund(attempt, charge_id, error):
+    #the charge went through but the order can't be placed, give the money
+    #back. A failed refund is left in the error for staff to handle
+    try:
+        stripe.Refund.create(charge=charge_id, idempotency_key=f'{attempt.idempotency_key}-refund')
+    except Exception as e:
+        error = f'Charged {charge_id} but not refunded ({error_message(e)}): {error}'
+    else:
+        error = f'{error}, you have not been charged'
+    fail(attempt, error)
+
+
+def process_attempt(attempt):
+    #the attempt must already be claimed by this worker
+    if not cart_unchanged(attempt, Order.objects.get(pk=attempt.order_id)):
+        fail(attempt, CART_CHANGED)
+        return 'failed'
+    try:
+        charge = stripe.Charge.create(
+            amount=int(round(attempt.amount * 100)),
+            currency='inr',
+            source=attempt.token,
+            idempotency_key=attempt.idempotency_key,
+        )
+    except Exception as e:
+        if isinstance(e, RETRYABLE) and attempt.attempts < MAX_ATTEMPTS:
+            finish(attempt, 'pending', error=error_message(e),
+                   next_attempt_at=timezone.now() + backoff(attempt.attempts))
+            return 'retry'
+        fail(attempt, error_message(e))
+        return 'failed'
+    #recorded on its own first, so the charge isn't lost whatever happens next
+    finish(attempt, 'processing', charge_id=charge['id'])
+    try:
+        finalize_order(attempt, charge['id'])
+    except (CartChanged, InvalidTransition) as e:
+        refund(attempt, charge['id'], str(e))
+        return 'failed'
+    return 'succeeded'
+
+
+def process_pending(limit=50):
+    #claims and charges up to limit queued attempts that are due, oldest first
+    requeue_stale()
+    results = {'succeeded': 0, 'failed': 0, 'retry': 0}
+    due = PaymentAttempt.objects.filter(status='pending', next_attempt_at__lte=timezone.now())
+    ids = list(due.order_by('id').values_list('id', flat=True)[:limit])
+    for attempt_id in ids:
+        if not claim(attempt_id):
+            continue
+        attempt = PaymentAttempt.objects.select_related('user').get(pk=attempt_id)
+        results[process_attempt(attempt)] += 1
+    return results
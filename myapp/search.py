@@ -0,0 +1,216 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Item
+from .pagination import ORDERINGS, DEFAULT_ORDERING, QuerySetSource
+
+
+#how many items are loaded and written to the index per round trip
+INDEX_BATCH_SIZE = 500
+
+TERM_RE = re.compile(r'\w+')
+
+
+def get_terms(query):
+    return TERM_RE.findall((query or '').lower())[:10]
+
+
+class SearchBackend:
+    table = None
+
+    def ranked(self, terms):
+        #returns (sql, params) selecting (id, score) for every match, lower scores rank first
+        raise NotImplementedError
+
+    def seek(self, terms, key, forward, limit):
+        #keyset over (score, id) so every results page costs the same
+        sql, params = self.ranked(terms)
+        where = ''
+        if key is not None and len(key) == 2:
+            op = '>' if forward else '<'
+            where = f'WHERE score {op} %s OR (score = %s AND id {op} %s)'
+            params += [key[0], key[0], key[1]]
+        direction = 'ASC' if forward else 'DESC'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id, score FROM ({sql}) ranked {where} '
+                f'ORDER BY score {direction}, id {direction} LIMIT %s',
+                params + [limit]
+            )
+            return cursor.fetchall()
+
+
+class SqliteSearchBackend(SearchBackend):
+    #FTS5 virtual table, the rowid is the item id
+    table = 'myapp_item_fts'
+
+    def match(self, terms):
+        return ' '.join('"%s"*' % term for term in terms)
+
+    def ranked(self, terms):
+        #bm25 weights: title, categories, description
+        return (
+            f'SELECT rowid AS id, bm25({self.table}, 10.0, 5.0, 1.0) AS score '
+            f'FROM {self.table} WHERE {self.table} MATCH %s',
+            [self.match(terms)]
+        )
+
+    def index(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, categories, description) VALUES (%s, %s, %s, %s)',
+                rows
+            )
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+
+class PostgresSearchBackend(SearchBackend):
+    #side table holding a weighted tsvector per item with a GIN index on it
+    table = 'myapp_item_search'
+
+    def tsquery(self, terms):
+        return ' & '.join('%s:*' % term for term in terms)
+
+    def ranked(self, terms):
+        #ts_rank grows with relevance, negate it to sort the same way as bm25
+        return (
+            f"SELECT item_id AS id, -ts_rank(document, query)::float8 AS score "
+            f"FROM {self.table}, to_tsquery('simple', %s) query WHERE document @@ query",
+            [self.tsquery(terms)]
+        )
+
+    def index(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (item_id, document) VALUES (%s, "
+                f"setweight(to_tsvector('simple', %s), 'A') || "
+                f"setweight(to_tsvector('simple', %s), 'B') || "
+                f"setweight(to_tsvector('simple', %s), 'C')) "
+                f"ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE item_id = ANY(%s)', [list(ids)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    backend = BACKENDS.get(connection.vendor)
+    return backend() if backend else None
+
+
+def build_rows(items):
+    return [
+        (item.id, item.title, ' '.join(cat.title for cat in item.category.all()), item.description)
+        for item in items
+    ]
+
+
+def index_items(ids):
+    backend = get_backend()
+    if backend is None:
+        return
+    ids = list(ids)
+    for start in range(0, len(ids), INDEX_BATCH_SIZE):
+        batch = ids[start:start + INDEX_BATCH_SIZE]
+        items = Item.objects.filter(id__in=batch).only('id', 'title', 'description').prefetch_related('category')
+        rows = build_rows(items)
+        backend.index(rows)
+        #ids that no longer exist are dropped from the index
+        missing = set(batch) - {row[0] for row in rows}
+        if missing:
+            backend.remove(missing)
+
+
+def remove_items(ids):
+    backend = get_backend()
+    if backend is not None:
+        backend.remove(list(ids))
+
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE):
+    #walk the catalog by primary key so memory stays flat however big it is
+    backend = get_backend()
+    if backend is None:
+        return 0
+    backend.clear()
+    total = 0
+    last_id = 0
+    while True:
+        items = list(
+            Item.objects.filter(id__gt=last_id).order_by('id')
+            .only('id', 'title', 'description').prefetch_related('category')[:batch_size]
+        )
+        if not items:
+            break
+        backend.index(build_rows(items))
+        total += len(items)
+        last_id = items[-1].id
+    return total
+
+
+def matching_items(query):
+    #Item queryset of every match, for lookups that filter on it instead of
+    #ranking, like the admin autocomplete
+    terms = get_terms(query)
+    backend = get_backend()
+    if not terms:
+        return Item.objects.none()
+    if backend is None:
+        queryset = Item.objects.all()
+        for term in terms:
+            queryset = queryset.filter(title__icontains=term)
+        return queryset
+    sql, params = backend.ranked(terms)
+    #not id__in=RawSQL(), which adds a second pair of parentheses around the
+    #subquery and so turns it into a scalar one that only yields its first id
+    column = f'{connection.ops.quote_name(Item._meta.db_table)}.{connection.ops.quote_name("id")}'
+    return Item.objects.extra(where=[f'{column} IN (SELECT id FROM ({sql}) ranked)'], params=params)
+
+
+class SearchResults:
+    #keyset source for get_page(): ranked by relevance when the index is
+    #available, otherwise a plain catalog listing in the requested order
+    def __init__(self, query, ordering=DEFAULT_ORDERING):
+        self.terms = get_terms(query)
+        self.backend = get_backend()
+        self.ordering = ordering
+
+    def use_index(self):
+        return bool(self.terms) and self.backend is not None
+
+    def fallback(self):
+        #an empty query lists the whole catalog, databases without a
+        #search index keep the old substring search
+        queryset = Item.objects.catalog()
+        for term in self.terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(category__title__icontains=term))
+        return QuerySetSource(queryset.distinct() if self.terms else queryset, ORDERINGS[self.ordering])
+
+    def fetch(self, key, forward, limit):
+        if not self.use_index():
+            return self.fallback().fetch(key, forward, limit)
+        rows = self.backend.seek(self.terms, key, forward, limit)
+        items = Item.objects.catalog().in_bulk([pk for pk, score in rows])
+        return [((score, pk), items[pk]) for pk, score in rows if pk in items]
@@ -0,0 +1,95 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+
+#changes to these keys (logging in or out, a new expiry) reach the
+#database straight away, everything else is coalesced
+DURABLE_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY, '_session_expiry')
+CLEANUP_BATCH_SIZE = 1000
+#caches whose entries other worker processes never see
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def durable_state(data):
+    return tuple(data.get(key) for key in DURABLE_KEYS)
+
+
+def is_shared(cache):
+    return not isinstance(cache, PROCESS_LOCAL_CACHES)
+
+
+class SessionStore(CachedDBStore):
+    #sessions are read from the cache and every save lands there, but the
+    #database row is only rewritten when a durable key changed or the last
+    #write is older than SESSION_DB_WRITE_INTERVAL seconds. Messages that
+    #overflow their cookie into the session only cost a cache write.
+    #A cache that loses an entry loses at most that many seconds of changes.
+    #With a cache every process keeps for itself the workers would each see
+    #their own copy of the session, so then it is read and written in the
+    #database only, like the db engine
+    cache_key_prefix = 'coalesced-session:'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._flushed = None
+        self._durable = None
+        self.coalesce = is_shared(self._cache)
+
+    def remember(self, data, flushed):
+        self._flushed = flushed
+        self._durable = durable_state(data)
+        return {'data': data, 'flushed': flushed}
+
+    def load(self):
+        if not self.coalesce:
+            return DBStore.load(self)
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            #memcached raises on invalid keys, start a new session like cached_db does
+            entry = None
+        if entry is None:
+            s = self._get_session_from_db()
+            if not s:
+                return {}
+            entry = self.remember(self.decode(s.session_data), time.time())
+            self._cache.set(self.cache_key, entry, self.get_expiry_age(expiry=s.expire_date))
+            return entry['data']
+        self.remember(entry['data'], entry['flushed'])
+        return entry['data']
+
+    def save(self, must_create=False):
+        if not self.coalesce:
+            return DBStore.save(self, must_create)
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        flushed = self._flushed
+        if (must_create or flushed is None or durable_state(data) != self._durable
+                or time.time() - flushed >= settings.SESSION_DB_WRITE_INTERVAL):
+            DBStore.save(self, must_create)
+            flushed = time.time()
+        self._cache.set(self.cache_key, self.remember(data, flushed), self.get_expiry_age())
+
+    @classmethod
+    def clear_expired(cls, batch_size=CLEANUP_BATCH_SIZE, pause=0):
+        #many short DELETEs on the expire_date index instead of one that
+        #locks the table for as long as it takes, returns the number removed
+        Session = cls.get_model_class()
+        now = timezone.now()
+        removed = 0
+        while True:
+            keys = list(Session.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:batch_size])
+            if not keys:
+                return removed
+            Session.objects.filter(session_key__in=keys).delete()
+            removed += len(keys)
+            if pause:
+                time.sleep(pause)
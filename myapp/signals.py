@@ -0,0 +1,126 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Item, Category, Order, DiscountCode, CheckZipcode
+from . import search, zipcodes, coupons, page_cache
+from .images import generate_derivatives_later
+
+
+#keep the search index in step with the catalog
+@receiver(post_save, sender=Item)
+def index_saved_item(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_deleted_item(sender, instance, **kwargs):
+    search.remove_items([instance.pk])
+
+
+def category_items_changed(ids):
+    #items whose category list or category titles changed: reindex them and
+    #bump their version so cached product fragments are rendered again
+    ids = list(ids)
+    if ids:
+        search.index_items(ids)
+        Item.objects.filter(pk__in=ids).update(version=F('version') + 1)
+        transaction.on_commit(page_cache.invalidate)
+
+
+@receiver(m2m_changed, sender=Item.category.through)
+def item_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        #the category loses all its items, remember which ones changed
+        instance._changed_item_ids = list(instance.item_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            category_items_changed([instance.pk])
+        elif action == 'post_clear':
+            category_items_changed(getattr(instance, '_changed_item_ids', []))
+        else:
+            category_items_changed(pk_set)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        category_items_changed(instance.item_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_items(sender, instance, **kwargs):
+    instance._changed_item_ids = list(instance.item_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    category_items_changed(getattr(instance, '_changed_item_ids', []))
+
+
+#open carts store their totals, reprice them when an item or coupon changes
+@receiver(post_save, sender=Item)
+def reprice_open_orders(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        Order.objects.filter(ordered=False, items__item=instance).update_totals()
+
+
+@receiver(post_save, sender=DiscountCode)
+def reprice_coupon_orders(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        Order.objects.filter(ordered=False, coupon=instance).update_totals()
+
+
+@receiver(pre_delete, sender=DiscountCode)
+def remember_coupon_orders(sender, instance, **kwargs):
+    instance._open_order_ids = list(Order.objects.filter(ordered=False, coupon=instance).values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=DiscountCode)
+def reprice_uncouponed_orders(sender, instance, **kwargs):
+    Order.objects.filter(id__in=getattr(instance, '_open_order_ids', [])).update_totals()
+
+
+#resized and WebP copies of a new upload for the product grids, only when
+#the image changed: price edits and version bumps save items all the time
+@receiver(pre_save, sender=Item)
+def remember_image_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not instance.image or (update_fields is not None and 'image' not in update_fields):
+        instance._image_changed = False
+        return
+    stored = Item.objects.filter(pk=instance.pk).values_list('image', flat=True).first() if instance.pk else None
+    instance._image_changed = instance.image.name != stored
+
+
+@receiver(post_save, sender=Item)
+def generate_item_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and getattr(instance, '_image_changed', False):
+        name = instance.image.name
+        transaction.on_commit(lambda: generate_derivatives_later(name))
+
+
+#rebuild the zipcode index once the change is committed, earlier and a
+#process could reload the old rows under the new version
+@receiver(post_save, sender=CheckZipcode)
+@receiver(post_delete, sender=CheckZipcode)
+def zipcodes_changed(sender, **kwargs):
+    transaction.on_commit(zipcodes.invalidate)
+
+
+@receiver(post_save, sender=DiscountCode)
+@receiver(post_delete, sender=DiscountCode)
+def coupons_changed(sender, **kwargs):
+    transaction.on_commit(coupons.invalidate)
+
+
+#the shared storefront pages are rendered from items and categories,
+#mark them stale once the change is visible to the request rendering them again
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(page_cache.invalidate)
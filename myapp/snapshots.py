@@ -0,0 +1,45 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+
+class VersionedSnapshot:
+    #a per-process copy of some rarely changing data, rebuilt when the
+    #version stamp in the shared cache moves. Each process asks the cache
+    #at most every check_interval seconds, lookups in between are local
+    def __init__(self, key, build, check_interval=5):
+        self.key = key
+        self.build = build
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.value = None
+        self.version = None
+        self.checked = 0
+
+    def current_version(self):
+        version = cache.get(self.key)
+        if version is None:
+            #add() so two processes starting together agree on one version
+            cache.add(self.key, time.time(), None)
+            version = cache.get(self.key)
+        return version
+
+    def get(self):
+        now = time.monotonic()
+        value = self.value
+        if value is not None and now - self.checked < self.check_interval:
+            return value
+        with self.lock:
+            version = self.current_version()
+            if self.value is None or self.version != version:
+                self.value = self.build()
+                self.version = version
+            self.checked = now
+            return self.value
+
+    def invalidate(self):
+        #drop this process's copy and tell the other processes to rebuild theirs
+        cache.set(self.key, time.time(), None)
+        with self.lock:
+            self.value = None
@@ -0,0 +1,125 @@
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    #brotli is optional, without it only the gzip variants are written
+    brotli = None
+
+
+#text formats worth compressing, fonts like woff/woff2 and images already are
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.map', '.json', '.txt', '.html', '.xml', '.eot', '.ttf', '.otf', '.ico')
+COMPRESS_MIN_SIZE = 256
+
+#names written by ManifestStaticFilesStorage carry a 12 digit md5 fragment
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+
+ENCODINGS = (
+    ('br', '.br'),
+    ('gzip', '.gz'),
+)
+
+
+def compress_file(path):
+    #writes path.gz and path.br next to the file, skipping ones already up to date
+    with open(path, 'rb') as f:
+        content = f.read()
+    if len(content) < COMPRESS_MIN_SIZE:
+        return []
+    written = []
+    variants = [('.gz', lambda data: gzip.compress(data, compresslevel=9))]
+    if brotli is not None:
+        variants.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    mtime = os.path.getmtime(path)
+    for suffix, compress in variants:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+            continue
+        compressed = compress(content)
+        #a variant that doesn't save anything is not worth serving
+        if len(compressed) >= len(content):
+            continue
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        written.append(target)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    #collectstatic: fingerprint every file into staticfiles.json, then
+    #precompress the text assets so they can be served without gzipping per request
+    def post_process(self, paths, dry_run=False, **options):
+        names = []
+        for name, hashed_name, processed in super().post_process(paths, dry_run=dry_run, **options):
+            names.append(name)
+            if hashed_name:
+                names.append(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in names:
+            if name.endswith(COMPRESS_EXTENSIONS) and self.exists(name):
+                for target in compress_file(self.path(name)):
+                    yield name, os.path.relpath(target, self.location), True
+
+
+def accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def serve_static(request, path):
+    #serves collected files from STATIC_ROOT, picking the precompressed
+    #variant the client accepts; fingerprinted names never change so they
+    #can be cached forever
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid path')
+    if not os.path.isfile(fullpath):
+        raise Http404('"%s" does not exist' % path)
+
+    accepted = accepted_encodings(request)
+    encoding = None
+    served = fullpath
+    for coding, suffix in ENCODINGS:
+        if coding in accepted and os.path.isfile(fullpath + suffix):
+            encoding = coding
+            served = fullpath + suffix
+            break
+
+    stat = os.stat(served)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+        response = HttpResponseNotModified()
+    else:
+        content_type, _ = mimetypes.guess_type(fullpath)
+        response = FileResponse(open(served, 'rb'), content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = stat.st_size
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if HASHED_NAME_RE.search(path) else DEFAULT_CACHE_CONTROL
+    return response
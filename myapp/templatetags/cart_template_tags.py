@@ -1,14 +1,11 @@
 from django import template
-from myapp.models import Order
+from myapp.cart import get_cart_count
 
 register = template.Library()
 
 @register.filter
 def cart_item_count(user):
     if user.is_authenticated:
-        order_item = 0
-        qs = Order.objects.filter(user=user, ordered=False)
-        if qs.exists():
-            return qs[0].items.count()
+        return get_cart_count(user)
     return 0
 
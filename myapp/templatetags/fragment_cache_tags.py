@@ -0,0 +1,89 @@
+import time
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+register = template.Library()
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+STATS_NAMES_KEY = 'fragment-stats:names'
+STATS_FIELDS = ('hits', 'misses', 'hit_us', 'miss_us')
+
+_seen_names = set()
+
+
+def stats_key(name, field):
+    return f'fragment-stats:{name}:{field}'
+
+
+def bump(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def record(name, hit, elapsed):
+    if name not in _seen_names:
+        names = cache.get(STATS_NAMES_KEY) or []
+        if name not in names:
+            cache.set(STATS_NAMES_KEY, names + [name], None)
+        _seen_names.add(name)
+    micros = int(elapsed * 1000000)
+    if hit:
+        bump(stats_key(name, 'hits'), 1)
+        bump(stats_key(name, 'hit_us'), micros)
+    else:
+        bump(stats_key(name, 'misses'), 1)
+        bump(stats_key(name, 'miss_us'), micros)
+
+
+def get_stats():
+    names = cache.get(STATS_NAMES_KEY) or []
+    stats = {}
+    for name in names:
+        values = cache.get_many([stats_key(name, field) for field in STATS_FIELDS])
+        stats[name] = {field: values.get(stats_key(name, field), 0) for field in STATS_FIELDS}
+    return stats
+
+
+def reset_stats():
+    names = cache.get(STATS_NAMES_KEY) or []
+    cache.delete_many([stats_key(name, field) for name in names for field in STATS_FIELDS])
+    cache.delete(STATS_NAMES_KEY)
+    _seen_names.clear()
+
+
+class VersionedCacheNode(template.Node):
+    def __init__(self, nodelist, name, obj):
+        self.nodelist = nodelist
+        self.name = name
+        self.obj = obj
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        obj = self.obj.resolve(context)
+        #the version is part of the key, so a changed object simply misses
+        key = f'fragment:{name}:{obj._meta.label_lower}:{obj.pk}:{obj.version}'
+        started = time.perf_counter()
+        value = cache.get(key)
+        hit = value is not None
+        if not hit:
+            value = self.nodelist.render(context)
+            cache.set(key, value, FRAGMENT_TIMEOUT)
+        if settings.FRAGMENT_CACHE_STATS:
+            record(name, hit, time.perf_counter() - started)
+        return value
+
+
+#{% versioned_cache "fragment-name" object %} ... {% endversioned_cache %}
+@register.tag
+def versioned_cache(parser, token):
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError("'%s' takes a fragment name and an object" % bits[0])
+    nodelist = parser.parse(('endversioned_cache',))
+    parser.delete_first_token()
+    return VersionedCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
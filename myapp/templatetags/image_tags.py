@@ -0,0 +1,32 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from myapp.images import get_derivative_urls
+
+register = template.Library()
+
+
+def srcset(urls):
+    return ', '.join(f'{url} {width}w' for width, url in urls)
+
+
+@register.simple_tag
+def responsive_image(image, sizes='100vw', css_class='', alt='', style=''):
+    #<picture> with a WebP source and a resized fallback, falls back to the
+    #original upload until its derivatives have been generated
+    if not image:
+        return ''
+    attrs = format_html_join(' ', '{}="{}"', [
+        (name, value) for name, value in (('class', css_class), ('style', style)) if value
+    ])
+    urls = get_derivative_urls(image.name)
+    if not urls or not urls['fallback']:
+        return format_html('<img src="{}" alt="{}" loading="lazy" {}>', image.url, alt, attrs)
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy" {}>'
+        '</picture>',
+        srcset(urls['webp']), sizes,
+        urls['fallback'][-1][1], srcset(urls['fallback']), sizes, alt, attrs
+    )
@@ -1,3 +1,1218 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+import csv
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db import models
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.middleware.csrf import get_token
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .cart import (
+    add_item, remove_item, remove_single_item, set_quantities, get_open_order, open_lines,
+    get_cart_count, cart_count_key,
+)
+from .models import Item, Category, Order, OrderItem, DiscountCode, CouponUsage, PaymentAttempt, OrderStatusChange, InvalidTransition, CheckZipcode
+from . import exports, images, instrumentation, page_cache, payments, search, sessions, zipcodes
+from .templatetags import fragment_cache_tags
+from .wishlist import add_item as add_to_wishlist, remove_item as remove_from_wishlist, wishlisted, wishlist_key
+from .coupons import CouponError, apply_coupon, reserve_coupon, release_coupon
+from .payments import enqueue_payment, process_pending, CART_CHANGED
+from .management.commands.explain_hot_queries import Command as ExplainHotQueries
+from .management.commands.bench import Command as Bench
+from .pagination import encode_cursor, decode_cursor, QuerySetSource, ORDERINGS
+
+
+def make_user(username='shopper'):
+    return get_user_model().objects.create_user(username, f'{username}@example.com', 'secret')
+
+
+def make_item(n, price=100, discount_price=None, category=None):
+    item = Item.objects.create(
+        title=f'Item {n}', price=price, discount_price=discount_price, image='sample.jpg',
+        slug=f'item-{n}', description='A test item',
+    )
+    if category is not None:
+        item.category.add(category)
+    return item
+
+
+class CacheClearingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+
+class CursorTests(CacheClearingTestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor((12.5, 7))), (12.5, 7))
+
+    def test_tampered_cursors_mean_the_first_page(self):
+        for key in (['x'], [None], [True], [1e308 * 10], [2 ** 64], {'id': 1}, 'abc'):
+            self.assertIsNone(decode_cursor(encode_cursor(key) if isinstance(key, list) else key))
+        self.assertIsNone(decode_cursor('%%%'))
+
+    def test_pages_follow_the_cursor(self):
+        category = Category.objects.create(title='Shirts', slug='shirts')
+        items = [make_item(n, category=category) for n in range(15)]
+        first = self.client.get('/all-product/')
+        self.assertEqual([item.pk for item in first.context['object_list']], [item.pk for item in items[:12]])
+        second = self.client.get('/all-product/', {'after': encode_cursor((items[11].pk,))})
+        self.assertEqual([item.pk for item in second.context['object_list']], [item.pk for item in items[12:]])
+
+    def test_price_pages_follow_the_cursor(self):
+        items = [make_item(n, price=100 + n % 4, discount_price=90 if n % 5 == 0 else None) for n in range(30)]
+        expected = [item.pk for item in sorted(items, key=lambda item: (item.effective_price, item.pk))]
+        seen, params = [], {'sort': 'price'}
+        while True:
+            page = self.client.get('/all-product/', params).context['page_obj']
+            seen += [item.pk for item in page.object_list]
+            if not page.has_next():
+                break
+            last = page.object_list[-1]
+            params = {'sort': 'price', 'after': encode_cursor((last.effective_price, last.pk))}
+        self.assertEqual(seen, expected)
+
+    def test_price_pages_seek_the_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('reads an SQLite query plan')
+        source = QuerySetSource(Item.objects.catalog(), ORDERINGS['price'])
+        queryset = source.queryset.order_by(*source.keys).filter(source.seek((100.0, 5), True))[:13]
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('SEARCH myapp_item USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_tampered_cursor_is_not_an_error(self):
+        make_item(1)
+        response = self.client.get('/all-product/', {'after': encode_cursor(['not a number'])})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/all-product/', {'sort': 'price', 'after': encode_cursor(['x', 'y'])})
+        self.assertEqual(response.status_code, 200)
+
+
+class TotalsTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.plain = make_item(1, price=100)
+        self.discounted = make_item(2, price=100, discount_price=80)
+        #a discount price of 0 means no discount, in SQL as in the templates
+        self.zero = make_item(3, price=50, discount_price=0)
+
+    def assertTotalsMatchLines(self, order):
+        order.refresh_from_db()
+        lines = list(order.items.select_related('item'))
+        self.assertEqual(order.subtotal, sum(line.get_final_price() for line in lines))
+        self.assertEqual(order.total, order.subtotal - order.discount)
+
+    def test_totals_follow_the_cart(self):
+        order = add_item(self.user, self.plain)
+        add_item(self.user, self.discounted, quantity=2)
+        add_item(self.user, self.zero)
+        self.assertTotalsMatchLines(order)
+        self.assertEqual(order.subtotal, 100 + 2 * 80 + 50)
+        remove_item(self.user, self.discounted)
+        self.assertTotalsMatchLines(order)
+        set_quantities(self.user, {self.plain.pk: 3, self.zero.pk: 0}, replace=True)
+        self.assertTotalsMatchLines(order)
+        self.assertEqual(order.subtotal, 300)
+
+    def test_coupon_is_taken_off(self):
+        order = add_item(self.user, self.plain, quantity=2)
+        order.coupon = DiscountCode.objects.create(promo_code='TEN', amount=10)
+        order.save()
+        order.update_totals()
+        self.assertEqual((order.subtotal, order.discount, order.total), (200, 10, 190))
+
+    def test_item_price_change_reprices_open_carts(self):
+        order = add_item(self.user, self.plain)
+        self.plain.price = 120
+        self.plain.save()
+        order.refresh_from_db()
+        self.assertEqual(order.total, 120)
+
+    def test_catalog_sorts_by_the_price_shown(self):
+        prices = {item.pk: item.effective_price for item in Item.objects.catalog()}
+        self.assertEqual(prices, {self.plain.pk: 100, self.discounted.pk: 80, self.zero.pk: 50})
+
+    def test_saving_keeps_the_stored_price(self):
+        self.plain.discount_price = 70
+        self.plain.save(update_fields=['discount_price'])
+        self.assertEqual(Item.objects.get(pk=self.plain.pk).effective_price, 70)
+        self.plain.discount_price = 0
+        self.plain.save()
+        self.assertEqual(Item.objects.get(pk=self.plain.pk).effective_price, 100)
+
+
+class OpenCartTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.item = make_item(1)
+
+    def test_constraints_exist_after_migrating(self):
+        with connection.cursor() as cursor:
+            order = connection.introspection.get_constraints(cursor, Order._meta.db_table)
+            line = connection.introspection.get_constraints(cursor, OrderItem._meta.db_table)
+        self.assertTrue(order['myapp_order_one_open_cart']['unique'])
+        self.assertTrue(line['myapp_orderitem_one_open_line']['unique'])
+
+    def test_second_open_cart_is_rejected(self):
+        Order.objects.create(user=self.user, ordered_date=timezone.now())
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user, ordered_date=timezone.now())
+        #placed orders don't count
+        Order.objects.filter(user=self.user).update(ordered=True, status='in_transit')
+        Order.objects.create(user=self.user, ordered_date=timezone.now())
+
+    def test_second_open_line_is_rejected(self):
+        OrderItem.objects.create(user=self.user, item=self.item)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderItem.objects.create(user=self.user, item=self.item)
+
+    def test_losing_the_cart_race_returns_the_winner(self):
+        #another request creates the cart between our lookup and our insert
+        winner = Order.objects.create(user=self.user, ordered_date=timezone.now())
+        real_get = Order.objects.get
+        with mock.patch.object(Order.objects, 'get', side_effect=[Order.DoesNotExist, real_get(pk=winner.pk)]):
+            self.assertEqual(get_open_order(self.user, create=True), winner)
+        self.assertEqual(Order.objects.filter(user=self.user, ordered=False).count(), 1)
+
+    def test_adding_twice_updates_the_line(self):
+        add_item(self.user, self.item)
+        order = add_item(self.user, self.item, quantity=2)
+        self.assertEqual(list(open_lines(self.user).values_list('quantity', flat=True)), [3])
+        self.assertEqual(order.items.count(), 1)
+
+    def assertBulkLosesTheRace(self, replace, quantity):
+        other = make_item(2)
+        add_item(self.user, self.item)
+        reads = []
+
+        def stale_first_read(user):
+            #the first read misses the line a concurrent add_item inserted right after it
+            reads.append(user)
+            lines = OrderItem.objects.filter(user=user, ordered=False)
+            return lines.exclude(item=self.item) if len(reads) == 1 else lines
+
+        with mock.patch('myapp.cart.open_lines', side_effect=stale_first_read):
+            order = set_quantities(self.user, {self.item.pk: 2, other.pk: 1}, replace=replace)
+        lines = dict(open_lines(self.user).values_list('item_id', 'quantity'))
+        self.assertEqual(lines, {self.item.pk: quantity, other.pk: 1})
+        self.assertEqual(order.items.count(), 2)
+
+    def test_bulk_add_losing_the_race_adds_to_the_line(self):
+        self.assertBulkLosesTheRace(replace=False, quantity=3)
+
+    def test_bulk_replace_losing_the_race_sets_the_line(self):
+        self.assertBulkLosesTheRace(replace=True, quantity=2)
+
+
+@mock.patch('myapp.payments.stripe.Refund.create')
+@mock.patch('myapp.payments.stripe.Charge.create', return_value={'id': 'ch_test'})
+class PaymentTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.item = make_item(1, price=100)
+        self.other = make_item(2, price=40)
+        self.order = add_item(self.user, self.item)
+        self.attempt = enqueue_payment(self.order, 'tok_visa')
+
+    def test_charges_and_places_the_queued_cart(self, charge, refund):
+        self.assertEqual(process_pending(), {'succeeded': 1, 'failed': 0, 'retry': 0})
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.ordered, self.order.status), (True, 'in_transit'))
+        self.assertEqual(self.order.payment.amount, self.order.total)
+        self.assertFalse(self.order.items.filter(ordered=False).exists())
+        self.assertEqual(charge.call_args[1]['amount'], 10000)
+        refund.assert_not_called()
+
+    def test_double_submit_reuses_the_attempt(self, charge, refund):
+        self.assertEqual(enqueue_payment(self.order, 'tok_visa'), self.attempt)
+
+    def test_cart_changed_before_the_charge(self, charge, refund):
+        add_item(self.user, self.other)
+        self.assertEqual(process_pending()['failed'], 1)
+        charge.assert_not_called()
+        self.attempt.refresh_from_db()
+        self.assertEqual((self.attempt.status, self.attempt.error), ('failed', CART_CHANGED))
+        self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+
+    def test_cart_changed_during_the_charge_is_refunded(self, charge, refund):
+        def add_while_charging(**kwargs):
+            add_item(self.user, self.other)
+            return {'id': 'ch_test'}
+        charge.side_effect = add_while_charging
+        self.assertEqual(process_pending()['failed'], 1)
+        refund.assert_called_once_with(charge='ch_test', idempotency_key=f'{self.attempt.idempotency_key}-refund')
+        self.attempt.refresh_from_db()
+        self.assertEqual((self.attempt.status, self.attempt.charge_id), ('failed', 'ch_test'))
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.ordered)
+        #the lines added later are still in the cart, nothing shipped unpaid
+        self.assertEqual(open_lines(self.user).count(), 2)
+
+    def test_invalid_transition_after_the_charge_is_refunded(self, charge, refund):
+        def cancel_while_charging(**kwargs):
+            Order.objects.filter(pk=self.order.pk).update(status='canceled')
+            return {'id': 'ch_test'}
+        charge.side_effect = cancel_while_charging
+        self.assertEqual(process_pending()['failed'], 1)
+        refund.assert_called_once()
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.status, 'failed')
+        self.assertEqual(self.attempt.charge_id, 'ch_test')
+
+    def test_failed_refund_is_left_for_staff(self, charge, refund):
+        charge.side_effect = lambda **kwargs: add_item(self.user, self.other) and {'id': 'ch_test'}
+        refund.side_effect = stripe.error.APIConnectionError('down')
+        process_pending()
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.status, 'failed')
+        self.assertIn('not refunded', self.attempt.error)
+
+    def due_in(self):
+        self.attempt.refresh_from_db()
+        return (self.attempt.next_attempt_at - timezone.now()).total_seconds()
+
+    def test_retries_back_off_and_give_up(self, charge, refund):
+        charge.side_effect = stripe.error.RateLimitError('slow down')
+        for delay in (30, 60, 120, 240):
+            self.assertEqual(process_pending()['retry'], 1)
+            self.assertEqual(PaymentAttempt.objects.get(pk=self.attempt.pk).status, 'pending')
+            self.assertAlmostEqual(self.due_in(), delay, delta=5)
+            #not due yet, the worker leaves it alone
+            self.assertEqual(process_pending(), {'succeeded': 0, 'failed': 0, 'retry': 0})
+            PaymentAttempt.objects.filter(pk=self.attempt.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(process_pending()['failed'], 1)
+        self.assertEqual(charge.call_count, payments.MAX_ATTEMPTS)
+        self.attempt.refresh_from_db()
+        self.assertEqual((self.attempt.status, self.attempt.attempts), ('failed', payments.MAX_ATTEMPTS))
+
+    def test_stale_attempts_back_off_too(self, charge, refund):
+        later = timezone.now() + payments.STALE_AFTER * 2
+        PaymentAttempt.objects.filter(pk=self.attempt.pk).update(status='processing', attempts=2)
+        self.assertEqual(payments.requeue_stale(later), 1)
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.status, 'pending')
+        self.assertEqual(self.attempt.next_attempt_at, later + timedelta(minutes=1))
+
+    def test_stale_attempts_give_up_after_the_last_try(self, charge, refund):
+        later = timezone.now() + payments.STALE_AFTER * 2
+        PaymentAttempt.objects.filter(pk=self.attempt.pk).update(
+            status='processing', attempts=payments.MAX_ATTEMPTS, charge_id='ch_test')
+        self.assertEqual(payments.requeue_stale(later), 0)
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.status, 'failed')
+        #it was charged before the worker died, the money goes back
+        refund.assert_called_once_with(charge='ch_test', idempotency_key=f'{self.attempt.idempotency_key}-refund')
+
+    def test_one_active_attempt_per_order(self, charge, refund):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, PaymentAttempt._meta.db_table)
+        self.assertTrue(constraints['myapp_paymentattempt_one_active']['unique'])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PaymentAttempt.objects.create(order=self.order, user=self.user, idempotency_key='second', amount=1)
+        #finished attempts don't count
+        PaymentAttempt.objects.filter(pk=self.attempt.pk).update(status='failed')
+        PaymentAttempt.objects.create(order=self.order, user=self.user, idempotency_key='retry', amount=1)
+
+
+@mock.patch('stripe.Charge.create', return_value={'id': 'ch_test'})
+class CouponLimitTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.other_user = make_user('other')
+        self.item = make_item(1, price=100)
+        self.coupon = DiscountCode.objects.create(promo_code='SAVE10', amount=10, max_uses=2, max_uses_per_user=1)
+
+    def usage(self, user):
+        return CouponUsage.objects.filter(coupon=self.coupon, user=user).values_list('count', flat=True).first() or 0
+
+    def test_per_user_limit(self, charge):
+        reserve_coupon(self.coupon, self.user, 100)
+        with self.assertRaises(CouponError):
+            reserve_coupon(self.coupon, self.user, 100)
+        self.coupon.refresh_from_db()
+        #the rejected reservation took nothing
+        self.assertEqual((self.coupon.times_used, self.usage(self.user)), (1, 1))
+        order = add_item(self.user, self.item)
+        with self.assertRaises(CouponError):
+            apply_coupon(order, 'SAVE10', self.user)
+
+    def test_codes_differing_by_case_stay_apart(self, charge):
+        lower = DiscountCode.objects.create(promo_code='save10', amount=50)
+        order = add_item(self.user, self.item)
+        self.assertEqual(apply_coupon(order, ' save10 ', self.user), lower)
+        self.assertEqual(apply_coupon(order, 'SAVE10', self.user), self.coupon)
+        with self.assertRaises(CouponError):
+            apply_coupon(order, 'Save10', self.user)
+
+    def test_total_limit(self, charge):
+        reserve_coupon(self.coupon, self.user, 100)
+        reserve_coupon(self.coupon, self.other_user, 100)
+        with self.assertRaises(CouponError):
+            reserve_coupon(self.coupon, make_user('third'), 100)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 2)
+
+    def test_release_gives_the_use_back(self, charge):
+        reserve_coupon(self.coupon, self.user, 100)
+        release_coupon(self.coupon.pk, self.user.pk)
+        self.coupon.refresh_from_db()
+        self.assertEqual((self.coupon.times_used, self.usage(self.user)), (0, 0))
+        reserve_coupon(self.coupon, self.user, 100)
+
+    def test_failed_charge_releases_the_coupon(self, charge):
+        charge.side_effect = stripe.error.CardError('declined', None, 'card_declined')
+        order = add_item(self.user, self.item)
+        apply_coupon(order, 'SAVE10', self.user)
+        attempt = enqueue_payment(order, 'tok_visa')
+        self.assertEqual(attempt.coupon, self.coupon)
+        self.assertEqual(self.usage(self.user), 1)
+        self.assertEqual(process_pending()['failed'], 1)
+        self.coupon.refresh_from_db()
+        self.assertEqual((self.coupon.times_used, self.usage(self.user)), (0, 0))
+
+
+class TableRebuildTests(TransactionTestCase):
+    #SQLite rebuilds the whole table to alter a column, the constraints
+    #declared on the model must come back with it
+    def test_rebuild_keeps_the_open_cart_constraint(self):
+        old_field = Order._meta.get_field('order_id')
+        new_field = models.CharField(max_length=60, db_index=True)
+        new_field.set_attributes_from_name('order_id')
+        with connection.schema_editor() as editor:
+            editor.alter_field(Order, old_field, new_field)
+        try:
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, Order._meta.db_table)
+            self.assertIn('myapp_order_one_open_cart', constraints)
+            user = make_user()
+            Order.objects.create(user=user, ordered_date=timezone.now())
+            with self.assertRaises(IntegrityError):
+                Order.objects.create(user=user, ordered_date=timezone.now())
+        finally:
+            with connection.schema_editor() as editor:
+                editor.alter_field(Order, new_field, old_field)
+
+
+class TransitionTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.staff = make_user('staff')
+
+    def place(self, status='in_transit'):
+        return Order.objects.create(user=self.user, ordered=True, status=status, ordered_date=timezone.now())
+
+    def test_allowed_transition_is_logged(self):
+        order = self.place()
+        order.transition('shipped', user=self.staff)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'shipped')
+        change = order.status_history.get()
+        self.assertEqual((change.from_status, change.to_status, change.changed_by), ('in_transit', 'shipped', self.staff))
+
+    def test_disallowed_transition_is_rejected(self):
+        order = self.place('refund_granted')
+        with self.assertRaises(InvalidTransition):
+            order.transition('in_transit')
+        self.assertFalse(order.status_history.exists())
+
+    def test_concurrent_change_wins(self):
+        order = self.place()
+        Order.objects.filter(pk=order.pk).update(status='canceled')
+        with self.assertRaises(InvalidTransition):
+            order.transition('shipped')
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'canceled')
+
+    def test_bulk_transition_skips_orders_that_cant_move(self):
+        movable = [self.place() for _ in range(5)] + [self.place('shipped')]
+        stuck = self.place('refund_granted')
+        moved = Order.objects.filter(user=self.user).transition('canceled', user=self.staff, chunk_size=2)
+        self.assertEqual(moved, len(movable))
+        self.assertEqual(Order.objects.filter(status='canceled').count(), len(movable))
+        self.assertEqual(Order.objects.get(pk=stuck.pk).status, 'refund_granted')
+        self.assertEqual(OrderStatusChange.objects.count(), len(movable))
+
+    def test_history_is_append_only(self):
+        order = self.place()
+        order.transition('shipped')
+        change = order.status_history.get()
+        with self.assertRaises(ValueError):
+            change.save()
+
+
+class HotQueryAuditTests(CacheClearingTestCase):
+    def test_every_hot_view_is_audited(self):
+        out = StringIO()
+        call_command('explain_hot_queries', stdout=out)
+        self.assertIn('Every hot query uses an index', out.getvalue())
+        self.assertNotIn(' 0 queries', out.getvalue())
+
+    def test_limit_does_not_hide_a_filtered_scan(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('reads an SQLite query plan')
+        def scans(queryset):
+            sql, params = queryset.query.sql_with_params()
+            return ExplainHotQueries().explain(sql, params)[1]
+
+        #description has no index, a LIMIT doesn't stop the scan before a row matches
+        self.assertEqual(scans(Item.objects.filter(description='x')[:1]), ['myapp_item'])
+        self.assertEqual(scans(Item.objects.filter(description='x').order_by('id')[:1]), ['myapp_item'])
+        #the first page in primary key order reads a page worth of rows
+        self.assertEqual(scans(Item.objects.order_by('id')[:12]), [])
+
+
+class UserAdminSearchTests(CacheClearingTestCase):
+    def test_finds_users_by_email_prefix(self):
+        admin = get_user_model().objects.create_superuser('staff', 'staff@example.com', 'pass')
+        get_user_model().objects.create_user('jdoe', 'jane.doe@example.com', 'pass')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/auth/user/', {'q': 'jane.doe@'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user.username for user in response.context['cl'].result_list], ['jdoe'])
+
+    def test_finds_every_item_the_index_matches(self):
+        admin = get_user_model().objects.create_superuser('staff', 'staff@example.com', 'pass')
+        first, second = make_item(1), make_item(2)
+        self.client.force_login(admin)
+        response = self.client.get('/admin/myapp/item/', {'q': 'item'})
+        self.assertEqual(sorted(item.pk for item in response.context['cl'].result_list), [first.pk, second.pk])
+        lines = OrderItem.objects.bulk_create([OrderItem(user=admin, item=first), OrderItem(user=admin, item=second)])
+        response = self.client.get('/admin/myapp/orderitem/', {'q': 'item'})
+        self.assertEqual(len(response.context['cl'].result_list), len(lines))
+
+
+#the shared page cache would answer the repeated requests without a query
+@override_settings(PAGE_CACHE_ENABLED=False)
+class QueryCountTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.category = Category.objects.create(title='Things', slug='things')
+
+    def add_items(self, start, stop):
+        items = [make_item(n, category=self.category) for n in range(start, stop)]
+        Item.objects.filter(pk__in=[item.pk for item in items]).update(list_on_frontpage=True)
+        return items
+
+    def count(self, url, data=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertConstant(self, urls, grow):
+        #every page runs the same number of queries, on a cold cache, after
+        #grow() added rows
+        counts = [self.count(url, data) for url, data in urls]
+        grow()
+        for (url, data), count in zip(urls, counts):
+            cache.clear()
+            with self.assertNumQueries(count):
+                response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+
+    def test_grid_pages(self):
+        self.add_items(0, 4)
+        urls = [('/', None), ('/all-product/', None), ('/search/', {'q': 'item'}), ('/cat/things/', None)]
+        self.assertConstant(urls, lambda: self.add_items(4, 40))
+        self.client.force_login(self.user)
+        self.assertConstant(urls, lambda: self.add_items(40, 50))
+
+    def test_cart_pages(self):
+        items = self.add_items(0, 10)
+        add_item(self.user, items[0])
+        self.client.force_login(self.user)
+        urls = [('/order-summary/', None), ('/checkout/', None)]
+        self.assertConstant(urls, lambda: [add_item(self.user, item) for item in items[1:]])
+
+    def test_order_history(self):
+        items = self.add_items(0, 10)
+
+        def place(lines):
+            order = add_item(self.user, lines[0])
+            for item in lines[1:]:
+                add_item(self.user, item)
+            order.items.update(ordered=True)
+            order.transition('in_transit', ordered=True, order_id=f'order{order.pk}')
+            Order.objects.filter(pk=order.pk).update(status='delivered')
+
+        place(items[:1])
+        self.client.force_login(self.user)
+        self.assertConstant([('/pervious-order/', None)], lambda: [place(items[n:n + 3]) for n in range(1, 10, 3)])
+        self.assertEqual(len(self.client.get('/pervious-order/').context['object']), 4)
+
+    def test_bench_catalog_queries(self):
+        out = StringIO()
+        call_command('bench_catalog_queries', stdout=out)
+        self.assertIn('Every grid page runs a constant number of queries', out.getvalue())
+
+
+class ImportCatalogTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        with open(os.path.join(self.media.name, 'sample.jpg'), 'wb') as f:
+            f.write(b'not decoded with --skip-thumbnails')
+        settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def run_import(self, rows):
+        path = os.path.join(self.media.name, 'items.jsonl')
+        with open(path, 'w') as f:
+            f.write('\n'.join(json.dumps(row) for row in rows))
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--skip-thumbnails', '--workers', '1', stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_rows_of_the_wrong_type_are_reported_and_skipped(self):
+        row = {'title': 'Lamp', 'price': 10, 'image': 'sample.jpg'}
+        out, err = self.run_import([
+            row,
+            dict(row, title=123, slug='numeric-title'),
+            dict(row, slug='numeric-image', image=5),
+            dict(row, slug='mixed-categories', categories=[1, 'a']),
+            dict(row, slug='object-title', title={'en': 'Lamp'}),
+            dict(row, slug='object-categories', categories={'a': 1}),
+            dict(row, slug='nested-category', categories=[['a']]),
+            dict(row, slug='boolean-price', price=True),
+        ])
+        self.assertIn('Imported 3 of 8 rows', out)
+        for line in (3, 5, 6, 7, 8):
+            self.assertIn(f'line {line}:', err)
+        self.assertEqual(Item.objects.get(slug='numeric-title').title, '123')
+        categories = Item.objects.get(slug='mixed-categories').category.values_list('title', flat=True)
+        self.assertEqual(sorted(categories), ['1', 'a'])
+
+
+class SessionStoreTests(CacheClearingTestCase):
+    def stored(self, session):
+        #what the database row holds, not the cached copy
+        return sessions.DBStore(session.session_key).load()
+
+    def test_process_local_cache_writes_every_save(self):
+        session = sessions.SessionStore()
+        self.assertFalse(session.coalesce)
+        session['cart'] = 1
+        session.save()
+        session['cart'] = 2
+        session.save()
+        self.assertEqual(self.stored(session)['cart'], 2)
+
+    @override_settings(SESSION_DB_WRITE_INTERVAL=60)
+    @mock.patch('myapp.sessions.is_shared', return_value=True)
+    def test_shared_cache_coalesces_writes(self, is_shared):
+        with mock.patch('myapp.sessions.time.time', return_value=1000):
+            session = sessions.SessionStore()
+            session['cart'] = 1
+            session.save()
+            self.assertEqual(self.stored(session)['cart'], 1)
+            #within the interval only the cache is written, and read back
+            session = sessions.SessionStore(session.session_key)
+            session['cart'] = 2
+            session.save()
+            self.assertEqual(self.stored(session)['cart'], 1)
+            self.assertEqual(sessions.SessionStore(session.session_key)['cart'], 2)
+            #logging in is written straight away
+            session[sessions.SESSION_KEY] = '1'
+            session.save()
+            self.assertEqual(self.stored(session)[sessions.SESSION_KEY], '1')
+            session['cart'] = 3
+            session.save()
+            self.assertEqual(self.stored(session)['cart'], 2)
+        with mock.patch('myapp.sessions.time.time', return_value=1061):
+            session = sessions.SessionStore(session.session_key)
+            session['cart'] = 4
+            session.save()
+            self.assertEqual(self.stored(session)['cart'], 4)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.item = make_item(1)
+        self.factory = RequestFactory()
+        self.rendered = 0
+
+    def cached_view(self, respond):
+        def view(request):
+            self.rendered += 1
+            return respond(request)
+        return page_cache.cache_shared_page(view)
+
+    def request(self, view, method='get'):
+        request = getattr(self.factory, method)('/cached/')
+        request.user = AnonymousUser()
+        return view(request)
+
+    def test_anonymous_hit_is_served_from_the_cache(self):
+        self.assertEqual(self.client.get(self.item.get_absolute_url())['X-Page-Cache'], 'miss')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.item.get_absolute_url())
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Item 1')
+
+    def test_signed_in_visitors_get_the_shared_page(self):
+        self.client.get(self.item.get_absolute_url())
+        self.client.force_login(make_user('alice'))
+        response = self.client.get(self.item.get_absolute_url())
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, 'alice')
+
+    def test_pages_with_a_cookie_or_csrf_token_are_not_stored(self):
+        def with_cookie(request):
+            response = HttpResponse('mine')
+            response.set_cookie('visitor', '1')
+            return response
+
+        def with_token(request):
+            return HttpResponse(get_token(request))
+
+        for respond in (with_cookie, with_token):
+            view = self.cached_view(respond)
+            self.request(view)
+            self.assertEqual(self.request(view)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.rendered, 4)
+
+    def test_posts_are_not_cached(self):
+        view = self.cached_view(lambda request: HttpResponse('posted'))
+        self.request(view, 'post')
+        self.request(view, 'post')
+        self.assertEqual(self.rendered, 2)
+
+    def test_stale_page_is_served_while_one_request_renders_it(self):
+        view = self.cached_view(lambda request: HttpResponse(f'render {self.rendered}'))
+        self.request(view)
+        page_cache.invalidate()
+        #another request is already rendering the page again
+        request = self.factory.get('/cached/')
+        self.assertEqual(page_cache.get_cached(request)[1], 'refresh')
+        response = self.request(view)
+        self.assertEqual((response['X-Page-Cache'], response.content), ('stale', b'render 1'))
+        self.assertEqual(self.rendered, 1)
+
+    def test_user_fragments_answer_per_user(self):
+        alice, bob = make_user('alice'), make_user('bob')
+        add_to_wishlist(alice, self.item)
+        url = f'/user/fragments/?wishlist={self.item.pk}'
+        self.assertEqual(self.client.get(url).json(), {'authenticated': False})
+        self.client.force_login(alice)
+        response = self.client.get(url)
+        self.assertEqual(response.json()['wishlisted'], [self.item.pk])
+        self.assertIn('alice', response.json()['fragments']['navbar-user'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('X-Page-Cache', response)
+        self.client.force_login(bob)
+        response = self.client.get(url)
+        self.assertEqual(response.json()['wishlisted'], [])
+        self.assertNotIn('alice', response.json()['fragments']['navbar-user'])
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheInvalidationTests(TransactionTestCase):
+    #the invalidation runs on commit, which a TestCase never reaches
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title='Lamps', slug='lamps')
+        self.item = make_item(1, category=self.category)
+
+    def assertRenderedAgain(self, change, text):
+        url = self.item.get_absolute_url()
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+        change()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'refresh')
+        self.assertContains(response, text)
+
+    def test_item_save(self):
+        def rename():
+            self.item.title = 'Brass lamp'
+            self.item.save()
+        self.assertRenderedAgain(rename, 'Brass lamp')
+
+    def test_category_save(self):
+        def rename():
+            self.category.title = 'Desk lamps'
+            self.category.save()
+        self.assertRenderedAgain(rename, 'Desk lamps')
+
+
+class ImageTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name, MEDIA_URL='/media/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, name, size, mode='RGB', format='JPEG'):
+        buffer = BytesIO()
+        Image.new(mode, size).save(buffer, format=format)
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def sizes(self, name, ext):
+        found = {}
+        for width in images.THUMBNAIL_WIDTHS:
+            path = images.derivative_name(name, width, ext)
+            if default_storage.exists(path):
+                with default_storage.open(path, 'rb') as f:
+                    found[width] = Image.open(f).size
+        return found
+
+    def test_each_width_up_to_the_original(self):
+        name = self.upload('lamp.jpg', (600, 300))
+        self.assertEqual(images.generate_derivatives(name), 2)
+        self.assertEqual(self.sizes(name, 'jpg'), {240: (240, 120), 480: (480, 240)})
+        self.assertEqual(self.sizes(name, 'webp'), {240: (240, 120), 480: (480, 240)})
+        #existing derivatives are kept unless forced
+        self.assertEqual(images.generate_derivatives(name), 0)
+        self.assertEqual(images.generate_derivatives(name, force=True), 2)
+
+    def test_small_and_transparent_images(self):
+        name = self.upload('icon.png', (100, 50), mode='RGBA', format='PNG')
+        self.assertEqual(images.generate_derivatives(name), 1)
+        #never upscaled, and transparency keeps a PNG fallback
+        self.assertEqual(self.sizes(name, 'png'), {240: (100, 50)})
+        self.assertEqual(self.sizes(name, 'jpg'), {})
+
+    def test_responsive_image_tag(self):
+        item = make_item(1)
+        item.image = self.upload('lamp.jpg', (600, 300))
+        template = Template('{% load image_tags %}{% responsive_image item.image sizes="50vw" alt="Lamp" %}')
+        html = template.render(Context({'item': item}))
+        #the original until the derivatives exist
+        self.assertTrue(html.startswith('<img src="/media/lamp.jpg"'))
+        images.generate_derivatives(item.image.name)
+        html = template.render(Context({'item': item}))
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/lamp-240w.webp 240w, /media/derivatives/lamp-480w.webp 480w" sizes="50vw">', html)
+        self.assertIn('<img src="/media/derivatives/lamp-480w.jpg"', html)
+
+    @mock.patch('myapp.signals.generate_derivatives_later')
+    def test_only_a_new_image_is_resized_after_commit(self, generate):
+        with mock.patch('myapp.signals.transaction.on_commit', side_effect=lambda callback: callback()):
+            item = make_item(1)
+            generate.assert_called_once_with('sample.jpg')
+            item.price = 120
+            item.save()
+            item.save(update_fields=['price'])
+            self.assertEqual(generate.call_count, 1)
+            item.image = 'other.jpg'
+            item.save()
+            generate.assert_called_with('other.jpg')
+        #nothing runs before the transaction commits
+        item.image = 'third.jpg'
+        item.save()
+        self.assertEqual(generate.call_count, 2)
+
+
+class CartCountTests(TransactionTestCase):
+    #the cached count is dropped on commit, which a TestCase never reaches
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.lamp, self.chair = make_item(1), make_item(2)
+
+    def count(self):
+        #a later request: a fresh user object, the count comes from the cache
+        return get_cart_count(get_user_model().objects.get(pk=self.user.pk))
+
+    def test_count_follows_every_change(self):
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(cache.get(cart_count_key(self.user.pk)), 0)
+        add_item(self.user, self.lamp)
+        self.assertEqual(self.count(), 1)
+        add_item(self.user, self.lamp)
+        self.assertEqual(self.count(), 1)
+        set_quantities(self.user, {self.chair.pk: 2})
+        self.assertEqual(self.count(), 2)
+        remove_single_item(self.user, self.chair)
+        self.assertEqual(self.count(), 2)
+        remove_single_item(self.user, self.chair)
+        self.assertEqual(self.count(), 1)
+        remove_item(self.user, self.lamp)
+        self.assertEqual(self.count(), 0)
+
+    def test_count_is_served_from_the_cache(self):
+        add_item(self.user, self.lamp)
+        self.count()
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_count(user), 1)
+
+    def test_count_is_dropped_once_the_change_commits(self):
+        self.assertEqual(self.count(), 0)
+        with transaction.atomic():
+            add_item(self.user, self.lamp)
+            #a concurrent request still sees the committed cart
+            self.assertEqual(cache.get(cart_count_key(self.user.pk)), 0)
+        self.assertIsNone(cache.get(cart_count_key(self.user.pk)))
+        self.assertEqual(self.count(), 1)
+
+    @mock.patch('myapp.payments.stripe.Charge.create', return_value={'id': 'ch_test'})
+    def test_checkout_empties_the_badge(self, charge):
+        enqueue_payment(add_item(self.user, self.lamp), 'tok_visa')
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(process_pending()['succeeded'], 1)
+        self.assertEqual(self.count(), 0)
+
+
+class WishlistCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.lamp, self.chair = make_item(1), make_item(2)
+        self.page = [self.lamp.pk, self.chair.pk]
+
+    def hearts(self):
+        return wishlisted(get_user_model().objects.get(pk=self.user.pk), self.page)
+
+    def test_ids_follow_every_change(self):
+        self.assertEqual(self.hearts(), set())
+        self.assertEqual(cache.get(wishlist_key(self.user.pk)), frozenset())
+        self.assertTrue(add_to_wishlist(self.user, self.lamp))
+        self.assertEqual(self.hearts(), {self.lamp.pk})
+        self.assertFalse(add_to_wishlist(self.user, self.lamp))
+        add_to_wishlist(self.user, self.chair)
+        self.assertEqual(self.hearts(), {self.lamp.pk, self.chair.pk})
+        self.assertTrue(remove_from_wishlist(self.user, self.lamp))
+        self.assertEqual(self.hearts(), {self.chair.pk})
+        self.assertFalse(remove_from_wishlist(self.user, self.lamp))
+        self.assertEqual(self.hearts(), {self.chair.pk})
+
+    def test_ids_are_served_from_the_cache(self):
+        add_to_wishlist(self.user, self.lamp)
+        self.hearts()
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(wishlisted(user, self.page), {self.lamp.pk})
+
+    def test_ids_are_dropped_once_the_change_commits(self):
+        self.hearts()
+        with transaction.atomic():
+            add_to_wishlist(self.user, self.lamp)
+            self.assertEqual(cache.get(wishlist_key(self.user.pk)), frozenset())
+        self.assertIsNone(cache.get(wishlist_key(self.user.pk)))
+        self.assertEqual(self.hearts(), {self.lamp.pk})
+
+    def test_anonymous_visitors_have_no_hearts(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(wishlisted(AnonymousUser(), self.page), set())
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class FragmentCacheTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(title='Lamps', slug='lamps')
+        self.item = make_item(1, category=self.category)
+        self.addCleanup(fragment_cache_tags.reset_stats)
+
+    def test_stats_are_off_by_default(self):
+        self.client.get(self.item.get_absolute_url())
+        with mock.patch.object(fragment_cache_tags.cache, 'incr') as incr:
+            self.client.get(self.item.get_absolute_url())
+        incr.assert_not_called()
+        self.assertEqual(fragment_cache_tags.get_stats(), {})
+
+    @override_settings(FRAGMENT_CACHE_STATS=True)
+    def test_stats_count_the_item_fragments(self):
+        self.client.get(self.item.get_absolute_url())
+        self.client.get(self.item.get_absolute_url())
+        stats = fragment_cache_tags.get_stats()
+        #the static text below them is not worth a cache lookup
+        self.assertEqual(sorted(stats), ['product-body', 'product-head'])
+        self.assertEqual((stats['product-head']['hits'], stats['product-head']['misses']), (1, 1))
+
+    def test_save_after_a_category_change_moves_the_version(self):
+        #the category add bumped the stored version behind this instance
+        stored = Item.objects.get(pk=self.item.pk).version
+        self.item.title = 'Brass lamp'
+        self.item.save()
+        self.assertEqual(self.item.version, stored + 1)
+        self.assertEqual(Item.objects.get(pk=self.item.pk).version, stored + 1)
+        self.assertContains(self.client.get(self.item.get_absolute_url()), 'Brass lamp')
+
+    def test_save_with_update_fields_moves_the_version(self):
+        version = Item.objects.get(pk=self.item.pk).version
+        self.item.price = 80
+        self.item.save(update_fields=['price'])
+        stored = Item.objects.get(pk=self.item.pk)
+        self.assertEqual((stored.version, stored.effective_price), (version + 1, 80))
+
+
+class ZipcodeTests(CacheClearingTestCase):
+    def test_parse_rule(self):
+        self.assertEqual(zipcodes.parse_rule(' 560 001 '), ('exact', '560001'))
+        self.assertEqual(zipcodes.parse_rule('sw1a 1aa'), ('exact', 'SW1A1AA'))
+        self.assertEqual(zipcodes.parse_rule('5600*'), ('prefix', '5600'))
+        self.assertEqual(zipcodes.parse_rule('560001-560099'),
+                         ('range', (zipcodes.encode('560001'), zipcodes.encode('560099'))))
+        for value in ('', '*', '56*0*', '560099-560001', '56001-560099', '5600A-5600B'):
+            self.assertIsNone(zipcodes.parse_rule(value), value)
+
+    def test_exact_prefix_and_range_hits(self):
+        index = zipcodes.ZipcodeIndex(['110001', 'SW1A 1AA', '5600*', '400001-400099'])
+        for zipcode in ('110001', 'sw1a1aa', '560034', '5600', '400050'):
+            self.assertIn(zipcode, index)
+        for zipcode in ('110002', 'SW1A1AB', '5601', '560', '400100', '4000'):
+            self.assertNotIn(zipcode, index)
+
+    def test_range_boundaries(self):
+        #adjacent ranges are merged into one, the gap after them is not
+        index = zipcodes.ZipcodeIndex(['400001-400050', '400051-400099', '400200-400299'])
+        self.assertEqual(len(index.starts), 2)
+        for zipcode in ('400001', '400050', '400051', '400099', '400200', '400299'):
+            self.assertIn(zipcode, index)
+        for zipcode in ('400000', '400100', '400199', '400300', '0400001', '40001'):
+            self.assertNotIn(zipcode, index)
+
+    def test_exact_boundaries(self):
+        #leading zeros are part of the zipcode, the first and last numbers
+        #of the sorted array are found like any other
+        index = zipcodes.ZipcodeIndex(['012345', '000001', '999999'])
+        for zipcode in ('012345', '000001', '999999'):
+            self.assertIn(zipcode, index)
+        for zipcode in ('12345', '000000', '1', '1000000'):
+            self.assertNotIn(zipcode, index)
+
+    def test_rules_typed_by_a_shopper_are_rejected(self):
+        index = zipcodes.ZipcodeIndex(['5600*', '400001-400099', '110001'])
+        for zipcode in ('5600*', '*', '400001-400099', '110001-110001', '', None):
+            self.assertNotIn(zipcode, index)
+
+    def test_is_serviceable_follows_the_table(self):
+        CheckZipcode.objects.create(zipcode='5600*')
+        zipcodes.invalidate()
+        self.assertTrue(zipcodes.is_serviceable('560034'))
+        self.assertFalse(zipcodes.is_serviceable('5600*'))
+        self.assertFalse(zipcodes.is_serviceable('400050'))
+        CheckZipcode.objects.create(zipcode='400001-400099')
+        zipcodes.invalidate()
+        self.assertTrue(zipcodes.is_serviceable('400050'))
+
+class SearchIndexTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.item = Item.objects.create(title='Desk light', price=10, image='sample.jpg', slug='desk-light',
+                                        description='Plain')
+        self.lamps = Category.objects.create(title='Lamps', slug='lamps')
+
+    def found(self, query):
+        return list(search.matching_items(query).values_list('pk', flat=True))
+
+    def test_create_update_and_delete(self):
+        self.assertEqual(self.found('desk'), [self.item.pk])
+        self.item.title = 'Brass lantern'
+        self.item.save()
+        self.assertEqual(self.found('desk'), [])
+        #prefix matches, like the search box as it is typed
+        self.assertEqual(self.found('lant'), [self.item.pk])
+        pk = self.item.pk
+        self.item.delete()
+        self.assertEqual(self.found('lantern'), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {search.get_backend().table} WHERE rowid = %s', [pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_category_changes_from_the_item(self):
+        self.item.category.add(self.lamps)
+        self.assertEqual(self.found('lamps'), [self.item.pk])
+        self.item.category.remove(self.lamps)
+        self.assertEqual(self.found('lamps'), [])
+        self.item.category.set([self.lamps])
+        self.item.category.clear()
+        self.assertEqual(self.found('lamps'), [])
+
+    def test_category_changes_from_the_category(self):
+        other = make_item(2)
+        self.lamps.item_set.add(self.item, other)
+        self.assertEqual(sorted(self.found('lamps')), [self.item.pk, other.pk])
+        self.lamps.item_set.remove(other)
+        self.assertEqual(self.found('lamps'), [self.item.pk])
+        self.lamps.item_set.clear()
+        self.assertEqual(self.found('lamps'), [])
+
+    def test_category_rename_and_delete(self):
+        self.item.category.add(self.lamps)
+        self.lamps.title = 'Lighting'
+        self.lamps.save()
+        self.assertEqual(self.found('lamps'), [])
+        self.assertEqual(self.found('lighting'), [self.item.pk])
+        self.lamps.delete()
+        self.assertEqual(self.found('lighting'), [])
+
+    def test_title_matches_rank_first(self):
+        described = Item.objects.create(title='Shade', price=10, image='sample.jpg', slug='shade',
+                                        description='Fits the brass lamp')
+        titled = Item.objects.create(title='Brass lamp', price=10, image='sample.jpg', slug='brass-lamp',
+                                     description='A lamp')
+        response = self.client.get('/search/', {'q': 'brass'})
+        self.assertEqual([item.pk for item in response.context['queryset']], [titled.pk, described.pk])
+
+
+class ExportTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.item = make_item(1, price=100)
+        self.orders = []
+        for n, day in enumerate((1, 2, 3)):
+            #23:30 in TIME_ZONE, the exports write it as 18:00 UTC
+            when = timezone.make_aware(datetime(2020, 1, day, 23, 30))
+            order = Order.objects.create(user=self.user, ordered=True, status='in_transit', ordered_date=when,
+                                         order_id=f'order-{n}', total=100 * (n + 1))
+            order.items.add(OrderItem.objects.create(user=self.user, item=self.item, quantity=n + 1, ordered=True))
+            self.orders.append(order)
+        #the open cart is never exported
+        add_item(self.user, self.item)
+
+    def lines(self, kind, fmt, **filters):
+        return list(exports.export_lines(kind, fmt, exports.export_queryset(kind, **filters)))
+
+    def test_csv_header_and_rows(self):
+        lines = self.lines('orders', 'csv')
+        self.assertEqual(lines[0], ','.join(name for name, path in exports.EXPORTS['orders']['columns']) + '\r\n')
+        rows = list(csv.DictReader(lines))
+        self.assertEqual([row['order_id'] for row in rows], ['order-0', 'order-1', 'order-2'])
+        self.assertEqual((rows[2]['user'], rows[2]['total'], rows[2]['coupon']), ('shopper', '300.0', ''))
+
+    def test_jsonl_rows(self):
+        rows = [json.loads(line) for line in self.lines('order-items', 'jsonl')]
+        self.assertEqual([(row['order_id'], row['item'], row['quantity']) for row in rows],
+                         [('order-0', 'Item 1', 1), ('order-1', 'Item 1', 2), ('order-2', 'Item 1', 3)])
+        self.assertEqual(rows[0]['ordered_date'], '2020-01-01T18:00:00Z')
+
+    def test_dates_are_whole_local_days(self):
+        rows = [json.loads(line) for line in self.lines('orders', 'jsonl', date_from=date(2020, 1, 2), date_to=date(2020, 1, 2))]
+        self.assertEqual([row['order_id'] for row in rows], ['order-1'])
+        Order.objects.filter(pk=self.orders[0].pk).update(status='delivered')
+        rows = [json.loads(line) for line in self.lines('orders', 'jsonl', statuses=['delivered'])]
+        self.assertEqual([row['order_id'] for row in rows], ['order-0'])
+
+    def test_streamed_in_chunks_with_one_query(self):
+        lines = exports.export_lines('orders', 'csv', exports.export_queryset('orders'))
+        #the header goes out before the database is read
+        with self.assertNumQueries(0):
+            next(lines)
+        with mock.patch.object(exports, 'EXPORT_CHUNK_SIZE', 2), \
+                mock.patch('django.db.models.query.QuerySet.iterator', autospec=True,
+                           side_effect=models.QuerySet.iterator) as iterator, \
+                self.assertNumQueries(1):
+            lines = exports.export_lines('orders', 'csv', exports.export_queryset('orders'))
+            self.assertEqual(len(list(lines)), 4)
+        self.assertEqual(iterator.call_args[1], {'chunk_size': 2})
+
+    def test_admin_action_streams_a_download(self):
+        admin = get_user_model().objects.create_superuser('staff', 'staff@example.com', 'pass')
+        self.client.force_login(admin)
+        response = self.client.post('/admin/myapp/order/', {
+            'action': 'export_order_items_csv', '_selected_action': [self.orders[0].pk, self.orders[2].pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertRegex(response['Content-Disposition'], r'^attachment; filename="order-items-\d{8}-\d{6}\.csv"$')
+        rows = list(csv.DictReader(line.decode() for line in response.streaming_content))
+        self.assertEqual([(row['order_id'], row['quantity']) for row in rows], [('order-0', '1'), ('order-2', '3')])
+
+    def test_command_writes_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'orders.jsonl')
+            err = StringIO()
+            call_command('export_orders', '--format', 'jsonl', '--output', path, stderr=err)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 3)
+        self.assertIn('Wrote 3 rows', err.getvalue())
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class ServerTimingTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        make_item(1)
+
+    def test_off_by_default(self):
+        self.assertFalse(settings.SERVER_TIMING)
+        self.assertNotIn('Server-Timing', self.client.get('/'))
+
+    @override_settings(SERVER_TIMING=True)
+    def test_reports_the_request_when_on(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        parts = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(sorted(parts), ['db', 'total', 'tpl', 'view'])
+        self.assertIn(f'desc="{len(queries)} queries"', parts['db'])
+        durations = {name: float(part.rsplit('dur=', 1)[1]) for name, part in parts.items()}
+        self.assertLessEqual(durations['view'], durations['total'])
+
+    def test_requests_are_counted_either_way(self):
+        self.addCleanup(instrumentation.reset_stats)
+        with mock.patch.object(instrumentation, 'FLUSH_INTERVAL', 0):
+            #flushes what earlier tests left pending in this process
+            self.client.get('/')
+            instrumentation.reset_stats()
+            self.client.get('/')
+            self.client.get('/')
+        self.assertEqual(instrumentation.get_stats()['home-page']['count'], 2)
+
+
+class BenchTests(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def test_checkout_without_an_open_cart_redirects(self):
+        response = self.client.get('/checkout/')
+        self.assertRedirects(response, '/all-product/', fetch_redirect_response=False)
+        add_item(self.user, make_item(1))
+        self.assertEqual(self.client.get('/checkout/').status_code, 200)
+        #an invalid form goes back to the checkout page too
+        self.assertRedirects(self.client.post('/checkout/', {}), '/checkout/', fetch_redirect_response=False)
+
+    def test_only_2xx_and_3xx_answers_are_timed(self):
+        client = mock.Mock()
+        client.request.side_effect = [(200, 0.1, 5), (302, 0.2, None), (404, 0.3, 2), (500, 0.4, 9), (101, 0.5, 1)]
+        results = {'home': {'samples': [], 'errors': 0, 'queries': []}}
+        with mock.patch('myapp.management.commands.bench.time.monotonic', side_effect=[0] * 5 + [2]):
+            Bench().run_client(client, ['home'], 1, results, mock.MagicMock())
+        self.assertEqual(results['home'], {'samples': [0.1, 0.2], 'errors': 3, 'queries': [5]})
+
+    def test_seed_bench_gives_every_user_an_open_cart(self):
+        call_command('seed_bench', users=3, items=5, orders=4, categories=2, stdout=StringIO())
+        carts = Order.objects.filter(user__username__startswith='bench-user-', ordered=False)
+        self.assertEqual(carts.count(), 3)
+        for cart in carts:
+            line = cart.items.get()
+            self.assertEqual((line.quantity, line.ordered, line.user_id), (1, False, cart.user_id))
+            self.assertEqual(cart.total, line.item.effective_price)
+        self.client.force_login(carts[0].user)
+        self.assertEqual(self.client.get('/checkout/').status_code, 200)
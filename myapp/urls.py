@@ -1,24 +1,30 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
 from . import views
+from .page_cache import cache_shared_page
+from .staticfiles import serve_static
 
 
 urlpatterns = [
-    path('', views.HomeView.as_view(), name='home-page'),
-    path('all-product/', views.AllProductView.as_view(), name='all-product-view'),
-    path('product/<slug>/', views.ItemDetailView.as_view(), name='product-page'),
+    path('', cache_shared_page(views.HomeView.as_view()), name='home-page'),
+    path('all-product/', cache_shared_page(views.AllProductView.as_view()), name='all-product-view'),
+    path('product/<slug>/', cache_shared_page(views.ItemDetailView.as_view()), name='product-page'),
     path('order-summary/', views.OrderSummaryView.as_view(), name='order-summary'),
     path('add-to-cart/<slug>/', views.add_to_cart, name='add-to-cart'),
     path('remove-from-cart/<slug>/', views.remove_from_cart, name='remove-from-cart'),
     path('wishlist/', views.WishlistView.as_view(), name='wishlist-view'),
     path('add-to-wishlist/<slug>/', views.add_to_wishlist, name='add-to-wishlist'),
     path('remove-from-wishlist/<slug>/', views.remove_from_wishlist, name='remove-from-wishlist'),
+    path('wishlist/status/', views.wishlist_status, name='wishlist-status'),
+    path('user/fragments/', views.user_fragments, name='user-fragments'),
+    path('cart/bulk/', views.bulk_update_cart, name='bulk-update-cart'),
     path('remove-single-item-from-cart/<slug>/', views.remove_single_item_from_cart, name='remove-single-item-from-cart'),
     # path('add-single-item-from-cart/<slug>/', views.add_single_item_from_cart, name='add-single-item-from-cart'),
     path('checkout/', views.CheckOutView.as_view(), name='checkout-page'),
     path('payment/<payment_option>/', views.PaymentView.as_view(), name='payment'),
+    path('payment-status/<key>/', views.payment_status, name='payment-status'),
     path('manage-address/', views.manage_address_view, name='manage-address'),
     path('create-address/', views.address_create, name='create-address'),
     path('update-address/<id>/', views.address_update, name='update-address'),
@@ -28,7 +34,8 @@ urlpatterns = [
     path('discount-code/', views.DiscountCodeView.as_view(), name='discount-code'),
     path('remove-code/', views.remove_coupon, name='remove-code'),
     path('check-zipcode/', views.CheckZipcodeView.as_view(), name='check-zipcode'),
-    path('cat/<slug>/', views.item_by_category, name='item-by-category'),
+    path('zipcode/serviceable/', views.zipcode_serviceable, name='zipcode-serviceable'),
+    path('cat/<slug>/', cache_shared_page(views.item_by_category), name='item-by-category'),
     path('refund-request/', views.RequestRefundView.as_view(), name='refund-view'),
     path('my-active-order/', views.MyActiveOrderSummary.as_view(), name='my-active-order'),
     path('cancel-order/<id>/', views.cancel_order, name='cancel-order'),
@@ -36,6 +43,11 @@ urlpatterns = [
     path('accounts/', include('allauth.urls')),
 ]
 
+if settings.SERVE_STATIC:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), serve_static),
+    ]
+
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,19 +1,28 @@
 from django.conf import settings
-from django.db.models import Q
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render, get_object_or_404, redirect, reverse
+from django.template.loader import render_to_string
 from django.views.generic import ListView, DetailView, View
 from django.views.generic.edit import CreateView, UpdateView
 from django.utils import timezone
-from .models import Item, OrderItem, Order, BilingAddress, UserProfile, Payment, WishlistedItem, Wishlish, DiscountCode, CheckZipcode, Category, Refund
+from .models import Item, OrderItem, Order, BilingAddress, UserProfile, Payment, WishlistItem, DiscountCode, CheckZipcode, Category, Refund, PaymentAttempt, InvalidTransition, ACTIVE_ORDER_STATUSES, PAST_ORDER_STATUSES
 from .forms import CheckoutForm, CreateAddressForm, UserProfileForm, DiscountForm, CheckZipcodeForm, RequestRefundForm
+from .search import SearchResults
+from .cart import invalidate_cart_count, add_item, remove_item, remove_single_item, set_quantities, get_open_order, open_lines
+from .payments import enqueue_payment
+from .coupons import apply_coupon, CouponError
+from .zipcodes import is_serviceable
+from . import wishlist
+from .order_history import get_order_history
+from .pagination import KeysetPaginationMixin, QuerySetSource, ORDERINGS, get_ordering, get_page
 
-import random
-import string 
+import json
 
 # Create your views here.
 # def home_page(request):
@@ -29,51 +38,55 @@ import string
 #         return queryset[0]
 #     return None
 
-import stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
-
-def create_order_id():
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
+MAX_BULK_CART_ITEMS = 100
+MAX_WISHLIST_STATUS_IDS = 100
 
 
 def search(request):
-    queryset = Item.objects.all()
-    query = request.GET.get('q')
-    if query:
-        queryset = queryset.filter(
-            Q(title__icontains=query) |
-            Q(category__title__icontains=query)
-        ).distinct()
+    query = request.GET.get('q', '')
+    page_obj = get_page(SearchResults(query, get_ordering(request)), request, 12)
     context = {
-        'queryset': queryset
+        'queryset': page_obj.object_list,
+        'wishlisted': wishlist.wishlisted(request.user, [item.id for item in page_obj.object_list]),
+        'query': query,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages()
     }
     return render(request, 'search.html', context)
 
 
 
-class HomeView(ListView):
+class HomeView(KeysetPaginationMixin, ListView):
     model = Item
     context_object_name = 'object_list'
-    queryset = Item.objects.filter(list_on_frontpage=True)
+    queryset = Item.objects.catalog().filter(list_on_frontpage=True)
     paginate_by = 4
     template_name = "home-page.html"
 
     def get_context_data(self, **kwargs):
         context = super(HomeView, self).get_context_data(**kwargs)
         context['category'] = Category.objects.all()[:5]
+        context['wishlisted'] = wishlist.wishlisted(self.request.user, [item.id for item in context['object_list']])
         return context
 
 
-class AllProductView(ListView):
+class AllProductView(KeysetPaginationMixin, ListView):
     model = Item
+    queryset = Item.objects.catalog()
+    paginate_by = 12
     template_name = "all-product.html"
 
+    def get_context_data(self, **kwargs):
+        context = super(AllProductView, self).get_context_data(**kwargs)
+        context['wishlisted'] = wishlist.wishlisted(self.request.user, [item.id for item in context['object_list']])
+        return context
+
 
 class OrderSummaryView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = Order.objects.select_related('coupon').prefetch_related('items__item').get(user=self.request.user, ordered=False)
             context = {
                 'object': order
             }
@@ -85,42 +98,33 @@ class OrderSummaryView(LoginRequiredMixin, View):
         
 class WishlistView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
-        try:
-            wishlist_qs = Wishlish.objects.get(user=self.request.user, wishlisted=False)
-            context = {
-                'wishlist': wishlist_qs
-            }
-            return render(self.request, 'wishlist.html', context)
-        except ObjectDoesNotExist: 
-            messages.error(self.request, "You have not added anything in wishlist yet")
-            return redirect('/')
+        context = {
+            'wishlist': WishlistItem.objects.filter(user=self.request.user).select_related('item').order_by('-added')
+        }
+        return render(self.request, 'wishlist.html', context)
 
 
 class PreviousOrderSummary(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
-        try:
-            previous_order = Order.objects.filter(user=self.request.user, ordered=True)
-            context = {
-                'object': previous_order,
-            }
-            return render(self.request, 'previous_order.html', context)
-        except ObjectDoesNotExist:
-            messages.error(self.request, "You have not ordered anything yet")
-            return redirect('/')
+        page_obj = get_order_history(self.request, Order.objects.filter(status__in=PAST_ORDER_STATUSES))
+        context = {
+            'object': page_obj.object_list,
+            'page_obj': page_obj,
+            'is_paginated': page_obj.has_other_pages(),
+        }
+        return render(self.request, 'previous_order.html', context)
 
 
 #my order page(currently)
 class MyActiveOrderSummary(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
-        try:
-            my_order = Order.objects.filter(user=self.request.user, ordered=True)
-            context = {
-                'object': my_order,
-            }
-            return render(self.request, 'my_active_order.html', context)
-        except ObjectDoesNotExist:
-            messages.error(self.request, "You have not ordered anything yet")
-            return redirect('/')
+        page_obj = get_order_history(self.request, Order.objects.filter(status__in=ACTIVE_ORDER_STATUSES))
+        context = {
+            'object': page_obj.object_list,
+            'page_obj': page_obj,
+            'is_paginated': page_obj.has_other_pages(),
+        }
+        return render(self.request, 'my_active_order.html', context)
 
 
 class ItemDetailView(DetailView):
@@ -137,7 +141,10 @@ class CheckOutView(View):
     def get(self, *args, **kwargs):
         #form
         form = CheckoutForm()
-        order = Order.objects.get(user=self.request.user, ordered=False)
+        order = Order.objects.select_related('coupon').prefetch_related('items__item').filter(user=self.request.user, ordered=False).first()
+        if order is None:
+            messages.warning(self.request, "You do not have an active order")
+            return redirect('all-product-view')
         context = {
             'form': form,
             'object': order,
@@ -176,31 +183,31 @@ class CheckOutView(View):
                 else:
                     messages.warning(self.request, "Failed to checkout")
                     return redirect('checkout-page')
+            messages.warning(self.request, "Failed to checkout")
+            return redirect('checkout-page')
         except ObjectDoesNotExist: 
             messages.warning(self.request, "You do not have an active order")
             return redirect('all-product-view')
 
 
 def cancel_order(request, id):
-    order = Order.objects.get(user=request.user, ordered=True, id=id)
     try:
-        order.in_transit = False
-        order.shipped = False
-        order.out_for_delivery = False
-        order.delivered = False
-        order.canceled = True
-        order.save()
+        order = Order.objects.get(user=request.user, ordered=True, id=id)
+        order.transition('canceled', user=request.user)
 
         messages.success(request, "Your order has been canceled")
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
     except ObjectDoesNotExist:
         messages.warning(request, "Order does not found")
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
+    except InvalidTransition:
+        messages.warning(request, "This order can not be canceled anymore")
+        return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
 class PaymentView(View):
     def get(self, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
+        order = Order.objects.select_related('coupon').prefetch_related('items__item').get(user=self.request.user, ordered=False)
         if order.billing_address:
             context = {
                 'object': order,
@@ -213,189 +220,109 @@ class PaymentView(View):
     def post(self, *args, **kwargs):
         order = Order.objects.get(user=self.request.user, ordered=False)
         token = self.request.POST.get('stripeToken')
-        #check again on amount line ..stripe doc for INR
-        amount = int(order.get_total()* 100)
-
-
+        #the charge runs in the process_payments worker, the customer waits
+        #on a status page instead of holding this request open
         try:
-            charge = stripe.Charge.create(
-                amount=amount,
-                currency="inr",
-                source=token,
-            )
-            #create the payment
-            payment = Payment()
-            payment.stripe_charge_id = charge['id']
-            payment.user = self.request.user
-            payment.amount = order.get_total()
-            payment.save()
-
-            #assign the payment to the order
-            order_items = order.items.all()
-            order_items.update(ordered=True)
-            for item in order_items:
-                item.save()
-
-            order.ordered = True
-            order.in_transit = True
-            order.payment = payment
-            order.order_id = create_order_id()
-            order.save()
-
-            messages.success(self.request, "Your order has been placed successfully")
-            return redirect('/')
-
-        except stripe.error.CardError as e:
-           body = e.json_body
-           err = body.get('error', {})
-           messages.error(self.request, f"{err.get('message')}")
-           return redirect('/')
-
-        except stripe.error.RateLimitError as e:
-            # Too many requests made to the API too quickly
-            messages.error(self.request, "Rate limit error")
-            return redirect('/')
-            
-
-        except stripe.error.InvalidRequestError as e:
-            # Invalid parameters were supplied to Stripe's API
-            messages.error(self.request, "Invalid request error")
-            return redirect('/')
-            
-
-        except stripe.error.AuthenticationError as e:
-            # Authentication with Stripe's API failed
-            # (maybe you changed API keys recently)
-            messages.error(self.request, "Not authenticated")
-            return redirect('/')
-
-        except stripe.error.APIConnectionError as e:
-            # Network communication with Stripe failed
-            messages.error(self.request, "API connection error")
-            return redirect('/')
+            attempt = enqueue_payment(order, token)
+        except CouponError as e:
+            order.coupon = None
+            order.save(update_fields=['coupon'])
+            order.update_totals()
+            messages.warning(self.request, f"{e}, it has been removed from your order")
+            return redirect('checkout-page')
+        return redirect('payment-status', key=attempt.idempotency_key)
 
-        except stripe.error.StripeError as e:
-            # Display a very generic error to the user, and maybe send
-            # yourself an email
-            messages.error(self.request, "Something went wrong")
-            return redirect('/')
 
-        except Exception as e:
-            # send email to ourself
-            messages.error(self.request, "Something went wrong! we are taking note of it")
-            return redirect('/')
+@login_required
+def payment_status(request, key):
+    attempt = get_object_or_404(PaymentAttempt.objects.select_related('order'), idempotency_key=key, user=request.user)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': attempt.status,
+            'finished': attempt.is_finished(),
+            'error': attempt.error if attempt.status == 'failed' else '',
+        })
+    if attempt.status == 'succeeded':
+        messages.success(request, "Your order has been placed successfully")
+        return redirect('/')
+    if attempt.status == 'failed':
+        messages.error(request, attempt.error or "Something went wrong")
+        return redirect('/')
+    return render(request, 'payment_status.html', {'attempt': attempt})
 
 
 
 @login_required
 def add_to_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(item=item, user=request.user, ordered=False)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        #check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.info(request, "This item was added to your cart.")
-        else:
-            messages.info(request, "This item was added to your cart.")
-            order.items.add(order_item)
-            return redirect('order-summary')
-    else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(user=request.user, ordered_date=ordered_date)
-        order.items.add(order_item)
-        messages.info(request, "This item was added to your cart.")
-        return redirect('order-summary')
+    item = get_object_or_404(Item.objects.only('id'), slug=slug)
+    add_item(request.user, item)
+    messages.info(request, "This item was added to your cart.")
     return redirect('order-summary')
 
 
 @login_required
 def remove_from_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(
-        user=request.user, 
-        ordered=False
-    )
-    if order_qs.exists():
-        order = order_qs[0]
-        #check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item, 
-                user=request.user, 
-                ordered=False
-            )[0]
-            order.items.remove(order_item)
-            messages.info(request, "Removed from your cart.")
-            return redirect('order-summary')
-        else:
-            messages.info(request, "This item was not in your cart.")
-            return redirect('product-page', slug=slug) 
+    item = get_object_or_404(Item.objects.only('id'), slug=slug)
+    if remove_item(request.user, item):
+        messages.info(request, "Removed from your cart.")
+        return redirect('order-summary')
+    if Order.objects.filter(user=request.user, ordered=False).exists():
+        messages.info(request, "This item was not in your cart.")
     else:
         #add a message saying the user doesnt have an order
         messages.info(request, "You do not have an active order.")
-        return redirect('product-page', slug=slug)
+    return redirect('product-page', slug=slug)
 
 
 #remove single item for the cart
 @login_required
 def remove_single_item_from_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(
-        user=request.user, 
-        ordered=False
-    )
-    if order_qs.exists():
-        order = order_qs[0]
-        #check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item, 
-                user=request.user, 
-                ordered=False
-            )[0]
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save() 
-            else: 
-                order.items.remove(order_item)
-            messages.info(request, "This item quantity was updated")
-            return redirect('order-summary')
-        else:
-            messages.info(request, "This item was not in your cart.")
-            return redirect('product-page', slug=slug) 
+    item = get_object_or_404(Item.objects.only('id'), slug=slug)
+    if remove_single_item(request.user, item):
+        messages.info(request, "This item quantity was updated")
+        return redirect('order-summary')
+    if Order.objects.filter(user=request.user, ordered=False).exists():
+        messages.info(request, "This item was not in your cart.")
     else:
         #add a message saying the user doesnt have an order
         messages.info(request, "You do not have an active order.")
-        return redirect('product-page', slug=slug)
+    return redirect('product-page', slug=slug)
 
 
+#add or update many cart lines at once:
+#POST {"items": [{"slug": "...", "quantity": 2}, ...], "replace": false}
+@login_required
+@require_POST
+def bulk_update_cart(request):
+    try:
+        data = json.loads(request.body.decode() or '{}')
+        entries = data.get('items') or []
+        replace = bool(data.get('replace', False))
+        wanted = {}
+        for entry in entries[:MAX_BULK_CART_ITEMS]:
+            wanted[str(entry['slug'])] = int(entry.get('quantity', 1))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({'error': 'Expected {"items": [{"slug": ..., "quantity": ...}]}'}, status=400)
+    if len(entries) > MAX_BULK_CART_ITEMS:
+        return JsonResponse({'error': f'At most {MAX_BULK_CART_ITEMS} items per request'}, status=400)
+
+    items = dict(Item.objects.filter(slug__in=wanted).values_list('slug', 'id'))
+    quantities = {items[slug]: quantity for slug, quantity in wanted.items() if slug in items}
+    order = set_quantities(request.user, quantities, replace=replace) if quantities else get_open_order(request.user)
+    lines = open_lines(request.user).values_list('item__slug', 'quantity')
+    return JsonResponse({
+        'items': [{'slug': slug, 'quantity': quantity} for slug, quantity in lines],
+        'missing': [slug for slug in wanted if slug not in items],
+        'total': order.total if order else 0,
+    })
+
 
 #wishlist-add to wishlist
 @login_required
 def add_to_wishlist(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    wishlist_item, created = WishlistedItem.objects.get_or_create(item=item, user=request.user, wishlisted=False)
-    wishlist_qs = Wishlish.objects.filter(user=request.user, wishlisted=False)
-    if wishlist_qs.exists():
-        wishlist = wishlist_qs[0]
-        #check if the order item is in the order
-        if wishlist.item.filter(item__slug=item.slug).exists():
-            wishlist_item.save()
-            messages.info(request, "This item was added to your wishlist.")
-        else:
-            messages.info(request, "This item was added to your wishlist.")
-            wishlist.item.add(wishlist_item)
-            return redirect('product-page', slug=slug)
-    else:
-        wishlisted_date = timezone.now()
-        wishlist = Wishlish.objects.create(user=request.user, wishlisted_date=wishlisted_date)
-        wishlist.item.add(wishlist_item)
-        messages.info(request, "This item was added to your wishlist.")
-        return redirect('product-page', slug=slug)
+    wishlist.add_item(request.user, item)
+    messages.info(request, "This item was added to your wishlist.")
     return redirect('product-page', slug=slug)
 
 
@@ -403,29 +330,37 @@ def add_to_wishlist(request, slug):
 @login_required
 def remove_from_wishlist(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    wishlist_qs = Wishlish.objects.filter(
-        user=request.user, 
-        wishlisted=False
-    )
-    if wishlist_qs.exists():
-        wishlist = wishlist_qs[0]
-        #check if the order item is in the order
-        if wishlist.item.filter(item__slug=item.slug).exists():
-            wishlist_item = WishlistedItem.objects.filter(
-                item=item, 
-                user=request.user, 
-                wishlisted=False
-            )[0]
-            wishlist.item.remove(wishlist_item)
-            messages.info(request, "Removed from your wishlist.")
-            return redirect('wishlist-view')
-        else:
-            messages.info(request, "This item was not in your wishlist.")
-            return redirect('product-page', slug=slug) 
-    else:
-        #add a message saying the user doesnt have an order
-        messages.info(request, "You do not have an active product in your wishlist.")
-        return redirect('product-page', slug=slug)
+    if wishlist.remove_item(request.user, item):
+        messages.info(request, "Removed from your wishlist.")
+        return redirect('wishlist-view')
+    messages.info(request, "This item was not in your wishlist.")
+    return redirect('product-page', slug=slug)
+
+
+def parse_item_ids(value):
+    return [int(pk) for pk in value.split(',')[:MAX_WISHLIST_STATUS_IDS] if pk.strip().isdigit()]
+
+
+#which of a page of items are wishlisted, ?ids=1,2,3
+def wishlist_status(request):
+    ids = parse_item_ids(request.GET.get('ids', ''))
+    return JsonResponse({'wishlisted': sorted(wishlist.wishlisted(request.user, ids))})
+
+
+#the per-user parts of a page served from the shared page cache: the navbar
+#and which of the page's items (?wishlist=1,2,3) are wishlisted
+@never_cache
+def user_fragments(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'authenticated': False})
+    ids = parse_item_ids(request.GET.get('wishlist', ''))
+    return JsonResponse({
+        'authenticated': True,
+        'fragments': {
+            'navbar-user': render_to_string('navbar_user.html', request=request),
+        },
+        'wishlisted': sorted(wishlist.wishlisted(request.user, ids)),
+    })
 
 
 
@@ -605,15 +540,6 @@ def address_delete(request, id):
     return redirect(reverse('manage-address'))
 
 
-def get_coupon(request, promo_code):
-    try:
-        coupon = DiscountCode.objects.get(promo_code=promo_code)
-        return coupon
-    except ObjectDoesNotExist:
-        messages.warning(request, "Promo code does not exists")
-        return redirect('checkout-page')
-
-
 class DiscountCodeView(View):
     def post(self, *args, **kwargs):
         form = DiscountForm(self.request.POST or None)
@@ -621,54 +547,72 @@ class DiscountCodeView(View):
             try:
                 promo_code = form.cleaned_data.get('promo_code')
                 order = Order.objects.get(user = self.request.user, ordered = False)
-                order.coupon = get_coupon(self.request, promo_code)
-                order.save()
+                apply_coupon(order, promo_code, self.request.user)
                 messages.success(self.request, "Successfully applied coupon")
                 return redirect('checkout-page')
             except ObjectDoesNotExist:
                 messages.warning(self.request, "You do not have any active order")
                 return redirect('checkout-page')
+            except CouponError as e:
+                messages.warning(self.request, str(e))
+                return redirect('checkout-page')
         else:
             messages.warning(self.request, "Promo code does not exists")
             return redirect('checkout-page')
 
-#ToDo
+
 def remove_coupon(request):
+    #detach the code from the cart, the code itself stays
     order = Order.objects.get(user=request.user, ordered=False)
-    order.coupon.delete()
+    order.coupon = None
+    order.save(update_fields=['coupon'])
+    order.update_totals()
     messages.warning(request, "Promo has been removed")
     return redirect('checkout-page')
 
 
 def get_zipcode(request, zipcode):
-    try:
-        checkzip_qs = CheckZipcode.objects.get(zipcode=zipcode)
+    if is_serviceable(zipcode):
         messages.success(request, "This product is available at your location")
         return zipcode
-    except ObjectDoesNotExist:
-        messages.warning(request, "This product is not available at your location")
-        return redirect('/')
+    messages.warning(request, "This product is not available at your location")
+    return redirect('/')
 
 
+#the product page form is sent with GET, a lookup needs no CSRF token and
+#without one the page can come from the shared page cache
 class CheckZipcodeView(View):
+    def get(self, *args, **kwargs):
+        return self.check(self.request.GET)
+
     def post(self, *args, **kwargs):
-        form = CheckZipcodeForm(self.request.POST or None)
+        return self.check(self.request.POST)
+
+    def check(self, data):
+        form = CheckZipcodeForm(data)
         if form.is_valid():
-            try:
-                zipcode = form.cleaned_data.get('zipcode')
-                checkzip_qs = get_zipcode(self.request, zipcode)
-                return redirect('/')
-            except ObjectDoesNotExist:
-                return redirect('/')
+            zipcode = form.cleaned_data.get('zipcode')
+            get_zipcode(self.request, zipcode)
+        return redirect('/')
+
+
+#answered from the in-memory index, used by the product page without a reload
+def zipcode_serviceable(request):
+    zipcode = request.GET.get('zipcode', '')[:20]
+    return JsonResponse({'zipcode': zipcode, 'serviceable': is_serviceable(zipcode)})
 
 
 #filter item by category
 def item_by_category(request, slug):
     category = get_object_or_404(Category, slug=slug)
-    item = Item.objects.filter(category=category)
+    item = Item.objects.catalog().filter(category=category)
+    page_obj = get_page(QuerySetSource(item, ORDERINGS[get_ordering(request)]), request, 12)
     context = {
         'category':category,
-        'items': item
+        'items': page_obj.object_list,
+        'wishlisted': wishlist.wishlisted(request.user, [item.id for item in page_obj.object_list]),
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages()
     }
     return render(request, "item_by_cat.html", context)
 
@@ -689,8 +633,7 @@ class RequestRefundView(View):
             email = form.cleaned_data.get('email')
             try:
                 order = Order.objects.get(order_id=order_id)
-                order.refund_requested = True
-                order.save()
+                order.transition('refund_requested', user=self.request.user if self.request.user.is_authenticated else None)
 
                 #store the refund
                 refund = Refund()
@@ -705,3 +648,6 @@ class RequestRefundView(View):
             except ObjectDoesNotExist:
                 messages.warning(self.request, "This order does not exists")
                 return redirect('refund-view')
+            except InvalidTransition:
+                messages.warning(self.request, "A refund can not be requested for this order")
+                return redirect('refund-view')
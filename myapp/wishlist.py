@@ -0,0 +1,58 @@
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .models import WishlistItem
+
+
+WISHLIST_TIMEOUT = 60 * 60
+
+
+def wishlist_key(user_id):
+    return f'wishlist-ids:{user_id}'
+
+
+def get_wishlist_ids(user):
+    #ids of every item on the user's wishlist, memoized on the user object
+    #for the rest of the request and cached per user until it changes
+    if not user.is_authenticated:
+        return frozenset()
+    if not hasattr(user, '_wishlist_ids'):
+        key = wishlist_key(user.pk)
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(WishlistItem.objects.filter(user=user).values_list('item_id', flat=True))
+            cache.set(key, ids, WISHLIST_TIMEOUT)
+        user._wishlist_ids = ids
+    return user._wishlist_ids
+
+
+def wishlisted(user, item_ids):
+    #the wishlisted subset of a page of item ids, at most one query
+    return get_wishlist_ids(user).intersection(item_ids)
+
+
+def invalidate(user):
+    #clear after commit so a concurrent request can't cache the old ids again
+    if hasattr(user, '_wishlist_ids'):
+        del user._wishlist_ids
+    key = wishlist_key(user.pk)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def add_item(user, item):
+    #returns False when the item was already on the wishlist
+    try:
+        with transaction.atomic():
+            WishlistItem.objects.create(user=user, item=item)
+    except IntegrityError:
+        return False
+    invalidate(user)
+    return True
+
+
+def remove_item(user, item):
+    #returns False when the item wasn't on the wishlist
+    removed = WishlistItem.objects.filter(user=user, item=item).delete()[0]
+    if removed:
+        invalidate(user)
+    return bool(removed)
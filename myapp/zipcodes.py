@@ -0,0 +1,138 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .models import CheckZipcode
+from .snapshots import VersionedSnapshot
+
+
+#a CheckZipcode row is one of
+#  560001           exact zipcode
+#  5600*            every zipcode starting with 5600
+#  560001-560099    inclusive numeric range, both ends the same length
+VERSION_KEY = 'zipcode-index-version'
+#how often a process asks the cache whether another process changed the zipcodes
+CHECK_INTERVAL = 5
+LOAD_BATCH_SIZE = 10000
+
+
+def normalize(zipcode):
+    return ''.join((zipcode or '').split()).upper()
+
+
+def encode(zipcode):
+    #numeric zipcodes become one int, the length keeps leading zeros apart
+    #("012" and "12" differ). None for anything that isn't all digits
+    if zipcode.isdigit() and len(zipcode) <= 12:
+        return len(zipcode) * 10 ** 12 + int(zipcode)
+    return None
+
+
+def parse_rule(value):
+    #returns ('exact', code), ('prefix', prefix) or ('range', (start, end)),
+    #None for a value that isn't a valid rule
+    value = normalize(value)
+    if not value:
+        return None
+    if value.endswith('*'):
+        prefix = value[:-1]
+        return ('prefix', prefix) if prefix and '*' not in prefix else None
+    if '-' in value:
+        start, _, end = value.partition('-')
+        if start.isdigit() and end.isdigit() and len(start) == len(end) and start <= end:
+            return ('range', (encode(start), encode(end)))
+        return None
+    return ('exact', value)
+
+
+class ZipcodeIndex:
+    #numeric zipcodes live in a sorted array of 64 bit ints (8 bytes each,
+    #binary searched), ranges are merged into sorted start/end arrays
+    def __init__(self, values):
+        numbers = set()
+        others = set()
+        prefixes = set()
+        ranges = []
+        for value in values:
+            rule = parse_rule(value)
+            if rule is None:
+                continue
+            kind, data = rule
+            if kind == 'exact':
+                key = encode(data)
+                if key is None:
+                    others.add(data)
+                else:
+                    numbers.add(key)
+            elif kind == 'prefix':
+                prefixes.add(data)
+            else:
+                ranges.append(data)
+        self.numbers = array('q', sorted(numbers))
+        self.others = frozenset(others)
+        self.prefixes = frozenset(prefixes)
+        self.prefix_lengths = sorted({len(prefix) for prefix in prefixes})
+        self.starts = array('q')
+        self.ends = array('q')
+        for start, end in sorted(ranges):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.numbers) + len(self.others) + len(self.prefixes) + len(self.starts)
+
+    def __contains__(self, zipcode):
+        zipcode = normalize(zipcode)
+        #a shopper's zipcode is letters and digits only, "5600*" or
+        #"560001-560099" typed in the form must not match as a rule
+        if not zipcode.isalnum():
+            return False
+        key = encode(zipcode)
+        if key is None:
+            if zipcode in self.others:
+                return True
+        else:
+            i = bisect_left(self.numbers, key)
+            if i < len(self.numbers) and self.numbers[i] == key:
+                return True
+            i = bisect_right(self.starts, key) - 1
+            if i >= 0 and key <= self.ends[i]:
+                return True
+        for length in self.prefix_lengths:
+            if length > len(zipcode):
+                break
+            if zipcode[:length] in self.prefixes:
+                return True
+        return False
+
+
+def load_values():
+    #walk the table by primary key so a huge import never sits in one result set
+    last_id = 0
+    while True:
+        rows = list(
+            CheckZipcode.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'zipcode')[:LOAD_BATCH_SIZE]
+        )
+        if not rows:
+            break
+        for pk, zipcode in rows:
+            yield zipcode
+        last_id = rows[-1][0]
+
+
+_snapshot = VersionedSnapshot(VERSION_KEY, lambda: ZipcodeIndex(load_values()), CHECK_INTERVAL)
+
+
+def get_index():
+    return _snapshot.get()
+
+
+def invalidate():
+    _snapshot.invalidate()
+
+
+def is_serviceable(zipcode):
+    return zipcode in get_index()